@@ -1,5 +1,6 @@
 import re
 import json
+import copy
 
 from math import floor
 
@@ -110,7 +111,10 @@ def as_querybuilder_fieldtype(field):
 
 @register.filter
 def as_querybuilder(form, request):
-    last_search = request.session.get('last_search')
+    from yats.shortcuts import get_last_search
+
+    # the rules are stripped for the builder, not in the remembered search
+    last_search = copy.deepcopy(get_last_search(request)[0])
     if last_search:
         if 'valid' in last_search:
             del last_search['valid']
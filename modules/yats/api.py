@@ -3,8 +3,10 @@ from django.utils.translation import gettext as _
 from django.apps import apps
 from django.conf import settings
 from django.http import QueryDict
-from yats.shortcuts import get_ticket_model, modulePathToModuleName, touch_ticket, remember_changes, mail_ticket, jabber_ticket, signal_ticket, check_references
+from yats.fieldschema import build_fields, get_field_defs, get_field_map, option_column
+from yats.shortcuts import get_ticket_model, touch_ticket, remember_changes, mail_ticket, jabber_ticket, signal_ticket, check_references
 from rpc4django import rpcmethod
+from rpc4django.rpcdispatcher import dispatcher
 from xmlrpc.client import Fault
 import datetime
 
@@ -47,44 +49,14 @@ def fieldNameToTracName(field):
 
     return field
 
-def buildFields(exclude_list):
-    TracFields = []
-    TicketFields = {}
-    tickets = get_ticket_model()
-    t = tickets()
-    for field in t._meta.fields:
-        if field.name in exclude_list:
-            continue
-
-        if type(field).__name__ == 'ForeignKey':
-            typename = 'select'
-            options = []
-            opts = apps.get_model(modulePathToModuleName(field.rel.to.__module__), field.rel.to.__name__).objects.all()
-            for opt in opts:
-                options.append(str(opt))
+def fieldTypeToTracType(typename):
+    if typename == 'TextField':
+        return 'textarea'
+    # TODO: bool and boolnull and choices
+    return 'text'
 
-            TicketFields[field.name] = (modulePathToModuleName(field.rel.to.__module__), field.rel.to.__name__)
-
-        else:
-            if field.__class__.__name__ == 'TextField':
-                typename = 'textarea'
-            else:
-                typename = 'text'
-
-            # TODO: bool and boolnull and choices
-            options = None
-
-            TicketFields[field.name] = None
-
-        value = {
-                'name': field.name,
-                'label': fieldNameToTracName(field.name),
-                'type': typename
-               }
-        if options:
-            value['options'] = options
-        TracFields.append(value)
-    return (TracFields, TicketFields)
+def buildFields(exclude_list):
+    return (build_fields(exclude_list, fieldNameToTracName, fieldTypeToTracType), get_field_defs())
 
 def TracNameTofieldName(field):
     if field == 'time created':
@@ -105,7 +77,8 @@ def add_search_terms(field_defs, parts, compare, results):
     if field_defs[parts[0]] is None:
         results['%s%s' % (parts[0], compare)] = parts[1]
     else:
-        results[parts[0]] = apps.get_model(field_defs[parts[0]][0], field_defs[parts[0]][1]).objects.get(name=parts[1]).pk
+        model = apps.get_model(field_defs[parts[0]][0], field_defs[parts[0]][1])
+        results[parts[0]] = model.objects.get(**{option_column(model) or 'name': parts[1]}).pk
 
 def search_terms(q):
     """
@@ -114,7 +87,8 @@ def search_terms(q):
     quotes.
     """
     results = {}
-    fields = buildFields([])[1]
+    # only the field map, the option lists are not needed here
+    fields = get_field_defs()
     elements = q.split('&')
     for element in elements:
         if '<=' in element:
@@ -208,22 +182,20 @@ def query(*args, **kwargs):
     ids = tickets.values_list('id', flat=True)
     return list(ids)
 
-@rpcmethod(name='ticket.get', signature=['array', 'int'], login_required=True)
-def get(id, **kwargs):
-    """
-    array ticket.get(int id)
-    """
+def getExcludeList(request):
     exclude_list = FIELD_EXCLUDE_LIST
-    # exclude_list.pop(exclude_list.index('id'))
-
-    request = kwargs['request']
-    checkImpersonate(request)
-
     if not request.user.is_staff:
         exclude_list = list(set(exclude_list + settings.TICKET_NON_PUBLIC_FIELDS))
+    return exclude_list
 
-    ticket = get_ticket_model().objects.get(pk=id)
+def getTicketQuery(exclude_list):
+    """
+    tickets with the shown foreign keys joined, str() of them needs no extra query
+    """
+    related = [name for name, typename, model in get_field_map() if model and name not in exclude_list]
+    return get_ticket_model().objects.select_related(*related)
 
+def ticketToTrac(ticket, exclude_list):
     attributes = {}
     for field in ticket._meta.fields:
         if field.name in exclude_list:
@@ -238,7 +210,42 @@ def get(id, **kwargs):
 
         else:
             attributes[fieldNameToTracName(field.name)] = str(getattr(ticket, field.name))
-    return [id, ticket.c_date, ticket.last_action_date, attributes]
+    return [ticket.pk, ticket.c_date, ticket.last_action_date, attributes]
+
+@rpcmethod(name='ticket.get', signature=['array', 'int'], login_required=True)
+def get(id, **kwargs):
+    """
+    array ticket.get(int id)
+    """
+    request = kwargs['request']
+    checkImpersonate(request)
+
+    exclude_list = getExcludeList(request)
+    ticket = getTicketQuery(exclude_list).get(pk=id)
+    return ticketToTrac(ticket, exclude_list)
+
+@rpcmethod(name='ticket.getMany', signature=['array', 'array'], login_required=True)
+def getMany(ids, **kwargs):
+    """
+    array ticket.getMany(array ids)
+    returns an array of ticket.get results in the order of ids, unknown ids are left out;
+    at most API_GET_MANY_LIMIT (default 1000) ids per call
+    """
+    request = kwargs['request']
+    checkImpersonate(request)
+
+    limit = getattr(settings, 'API_GET_MANY_LIMIT', 1000)
+    if len(ids) > limit:
+        raise Fault(APPLICATION_ERROR, 'ticket.getMany takes at most %s ids' % limit)
+
+    exclude_list = getExcludeList(request)
+    ids = [int(id) for id in ids]
+    tickets = {}
+    # some databases limit the number of query parameters
+    for i in range(0, len(ids), 500):
+        for ticket in getTicketQuery(exclude_list).filter(pk__in=ids[i:i + 500]):
+            tickets[ticket.pk] = ticket
+    return [ticketToTrac(tickets[id], exclude_list) for id in ids if id in tickets]
 
 @rpcmethod(name='ticket.update', signature=['array', 'int', 'string', 'struct', 'bool'], login_required=True)
 def update(id, comment, attributes={}, notify=False, **kwargs):
@@ -294,6 +301,46 @@ def update(id, comment, attributes={}, notify=False, **kwargs):
 
     return get(id, **kwargs)
 
+def rpcAllowed(request, method):
+    """
+    the checks rpc4django does for a single call
+    """
+    if method.permission is not None:
+        return request.user.has_perm(method.permission)
+    if method.login_required:
+        return request.user.is_authenticated
+    return True
+
+def multicall(calls, **kwargs):
+    """
+    array system.multicall(array calls)
+    calls is an array of structs {'methodName': string, 'params': array}, returns an array
+    with [result] or a fault struct {'faultCode': int, 'faultString': string} for each call
+    """
+    request = kwargs['request']
+    results = []
+    for call in calls:
+        try:
+            name = call['methodName']
+            if name == 'system.multicall':
+                raise Fault(APPLICATION_ERROR, 'system.multicall can not be nested')
+            method = dispatcher.rpcmethods.get(name)
+            if method is None:
+                raise Fault(-32601, 'method "%s" is not supported' % name)
+            if not rpcAllowed(request, method):
+                raise Fault(APPLICATION_ERROR, 'permission denied for %s' % name)
+            results.append([dispatcher.xmlrpcdispatcher._dispatch(name, tuple(call.get('params', [])), request=request)])
+        except Fault as e:
+            results.append({'faultCode': e.faultCode, 'faultString': e.faultString})
+        except Exception as e:
+            results.append({'faultCode': APPLICATION_ERROR, 'faultString': str(e) or e.__class__.__name__})
+    return results
+
+# the multicall of rpc4django runs the calls without their login and permission checks
+# and returns errors as strings, replace it
+dispatcher.rpcmethods.pop('system.multicall', None)
+rpcmethod(name='system.multicall', signature=['array', 'array'])(multicall)
+
 @rpcmethod(name='ticket.create', signature=['array', 'struct', 'bool'], login_required=True)
 def create(attributes={}, notify=True, **kwargs):
     """
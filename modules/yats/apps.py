@@ -0,0 +1,9 @@
+from django.apps import AppConfig
+
+
+class YatsConfig(AppConfig):
+    name = 'yats'
+
+    def ready(self):
+        from yats.models import connect_cache_invalidation
+        connect_cache_invalidation()
@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+"""
+content addressed store for ticket and doc attachments
+
+every distinct content is stored once as blobs/<aa>/<bb>/<sha256>.dat (preview
+next to it as .preview), tickets_files and docs_files reference it through
+.blob, file_blobs.refcount counts the referencing rows.
+files uploaded before the blob store have no blob and stay at <id>.dat, placed
+by FILE_UPLOAD_LAYOUT, until manage.py dedupe_files moves them. once
+manage.py migrate_file_layout moved all of them into that layout it leaves a
+marker file, from then on their paths are not looked up on disk any more.
+"""
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils.module_loading import import_string
+
+from yats.models import file_blobs
+from yats.uploadhandler import hash_upload, store_uploaded_file
+
+import hashlib
+import os
+import re
+import shutil
+
+
+def get_upload_folder():
+    return str(settings.FILE_UPLOAD_PATH)
+
+
+def get_blob_path(sha256, ext='dat'):
+    return os.path.join(get_upload_folder(), 'blobs', sha256[:2], sha256[2:4], '%s.%s' % (sha256, ext))
+
+
+class FlatLayout(object):
+    """
+    <folder>/<name>, the layout before FILE_UPLOAD_LAYOUT existed
+    """
+    def get_path(self, folder, name):
+        return os.path.join(folder, name)
+
+    def iter_files(self, folder):
+        if not os.path.isdir(folder):
+            return
+        for entry in os.scandir(folder):
+            if entry.is_file() and LEGACY_NAME.match(entry.name):
+                yield entry.name
+
+
+class ShardedLayout(object):
+    """
+    <folder>/<aa>/<bb>/<name> with aa and bb taken from md5(<id>), at most 256 entries per directory level
+    """
+    def get_path(self, folder, name):
+        digest = hashlib.md5(name.split('.')[0].encode('utf-8')).hexdigest()
+        return os.path.join(folder, digest[:2], digest[2:4], name)
+
+    def iter_files(self, folder):
+        if not os.path.isdir(folder):
+            return
+        for first in os.scandir(folder):
+            if not first.is_dir() or not SHARD_NAME.match(first.name):
+                continue
+            for second in os.scandir(first.path):
+                if not second.is_dir() or not SHARD_NAME.match(second.name):
+                    continue
+                for entry in os.scandir(second.path):
+                    if entry.is_file() and LEGACY_NAME.match(entry.name):
+                        yield entry.name
+
+
+LEGACY_NAME = re.compile(r'^\d+\.(dat|preview)$')
+SHARD_NAME = re.compile(r'^[0-9a-f]{2}$')
+LAYOUTS = ['yats.blobstore.ShardedLayout', 'yats.blobstore.FlatLayout']
+_layouts = {}
+_settled = {}
+
+
+def get_layout_name():
+    if hasattr(settings, 'FILE_UPLOAD_LAYOUT'):
+        return settings.FILE_UPLOAD_LAYOUT
+    return 'yats.blobstore.FlatLayout'
+
+
+def get_layouts():
+    """
+    configured layout first, the others are only looked at for files not moved yet
+    """
+    primary = get_layout_name()
+    if primary not in _layouts:
+        _layouts[primary] = [import_string(path)() for path in [primary] + [path for path in LAYOUTS if path != primary]]
+    return _layouts[primary]
+
+
+def get_layout_marker():
+    return os.path.join(get_upload_folder(), 'layout')
+
+
+def set_layout_settled():
+    """
+    called by migrate_file_layout once no file is left in another layout
+    """
+    marker = get_layout_marker()
+    with open('%s.part' % marker, 'w') as fo:
+        fo.write(get_layout_name())
+    os.replace('%s.part' % marker, marker)
+
+
+def layout_settled():
+    """
+    True if all legacy files are in the configured layout, the marker is read once per process
+    """
+    primary = get_layout_name()
+    if primary not in _settled:
+        try:
+            with open(get_layout_marker()) as fo:
+                _settled[primary] = fo.read().strip() == primary
+        except OSError:
+            _settled[primary] = False
+    return _settled[primary]
+
+
+def get_legacy_folders():
+    return [get_upload_folder(), os.path.join(get_upload_folder(), 'docs')]
+
+
+def get_legacy_path(f, ext='dat'):
+    if f._meta.model_name == 'docs_files':
+        folder = os.path.join(get_upload_folder(), 'docs')
+    else:
+        folder = get_upload_folder()
+
+    layouts = get_layouts()
+    if layout_settled():
+        return layouts[0].get_path(folder, '%s.%s' % (f.pk, ext))
+    # the preview lives where its .dat lives
+    for layout in layouts:
+        if os.path.isfile(layout.get_path(folder, '%s.dat' % f.pk)):
+            return layout.get_path(folder, '%s.%s' % (f.pk, ext))
+    return layouts[0].get_path(folder, '%s.%s' % (f.pk, ext))
+
+
+def get_file_path(f, ext='dat'):
+    """
+    path of the content (ext='dat') or preview (ext='preview') of a tickets_files or docs_files row
+    """
+    if f.blob_id:
+        return get_blob_path(f.blob_id, ext)
+    return get_legacy_path(f, ext)
+
+
+def add_blob(upload):
+    """
+    stores the upload unless the same content is already known, returns the blob with one more reference.
+    call it inside the transaction.atomic() that saves the referencing row, a failed save then takes
+    the reference back with it.
+    """
+    from yats.virusscan import virus_scan_enabled, queue_scan, SCAN_PENDING, SCAN_CLEAN, SCAN_INFECTED
+
+    hash_upload(upload)
+    # quarantined until scanned
+    scan_state = SCAN_PENDING if virus_scan_enabled() else SCAN_CLEAN
+    with transaction.atomic():
+        blob, created = file_blobs.objects.select_for_update().get_or_create(sha256=upload.sha256, defaults={'md5': upload.hash, 'size': upload.size, 'scan_state': scan_state})
+        path = get_blob_path(blob.sha256)
+        if created or not os.path.isfile(path):
+            store_uploaded_file(upload, path)
+            # content found infected before, it gets the same treatment again
+            if blob.scan_state == SCAN_INFECTED:
+                blob.scan_state = scan_state
+                file_blobs.objects.filter(pk=blob.pk).update(scan_state=scan_state)
+        file_blobs.objects.filter(pk=blob.pk).update(refcount=F('refcount') + 1)
+        if blob.scan_state == SCAN_PENDING:
+            queue_scan(blob.sha256)
+    return blob
+
+
+def release_blob(sha256):
+    with transaction.atomic():
+        file_blobs.objects.filter(pk=sha256).update(refcount=F('refcount') - 1)
+        deleted, _ = file_blobs.objects.filter(pk=sha256, refcount__lte=0).delete()
+        if deleted:
+            transaction.on_commit(lambda: unlink_blob(sha256))
+
+
+def unlink_blob(sha256):
+    # uploaded again meanwhile
+    if file_blobs.objects.filter(pk=sha256).exists():
+        return
+    remove_blob_files(sha256)
+
+
+def remove_blob_files(sha256):
+    """
+    content, preview and the thumbnails of both
+    """
+    from yats.shortcuts import remove_thumbnails
+
+    for ext in ('dat', 'preview'):
+        path = get_blob_path(sha256, ext)
+        remove_thumbnails(path)
+        if os.path.isfile(path):
+            os.unlink(path)
+
+
+def link_or_copy(src, dest):
+    """
+    dest gets the content of src without a window in which it is incomplete
+    """
+    folder = os.path.dirname(dest)
+    if not os.path.exists(folder):
+        os.makedirs(folder)
+    try:
+        os.link(src, dest)
+    except OSError:
+        shutil.copyfile(src, '%s.part' % dest)
+        os.replace('%s.part' % dest, dest)
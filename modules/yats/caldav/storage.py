@@ -8,8 +8,8 @@ from datetime import datetime
 from contextlib import contextmanager
 from radicale import ical
 
-from yats.shortcuts import get_ticket_model, build_ticket_search_ext, touch_ticket, remember_changes, mail_ticket, jabber_ticket, check_references, add_history, mail_comment, jabber_comment
-from yats.models import tickets_reports, UserProfile, get_flow_end, tickets_comments, ticket_resolution, get_default_resolution, convertPrio
+from yats.shortcuts import get_user_organisation, get_ticket_model, build_ticket_search_ext, touch_ticket, remember_changes, mail_ticket, jabber_ticket, check_references, add_history, mail_comment, jabber_comment, build_ical_todo
+from yats.models import tickets_reports, get_flow_end, tickets_comments, ticket_resolution, get_default_resolution, convertPrio
 from yats.forms import SimpleTickets
 
 from django.contrib.auth.models import AnonymousUser, User
@@ -292,7 +292,7 @@ class Collection(ical.Collection):
         user = path.split('/')[0]
         request = FakeRequest()
         request.user = User.objects.get(username=user)
-        request.organisation = UserProfile.objects.get(user=request.user).organisation
+        request.organisation = get_user_organisation(request.user)
         return request
 
     @classmethod
@@ -306,30 +306,4 @@ class Collection(ical.Collection):
 
     @classmethod
     def _itemToICal(cls, item):
-        cal = vobject.iCalendar()
-        cal.add('vtodo')
-        cal.vtodo.add('summary').value = item.caption
-        cal.vtodo.add('uid').value = str(item.uuid)
-        cal.vtodo.add('created').value = item.c_date
-        if item.closed:
-            cal.vtodo.add('status').value = 'COMPLETED'
-        if item.priority:
-            cal.vtodo.add('priority').value = str(item.priority.caldav)
-        else:
-            cal.vtodo.add('priority').value = '0'
-        if item.description:
-            cal.vtodo.add('description').value = item.description
-        if item.show_start:
-            # cal.vtodo.add('dstart').value = item.show_start
-            cal.vtodo.add('due').value = item.show_start
-            cal.vtodo.add('valarm')
-            cal.vtodo.valarm.add('uuid').value = '%s-%s' % (str(item.uuid), item.pk)
-            cal.vtodo.valarm.add('x-wr-alarmuid').value = '%s-%s' % (str(item.uuid), item.pk)
-            cal.vtodo.valarm.add('action').value = 'DISPLAY'
-            # cal.vtodo.valarm.add('x-apple-proximity').value = 'DEPART'
-            cal.vtodo.valarm.add('description').value = 'Erinnerung an ein Ereignis'
-            # cal.vtodo.valarm.add('trigger').value =
-            # TRIGGER;VALUE=DATE-TIME:20180821T200000Z
-
-        cal.vtodo.add('x-radicale-name').value = '%s.ics' % str(item.uuid)
-        return cal.serialize()
+        return build_ical_todo(item).serialize()
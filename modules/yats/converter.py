@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+"""
+document -> pdf conversion with a long running headless libreoffice
+
+every process (e.g. each preview worker) keeps one soffice instance and talks
+to it over a uno pipe, instead of paying the libreoffice startup for every
+file. a conversion running longer than OFFICE_CONVERTER_TIMEOUT kills the
+instance, the next conversion starts a fresh one; after OFFICE_CONVERTER_MAX_JOBS
+conversions the instance is recycled as well.
+needs the python uno bindings (debian: python3-uno), without them
+yats.shortcuts.convertOfficeTpPDF spawns libreoffice per file as before.
+"""
+from django.conf import settings
+
+import atexit
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+
+try:
+    import uno
+    from com.sun.star.beans import PropertyValue
+except ImportError:
+    uno = None
+
+# same filters as --infilter of the command line conversion
+INPUT_FILTERS = [
+    ('html', 'HTML'),
+    ('text/', 'Text'),
+    ('json', 'Text'),
+]
+
+PDF_FILTERS = [
+    ('com.sun.star.sheet.SpreadsheetDocument', 'calc_pdf_Export'),
+    ('com.sun.star.presentation.PresentationDocument', 'impress_pdf_Export'),
+    ('com.sun.star.drawing.DrawingDocument', 'draw_pdf_Export'),
+    ('com.sun.star.text.WebDocument', 'writer_web_pdf_Export'),
+]
+
+_converter = None
+_lock = threading.Lock()
+
+
+def get_setting(name, default):
+    if hasattr(settings, name):
+        return getattr(settings, name)
+    return default
+
+
+class ConverterError(Exception):
+    pass
+
+
+def properties(values):
+    result = []
+    for name, value in values.items():
+        prop = PropertyValue()
+        prop.Name = name
+        prop.Value = value
+        result.append(prop)
+    return tuple(result)
+
+
+def get_input_filter(mimetype):
+    if mimetype:
+        for key, name in INPUT_FILTERS:
+            # text/ not text: vnd.oasis.opendocument.text is no plain text
+            if key in mimetype.lower():
+                return name
+    return None
+
+
+def get_pdf_filter(doc):
+    for service, name in PDF_FILTERS:
+        if doc.supportsService(service):
+            return name
+    return 'writer_pdf_Export'
+
+
+class OfficeConverter(object):
+    def __init__(self, command=None, timeout=None, max_jobs=None):
+        self.command = command or get_setting('OFFICE_CONVERTER_COMMAND', '/usr/bin/soffice')
+        self.timeout = timeout or get_setting('OFFICE_CONVERTER_TIMEOUT', 120)
+        self.max_jobs = max_jobs or get_setting('OFFICE_CONVERTER_MAX_JOBS', 200)
+        self.pipe = 'yats_%s_%s' % (os.getpid(), id(self))
+        self.process = None
+        self.desktop = None
+        self.profile = None
+        self.jobs = 0
+        self.lock = threading.Lock()
+
+    def alive(self):
+        return self.process is not None and self.process.poll() is None
+
+    def start(self):
+        # own profile: instances do not lock each other and need no home directory
+        self.profile = tempfile.mkdtemp(prefix='yats-office-')
+        self.process = subprocess.Popen([
+            self.command, '--headless', '--invisible', '--nologo', '--nodefault', '--norestore', '--nolockcheck',
+            '-env:UserInstallation=%s' % uno.systemPathToFileUrl(self.profile),
+            '--accept=pipe,name=%s;urp;StarOffice.ComponentContext' % self.pipe,
+        ], stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+        local = uno.getComponentContext()
+        resolver = local.ServiceManager.createInstanceWithContext('com.sun.star.bridge.UnoUrlResolver', local)
+        deadline = time.time() + self.timeout
+        while True:
+            try:
+                context = resolver.resolve('uno:pipe,name=%s;urp;StarOffice.ComponentContext' % self.pipe)
+                break
+            except Exception:
+                if not self.alive() or time.time() > deadline:
+                    self.stop()
+                    raise ConverterError('libreoffice (%s) did not start' % self.command)
+                time.sleep(0.25)
+        self.desktop = context.ServiceManager.createInstanceWithContext('com.sun.star.frame.Desktop', context)
+        self.jobs = 0
+
+    def stop(self):
+        if self.desktop is not None and self.alive():
+            try:
+                self.desktop.terminate()
+                self.process.wait(5)
+            except Exception:
+                pass
+        if self.process is not None and self.process.poll() is None:
+            self.process.kill()
+            self.process.wait()
+        self.process = None
+        self.desktop = None
+        if self.profile:
+            shutil.rmtree(self.profile, ignore_errors=True)
+            self.profile = None
+
+    def convert(self, src, dest, mimetype=None):
+        with self.lock:
+            if not self.alive() or self.jobs >= self.max_jobs:
+                self.stop()
+                self.start()
+            self.jobs += 1
+
+            result = {}
+
+            def run():
+                try:
+                    self.store_pdf(src, dest, mimetype)
+                except Exception as e:
+                    result['error'] = e
+
+            worker = threading.Thread(target=run, daemon=True)
+            worker.start()
+            worker.join(self.timeout)
+            if worker.is_alive():
+                # the blocked uno call returns with an error once soffice is gone
+                self.stop()
+                raise ConverterError('conversion of %s took longer than %ss' % (src, self.timeout))
+            if 'error' in result:
+                if not self.alive():
+                    self.stop()
+                raise result['error']
+        return dest
+
+    def store_pdf(self, src, dest, mimetype):
+        load = {'Hidden': True, 'ReadOnly': True}
+        input_filter = get_input_filter(mimetype)
+        if input_filter:
+            load['FilterName'] = input_filter
+        doc = self.desktop.loadComponentFromURL(uno.systemPathToFileUrl(os.path.abspath(src)), '_blank', 0, properties(load))
+        if doc is None:
+            raise ConverterError('libreoffice could not load %s' % src)
+        try:
+            doc.storeToURL(uno.systemPathToFileUrl(os.path.abspath(dest)), properties({'FilterName': get_pdf_filter(doc)}))
+        finally:
+            doc.close(True)
+
+
+def get_office_converter():
+    """
+    converter of this process, None if uno is missing or OFFICE_CONVERTER = False
+    """
+    global _converter
+    if uno is None or not get_setting('OFFICE_CONVERTER', True):
+        return None
+    with _lock:
+        if _converter is None:
+            _converter = OfficeConverter()
+            atexit.register(_converter.stop)
+    return _converter
+
+
+def stop_office_converter():
+    """
+    stops the soffice of this process, for processes leaving through os._exit without atexit (forked pool workers)
+    """
+    with _lock:
+        if _converter is not None:
+            _converter.stop()
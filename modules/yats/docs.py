@@ -1,19 +1,23 @@
 # -*- coding: utf-8 -*-
 from django.conf import settings
 from django.contrib.auth.decorators import login_required
-from django.http.response import HttpResponseRedirect, StreamingHttpResponse, HttpResponse
+from django.http.response import HttpResponseRedirect, HttpResponse
 from django.shortcuts import render
 from django.utils.encoding import smart_str
 from django.contrib import messages
 from django.utils.translation import gettext as _
 from django.core.paginator import Paginator, PageNotAnInteger, EmptyPage
 from django.shortcuts import get_object_or_404
+from django.db import transaction
+from django.db.models import OuterRef, Subquery
 from yats.models import docs, docs_files, tickets_comments
 from yats.forms import DocsForm, UploadFileForm
-from yats.shortcuts import resize_image, add_breadcrumbs, get_ticket_model, convertPDFtoImg, convertOfficeTpPDF, isPreviewable
+from yats.shortcuts import thumbnail_response, add_breadcrumbs, get_ticket_model, needsPreview, queue_preview, preview_pending_response
+from yats.blobstore import add_blob, get_file_path
+from yats.virusscan import quarantine_response
+from yats.request import streamRanges, pageETag, conditionalPage, setPageValidators
 import re
 import os
-import io
 
 def docs_search(request):
     documents = docs.objects.filter(active_record=True)
@@ -47,6 +51,18 @@ def docs_new(request):
 
 @login_required
 def docs_action(request, mode, docid):
+    etag = last_modified = None
+    if mode == 'view' and request.method in ('GET', 'HEAD'):
+        row = docs.objects.filter(pk=docid).annotate(
+            last_file=Subquery(docs_files.objects.filter(doc=OuterRef('pk')).order_by('-u_date').values('u_date')[:1]),
+        ).values_list('u_date', 'last_file').first()
+        if row:
+            etag = pageETag(request, mode, docid, *row)
+            last_modified = max(filter(None, row))
+            response = conditionalPage(request, etag, last_modified)
+            if response:
+                return response
+
     doc = docs.objects.get(pk=docid)
     if mode == 'view':
         form = DocsForm(user=request.user, instance=doc, view_only=True)
@@ -64,7 +80,8 @@ def docs_action(request, mode, docid):
             # If page is out of range (e.g. 9999), deliver last page of results.
             files_lines = paginator.page(paginator.num_pages)
 
-        return render(request, 'docs/view.html', {'layout': 'horizontal', 'form': form, 'doc': doc, 'files': files_lines})
+        response = render(request, 'docs/view.html', {'layout': 'horizontal', 'form': form, 'doc': doc, 'files': files_lines})
+        return setPageValidators(response, etag, last_modified)
 
     elif mode == 'edit':
         if request.method == 'POST':
@@ -110,25 +127,28 @@ def docs_action(request, mode, docid):
 
     elif mode == 'download':
         fileid = request.GET.get('file', -1)
-        file_data = docs_files.objects.get(id=fileid, doc=doc)
-        src = '%s%s.dat' % (get_doc_files_folder(), fileid)
+        file_data = docs_files.objects.select_related('blob').get(id=fileid, doc=doc)
+        response = quarantine_response(file_data)
+        if response:
+            return response
+        src = get_file_path(file_data)
         content_type = file_data.content_type
-        if request.GET.get('preview') == 'yes' and os.path.isfile('%s%s.preview' % (get_doc_files_folder(), fileid)):
-            src = '%s%s.preview' % (get_doc_files_folder(), fileid)
+        etag = '"%s"' % file_data.checksum if file_data.checksum else None
+        if request.GET.get('preview') == 'yes' and file_data.has_preview:
+            src = get_file_path(file_data, 'preview')
             content_type = 'imgae/png'
+            etag = '"%s-preview"' % file_data.checksum if file_data.checksum else None
+        elif request.GET.get('preview') == 'yes' and needsPreview(file_data.content_type):
+            return preview_pending_response()
 
         if request.GET.get('resize', 'no') == 'yes' and ('image' in file_data.content_type or 'pdf' in file_data.content_type):
-            img = resize_image('%s' % (src), (200, 150), 75)
-            output = io.BytesIO()
-            img.save(output, 'PNG')
-            output.seek(0)
-            response = StreamingHttpResponse(output, content_type='image/png')
+            response = thumbnail_response(request, src, (200, 150))
 
         else:
-            response = StreamingHttpResponse(open('%s' % (src), "rb"), content_type=content_type)
+            response = streamRanges(request, src, content_type, etag=etag)
 
         if 'noDisposition' not in request.GET:
-            if request.GET.get('preview') == 'yes' and os.path.isfile('%s%s.preview' % (get_doc_files_folder(), fileid)):
+            if request.GET.get('preview') == 'yes' and file_data.has_preview:
                 response['Content-Disposition'] = 'attachment;filename=%s' % content_type
             else:
                 response['Content-Disposition'] = 'attachment;filename=%s' % smart_str(file_data.name)
@@ -150,26 +170,13 @@ def docs_action(request, mode, docid):
                 f.content_type = request.FILES['file'].content_type
                 f.doc_id = doc.id
                 f.public = True
-                f.save(user=request.user)
+                with transaction.atomic():
+                    f.blob = add_blob(request.FILES['file'])
+                    f.save(user=request.user)
 
                 # add_history(request, tic, 5, request.FILES['file'].name)
 
-                dest = get_doc_files_folder()
-                if not os.path.exists(dest):
-                    os.makedirs(dest)
-
-                with open('%s%s.dat' % (dest, f.id), 'wb+') as destination:
-                    for chunk in request.FILES['file'].chunks():
-                        destination.write(chunk)
-
-                if 'pdf' in f.content_type:
-                    convertPDFtoImg('%s/%s.dat' % (dest, f.id), '%s/%s.preview' % (dest, f.id))
-                else:
-                    if 'image' not in f.content_type and isPreviewable(f.content_type):
-                        tmp = convertOfficeTpPDF('%s/%s.dat' % (dest, f.id))
-                        convertPDFtoImg(tmp, '%s/%s.preview' % (dest, f.id))
-                        if os.path.isfile(tmp):
-                            os.unlink(tmp)
+                queue_preview(f)
 
                 return HttpResponseRedirect('/docs/view/%s/' % doc.pk)
 
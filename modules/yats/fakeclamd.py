@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+"""
+stand-in for clamd in tests and development, speaks the part of the protocol
+yats.virusscan uses (PING, VERSION, IDSESSION, INSTREAM, END) and finds only the
+EICAR test signature
+
+    server = FakeClamd(delay=0.05).start()
+    with override_settings(CLAMD_ADDRESS=server.address): ...
+    server.stop()
+
+or: manage.py fake_clamd --port 3310
+"""
+import socketserver
+import struct
+import threading
+import time
+
+EICAR = b'X5O!P%@AP[4\\PZX54(P^)7CC)7}$EICAR-STANDARD-ANTIVIRUS-TEST-FILE!$H+H*'
+
+
+class FakeClamdHandler(socketserver.BaseRequestHandler):
+    def setup(self):
+        self.buffer = b''
+
+    def read(self, size):
+        while len(self.buffer) < size:
+            data = self.request.recv(65536)
+            if not data:
+                raise EOFError()
+            self.buffer += data
+        data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
+    def read_command(self):
+        # z prefix: \0 terminated, n prefix: newline terminated
+        prefix = self.read(1)
+        end = b'\0' if prefix == b'z' else b'\n'
+        while end not in self.buffer:
+            data = self.request.recv(4096)
+            if not data:
+                raise EOFError()
+            self.buffer += data
+        command, self.buffer = self.buffer.split(end, 1)
+        return command.decode('ascii', 'replace'), end
+
+    def instream(self):
+        found = False
+        tail = b''
+        size = 0
+        while True:
+            length = struct.unpack('!L', self.read(4))[0]
+            if not length:
+                break
+            chunk = self.read(length)
+            size += length
+            if EICAR in tail + chunk:
+                found = True
+            tail = (tail + chunk)[-len(EICAR):]
+        if self.server.delay:
+            time.sleep(self.server.delay)
+        self.server.scans += 1
+        if size > self.server.max_size:
+            return 'INSTREAM size limit exceeded. ERROR'
+        if found:
+            return 'stream: Eicar-Signature FOUND'
+        return 'stream: OK'
+
+    def handle(self):
+        session = False
+        ids = 0
+        try:
+            while True:
+                command, end = self.read_command()
+                if command == 'IDSESSION':
+                    session = True
+                    continue
+                if command == 'END':
+                    break
+                if command == 'PING':
+                    reply = 'PONG'
+                elif command == 'VERSION':
+                    reply = 'ClamAV 0.0.0/yats-fake'
+                elif command == 'INSTREAM':
+                    reply = self.instream()
+                else:
+                    reply = 'UNKNOWN COMMAND'
+                if session:
+                    ids += 1
+                    reply = '%s: %s' % (ids, reply)
+                self.request.sendall(reply.encode('ascii') + end)
+                if not session:
+                    break
+        except (EOFError, ConnectionError):
+            pass
+
+
+class FakeClamdServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class FakeClamd(object):
+    def __init__(self, host='127.0.0.1', port=0, delay=0, max_size=25 * 1024 * 1024):
+        self.server = FakeClamdServer((host, port), FakeClamdHandler)
+        self.server.delay = delay
+        self.server.max_size = max_size
+        self.server.scans = 0
+        self.thread = None
+
+    @property
+    def address(self):
+        return '%s:%s' % self.server.server_address[:2]
+
+    @property
+    def scans(self):
+        return self.server.scans
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def serve_forever(self):
+        self.server.serve_forever()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
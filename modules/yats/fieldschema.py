@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+"""
+ticket fields for the xml-rpc api (yats.api) and yatse (yats.yatse)
+
+the field map (name, field class, referenced model) only depends on the ticket
+model and is built once per process. the option lists of select fields are the
+expensive part, they are read with values_list and cached per version: every
+save or delete in a referenced table starts a new one.
+"""
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+
+import threading
+import time
+
+_field_map = None
+_local_options = {}
+_lock = threading.Lock()
+
+
+def get_cache():
+    return caches[getattr(settings, 'FIELD_SCHEMA_CACHE_ALIAS', 'default')]
+
+
+def get_field_map():
+    """
+    [(name, field class name, referenced model or None)] of the ticket model
+    """
+    global _field_map
+    from yats.shortcuts import get_ticket_model
+
+    model = get_ticket_model()
+    with _lock:
+        if _field_map is None or _field_map[0] is not model:
+            fields = []
+            for field in model._meta.fields:
+                # not OneToOneField, the parent link of a ticket subclass
+                related = field.related_model if type(field).__name__ == 'ForeignKey' else None
+                fields.append((field.name, field.__class__.__name__, related))
+            _field_map = (model, fields)
+    return _field_map[1]
+
+
+def get_option_models():
+    """
+    tables the option lists come from, only their saves and deletes start a new version
+    """
+    return set(related for name, typename, related in get_field_map() if related)
+
+
+def get_field_defs():
+    """
+    {name: None or (app_label, model name)}, what yats.api.search_terms needs to resolve values
+    """
+    return dict((name, (related._meta.app_label, related.__name__) if related else None) for name, typename, related in get_field_map())
+
+
+def get_version():
+    """
+    None if the cache is not shared between the processes, a new version would only reach this one
+    """
+    from django.core.cache.backends.dummy import DummyCache
+    from django.core.cache.backends.locmem import LocMemCache
+
+    cache = get_cache()
+    if isinstance(cache, (DummyCache, LocMemCache)):
+        return None
+    version = cache.get('yats.fieldschema.version')
+    if version is None:
+        cache.add('yats.fieldschema.version', int(time.time() * 1000), None)
+        version = cache.get('yats.fieldschema.version')
+    return version
+
+
+def invalidate_field_options(sender):
+    if not any(related is sender for name, typename, related in get_field_map()):
+        return
+    cache = get_cache()
+    try:
+        cache.incr('yats.fieldschema.version')
+    except ValueError:
+        cache.add('yats.fieldschema.version', int(time.time() * 1000), None)
+    _local_options.clear()
+
+
+def option_column(model):
+    """
+    the column an option is shown and looked up by, None if only str() of the row tells
+    """
+    if model is get_user_model():
+        return model.USERNAME_FIELD
+    if 'name' in [field.name for field in model._meta.fields]:
+        return 'name'
+    return None
+
+
+def load_options(model):
+    column = option_column(model)
+    if column is None:
+        return [str(obj) for obj in model.objects.all()]
+    return [str(value) for value in model.objects.values_list(column, flat=True)]
+
+
+def get_options(model):
+    """
+    option names of a referenced table, read every time without a shared cache
+    """
+    version = get_version()
+    if version is None:
+        return load_options(model)
+    key = '%s.%s' % (model._meta.app_label, model._meta.model_name)
+    local = _local_options.get(key)
+    if local is not None and local[0] == version:
+        return local[1]
+    cache = get_cache()
+    cache_key = 'yats.fieldschema.%s.%s' % (version, key)
+    options = cache.get(cache_key)
+    if options is None:
+        options = load_options(model)
+        cache.set(cache_key, options, getattr(settings, 'FIELD_SCHEMA_CACHE_TIMEOUT', 3600))
+    _local_options[key] = (version, options)
+    return options
+
+
+def build_fields(exclude_list, label=None, typename=None):
+    """
+    [{'name', 'label', 'type', 'options'}], label and typename map the field name and field class name
+    """
+    result = []
+    for name, field_class, related in get_field_map():
+        if name in exclude_list:
+            continue
+        value = {
+            'name': name,
+            'label': label(name) if label else name,
+        }
+        if related:
+            value['type'] = 'select'
+            options = get_options(related)
+            if options:
+                value['options'] = list(options)
+        else:
+            value['type'] = typename(field_class) if typename else field_class
+        result.append(value)
+    return result
@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from yats.models import api_tokens
+from yats.middleware.auth import create_api_token
+
+
+class Command(BaseCommand):
+    help = 'create, list or revoke api tokens, send them as "Authorization: Token <token>"'
+
+    def add_arguments(self, parser):
+        parser.add_argument('username')
+        parser.add_argument('--name', default='', help='what the token is for')
+        parser.add_argument('--days', type=int, default=0, help='valid for this many days, default forever')
+        parser.add_argument('--list', action='store_true', help='list the tokens of the user')
+        parser.add_argument('--revoke', type=int, metavar='ID', help='delete the token with this id')
+
+    def handle(self, *args, **options):
+        try:
+            user = get_user_model().objects.get(username=options['username'])
+        except get_user_model().DoesNotExist:
+            raise CommandError('unknown user %s' % options['username'])
+
+        if options['list']:
+            for t in api_tokens.objects.filter(user=user).order_by('c_date'):
+                self.stdout.write('%s\t%s\tcreated %s\tlast used %s\texpires %s' % (t.pk, t.name or '-', t.c_date, t.last_used or '-', t.expires or '-'))
+            return
+
+        if options['revoke']:
+            deleted, _ = api_tokens.objects.filter(user=user, pk=options['revoke']).delete()
+            if not deleted:
+                raise CommandError('no token %s of %s' % (options['revoke'], user))
+            self.stdout.write('revoked')
+            return
+
+        t, token = create_api_token(user, options['name'], options['days'])
+        self.stdout.write('token %s for %s, it is not shown again:' % (t.pk, user))
+        self.stdout.write(token)
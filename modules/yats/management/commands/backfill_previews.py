@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+from django.core.management.base import BaseCommand
+from yats.models import tickets_files, docs_files
+from yats.blobstore import get_file_path
+
+import os
+
+
+class Command(BaseCommand):
+    help = 'set has_preview of all files from the previews on disk, needed once after upgrading'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help='check files already marked too, unmark them if their preview is gone')
+        parser.add_argument('--batch', type=int, default=500, help='rows per update')
+
+    def handle(self, *args, **options):
+        for model in (tickets_files, docs_files):
+            files = model.objects.all()
+            if not options['all']:
+                files = files.filter(has_preview=False)
+
+            found = []
+            missing = []
+            blobs = {}
+            total = 0
+            for f in files.only('pk', 'blob', 'has_preview').order_by('pk').iterator():
+                total += 1
+                # files with the same content share one preview
+                if f.blob_id:
+                    if f.blob_id not in blobs:
+                        blobs[f.blob_id] = os.path.isfile(get_file_path(f, 'preview'))
+                    exists = blobs[f.blob_id]
+                else:
+                    exists = os.path.isfile(get_file_path(f, 'preview'))
+                if exists and not f.has_preview:
+                    found.append(f.pk)
+                elif not exists and f.has_preview:
+                    missing.append(f.pk)
+
+            for pks, value in ((found, True), (missing, False)):
+                for i in range(0, len(pks), options['batch']):
+                    model.objects.filter(pk__in=pks[i:i + options['batch']]).update(has_preview=value)
+
+            self.stdout.write('%s: %s files checked, %s previews found, %s gone' % (model._meta.model_name, total, len(found), len(missing)))
+        self.stdout.write('done')
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+from django.core.management.base import BaseCommand, CommandError
+from yats.converter import OfficeConverter, uno
+from yats.shortcuts import spawnOfficeToPDF
+
+import mimetypes
+import os
+import shutil
+import tempfile
+import time
+
+
+class Command(BaseCommand):
+    help = 'compare pdf conversion with one libreoffice per file against the persistent converter'
+
+    def add_arguments(self, parser):
+        parser.add_argument('files', nargs='*', help='documents to convert, synthetic text documents if omitted')
+        parser.add_argument('--count', type=int, default=20, help='number of synthetic documents')
+        parser.add_argument('--skip-spawn', action='store_true', help='only measure the persistent converter')
+
+    def handle(self, *args, **options):
+        if uno is None:
+            raise CommandError('python uno bindings are missing (debian: python3-uno)')
+
+        workdir = tempfile.mkdtemp(prefix='yats-convert-bench-')
+        try:
+            files = options['files'] or self.make_documents(workdir, options['count'])
+            jobs = [(path, mimetypes.guess_type(path)[0]) for path in files]
+            self.stdout.write('%s documents' % len(jobs))
+
+            if not options['skip_spawn']:
+                outdir = os.path.join(workdir, 'spawn')
+                os.makedirs(outdir)
+                start = time.time()
+                times = []
+                for path, mimetype in jobs:
+                    single = time.time()
+                    spawnOfficeToPDF(path, mimetype, outdir=outdir)
+                    times.append(time.time() - single)
+                self.report('spawn per file', time.time() - start, times)
+
+            outdir = os.path.join(workdir, 'persistent')
+            os.makedirs(outdir)
+            converter = OfficeConverter()
+            start = time.time()
+            converter.start()
+            startup = time.time() - start
+            times = []
+            try:
+                for path, mimetype in jobs:
+                    single = time.time()
+                    converter.convert(path, os.path.join(outdir, '%s.pdf' % os.path.basename(path).split('.')[0]), mimetype)
+                    times.append(time.time() - single)
+            finally:
+                converter.stop()
+            self.report('persistent', time.time() - start, times)
+            self.stdout.write('persistent startup %.2fs' % startup)
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    def make_documents(self, workdir, count):
+        files = []
+        for i in range(count):
+            path = os.path.join(workdir, 'doc%s.txt' % i)
+            with open(path, 'w') as fo:
+                for line in range(200):
+                    fo.write('document %s line %s lorem ipsum dolor sit amet\n' % (i, line))
+            files.append(path)
+        return files
+
+    def report(self, name, total, times):
+        times = sorted(times)
+        self.stdout.write('%-16s %6.2fs total %6.2f docs/s p50 %6.3fs max %6.3fs' % (name, total, len(times) / total, times[len(times) // 2], times[-1]))
@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+from django.core.management.base import BaseCommand, CommandError
+from django.conf import settings
+from django.db import connections as db_connections
+from django.utils import timezone
+from haystack.backends import SQ
+from haystack.inputs import AutoQuery
+
+from yats.search_backend import DatabaseSearchBackend, DatabaseSearchQuery
+
+import datetime
+import itertools
+import random
+import string
+import time
+
+
+class Command(BaseCommand):
+    help = 'index synthetic tickets into a scratch table and compare full-text queries against LIKE scans'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=100000, help='number of synthetic tickets')
+        parser.add_argument('--queries', type=int, default=200, help='number of queries per kind')
+        parser.add_argument('--customers', type=int, default=50)
+        parser.add_argument('--keep', action='store_true', help='keep the scratch table')
+
+    def handle(self, *args, **options):
+        conf = settings.HAYSTACK_CONNECTIONS['default']
+        if conf['ENGINE'] != 'yats.search_backend.DatabaseEngine':
+            raise CommandError('default haystack connection does not use yats.search_backend.DatabaseEngine')
+
+        options_backend = dict(conf)
+        options_backend['TABLE'] = 'yats_search_bench'
+        backend = DatabaseSearchBackend('default', **options_backend)
+        backend.drop()
+        self.stdout.write('%s dialect' % backend.dialect.__class__.__name__)
+
+        rnd = random.Random(4711)
+        vocabulary = [''.join(rnd.choice(string.ascii_lowercase) for i in range(rnd.randint(4, 10))) for i in range(20000)]
+        # zipf like distribution, a few words are very common
+        weights = list(itertools.accumulate(1.0 / (rank + 1) for rank in range(len(vocabulary))))
+        now = timezone.now()
+
+        start = time.time()
+        rows = []
+        for pk in range(1, options['count'] + 1):
+            caption = ' '.join(rnd.choices(vocabulary, cum_weights=weights, k=6))
+            text = ' '.join(rnd.choices(vocabulary, cum_weights=weights, k=80))
+            rows.append(backend.prepare_row({
+                'django_ct': 'yats.tickets',
+                'django_id': pk,
+                'caption': caption,
+                'text': '%s\n%s\n#%s' % (caption, text, pk),
+                'content_auto': '%s\n#%s' % (caption, pk),
+                'closed': rnd.random() < 0.7,
+                'customer': rnd.randint(1, options['customers']),
+                'last_action_date': now - datetime.timedelta(minutes=pk),
+            }))
+            if len(rows) >= 2000:
+                backend.write_rows(rows)
+                rows = []
+        if rows:
+            backend.write_rows(rows)
+        duration = time.time() - start
+        self.stdout.write('indexed %s tickets in %.1fs (%.0f/s)' % (options['count'], duration, options['count'] / duration))
+
+        common = vocabulary[:50]
+        rare = vocabulary[1000:5000]
+        kinds = [
+            ('common word', lambda: (rnd.choice(common), False, None)),
+            ('rare word', lambda: (rnd.choice(rare), False, None)),
+            ('two words', lambda: ('%s %s' % (rnd.choice(common), rnd.choice(rare)), False, None)),
+            ('prefix 3 chars', lambda: (rnd.choice(rare)[:3], True, None)),
+            ('prefix + filters', lambda: (rnd.choice(rare)[:4], True, rnd.randint(1, options['customers']))),
+        ]
+
+        self.stdout.write('%-18s %12s %12s %12s %12s' % ('query', 'fts p50', 'fts p95', 'like p50', 'like p95'))
+        for name, make in kinds:
+            fts = []
+            like = []
+            for i in range(options['queries']):
+                term, prefix, customer = make()
+                fts.append(self.run_fts(backend, term, prefix, customer))
+                like.append(self.run_like(backend, term, prefix, customer))
+            self.stdout.write('%-18s %10.2fms %10.2fms %10.2fms %10.2fms' % (name, percentile(fts, 50), percentile(fts, 95), percentile(like, 50), percentile(like, 95)))
+
+        if not options['keep']:
+            backend.drop()
+        self.stdout.write(self.style.SUCCESS('done'))
+
+    def run_fts(self, backend, term, prefix, customer):
+        query = DatabaseSearchQuery()
+        query.backend = backend
+        if prefix:
+            query.add_filter(SQ(content_auto__contains=term))
+        else:
+            query.add_filter(SQ(content=AutoQuery(term)))
+        if customer:
+            query.add_filter(SQ(closed=False))
+            query.add_filter(SQ(customer=customer))
+        query.set_limits(0, 20)
+        start = time.time()
+        query.run()
+        return (time.time() - start) * 1000
+
+    def run_like(self, backend, term, prefix, customer):
+        # what the simple backend does: icontains on every word, count and first page
+        where = []
+        params = []
+        for word in term.split():
+            where.append('(LOWER(caption) LIKE %s OR LOWER(text) LIKE %s)')
+            params.extend(['%%%s%%' % word] * 2)
+        if customer:
+            where.append('closed = %s AND customer = %s')
+            params.extend([False, customer])
+        sql = 'FROM %s_document WHERE %s' % (backend.table, ' AND '.join(where))
+        start = time.time()
+        with db_connections[backend.database].cursor() as cursor:
+            cursor.execute('SELECT COUNT(*) ' + sql, params)
+            cursor.fetchone()
+            cursor.execute('SELECT django_id %s ORDER BY last_action_date DESC LIMIT 20' % sql, params)
+            cursor.fetchall()
+        return (time.time() - start) * 1000
+
+
+def percentile(values, percent):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * percent / 100))]
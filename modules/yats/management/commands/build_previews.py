@@ -1,36 +1,109 @@
 # -*- coding: utf-8 -*-
-from django.core.management.base import BaseCommand
-from django.conf import settings
-from yats.models import tickets_files
-from yats.shortcuts import convertPDFtoImg, convertOfficeTpPDF, non_previewable_contenttypes
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.db.models import Q
+from django.utils.dateparse import parse_date
+from yats.models import tickets_files, docs_files
+from yats.shortcuts import needsPreview, non_previewable_contenttypes
+from yats.blobstore import get_file_path
+from yats.tasks import build_preview
+from yats.virusscan import SCAN_CLEAN
 
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import multiprocessing.util
 import os
+import time
 
 class Command(BaseCommand):
     args = '<>'
-    help = 'generate previews for all uploaded files in tickets'
+    help = 'generate previews for all uploaded files in tickets and docs'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--now', action='store_true', help='convert in this command instead of queueing for the preview workers')
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='parallel conversions with --now')
+        parser.add_argument('--since', help='only files uploaded on or after this date (YYYY-MM-DD)')
+        parser.add_argument('--limit', type=int, default=0, help='stop after this many files')
 
     def handle(self, *args, **options):
-        dest = settings.FILE_UPLOAD_PATH
-        if not os.path.exists(dest):
-            os.makedirs(dest)
-
-        files = tickets_files.objects.exclude(content_type__icontains='image')
-        for non in non_previewable_contenttypes:
-            files = files.exclude(content_type__icontains=non)
-        for file in files:
-            src = '%s%s.dat' % (settings.FILE_UPLOAD_PATH, file.id)
-            if os.path.isfile(src):
-                if not os.path.isfile('%s%s.preview' % (dest, file.id)):
-                    self.stdout.write(file.content_type)
-                    self.stdout.write(src)
-                    if 'pdf' in file.content_type:
-                        convertPDFtoImg('%s%s.dat' % (dest, file.id), '%s%s.preview' % (dest, file.id))
-                    else:
-                        if 'image' not in file.content_type:
-                            tmp = convertOfficeTpPDF('%s%s.dat' % (dest, file.id), file.content_type)
-                            convertPDFtoImg(tmp, '%s%s.preview' % (dest, file.id))
-                            if os.path.isfile(tmp):
-                                os.unlink(tmp)
+        since = None
+        if options['since']:
+            since = parse_date(options['since'])
+            if not since:
+                raise CommandError('--since needs YYYY-MM-DD')
+
+        jobs = []
+        for model in (tickets_files, docs_files):
+            name = model._meta.model_name
+            files = model.objects.exclude(content_type__icontains='image')
+            for non in non_previewable_contenttypes:
+                files = files.exclude(content_type__icontains=non)
+            if since:
+                files = files.filter(c_date__date__gte=since)
+            # files with a preview are done, a new run picks up the failed and the not yet converted ones
+            files = files.filter(has_preview=False).order_by('pk')
+            # queued by the scan worker once they are clean
+            files = files.filter(Q(blob__isnull=True) | Q(blob__scan_state=SCAN_CLEAN))
+            for file in files.iterator():
+                if not needsPreview(file.content_type) or not os.path.isfile(get_file_path(file)):
+                    continue
+                jobs.append((name, file.pk, file.content_type))
+                if options['limit'] and len(jobs) >= options['limit']:
+                    break
+            if options['limit'] and len(jobs) >= options['limit']:
+                break
+
+        if not options['now']:
+            count = 0
+            for name, pk, content_type in jobs:
+                build_preview(name, pk)
+                count += 1
+            self.stdout.write('%s previews queued, run: manage.py process_tasks --queue previews' % count)
+            self.stdout.write('done')
+            return
 
+        self.stdout.write('%s files, %s workers' % (len(jobs), options['workers']))
+        stats = {}
+        failed = 0
+        start = time.time()
+        # children must not share the connection of this process
+        connections.close_all()
+        with ProcessPoolExecutor(max_workers=options['workers'], mp_context=multiprocessing.get_context('fork'), initializer=init_worker) as pool:
+            for name, pk, content_type, duration, error in pool.map(convert, jobs, chunksize=1):
+                stat = stats.setdefault(content_type, [0, 0.0, 0])
+                stat[0] += 1
+                stat[1] += duration
+                if error:
+                    stat[2] += 1
+                    failed += 1
+                    self.stderr.write('%s %s: %s' % (name, pk, error))
+
+        total = time.time() - start
+        self.stdout.write('%-50s %6s %6s %10s %14s' % ('content type', 'files', 'failed', 'avg', 'files/s/worker'))
+        for content_type, (count, duration, errors) in sorted(stats.items(), key=lambda item: -item[1][1]):
+            self.stdout.write('%-50s %6s %6s %9.2fs %14.2f' % (content_type[:50], count, errors, duration / count, count / duration if duration else 0))
+        self.stdout.write('%s previews in %.1fs (%.2f files/s), %s failed' % (len(jobs), total, len(jobs) / total if total else 0, failed))
         self.stdout.write('done')
+
+
+def init_worker():
+    from yats.converter import stop_office_converter
+
+    # pool workers end with os._exit, atexit would never stop their soffice
+    multiprocessing.util.Finalize(None, stop_office_converter, exitpriority=10)
+
+
+def convert(job):
+    name, pk, content_type = job
+    start = time.time()
+    try:
+        build_preview.now(name, pk)
+        # the converters only print their errors
+        if apps.get_model('yats', name).objects.filter(pk=pk, has_preview=True).exists():
+            error = None
+        else:
+            error = 'no preview built'
+    except Exception as e:
+        error = str(e) or e.__class__.__name__
+    return name, pk, content_type, time.time() - start, error
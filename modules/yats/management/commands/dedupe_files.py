@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import F
+from yats.models import tickets_files, docs_files, file_blobs
+from yats.blobstore import get_blob_path, get_legacy_path, link_or_copy
+
+import hashlib
+import os
+
+
+class Command(BaseCommand):
+    help = 'move attachments stored as <id>.dat into the content addressed blob store, identical files are kept once'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='only report what would be reclaimed')
+
+    def handle(self, *args, **options):
+        stats = {'files': 0, 'blobs': 0, 'missing': 0, 'reclaimed': 0}
+        seen = set()
+        for model in (tickets_files, docs_files):
+            for f in model.objects.filter(blob__isnull=True).order_by('pk').iterator():
+                src = get_legacy_path(f)
+                if not os.path.isfile(src):
+                    stats['missing'] += 1
+                    continue
+
+                md5, sha256, size = hash_file(src)
+                stats['files'] += 1
+                if sha256 in seen or file_blobs.objects.filter(pk=sha256).exists():
+                    stats['reclaimed'] += size
+                else:
+                    stats['blobs'] += 1
+                seen.add(sha256)
+                if options['dry_run']:
+                    continue
+
+                self.move(f, src, md5, sha256, size)
+
+        self.stdout.write('%(files)s files, %(blobs)s distinct, %(missing)s missing on disk' % stats)
+        self.stdout.write(self.style.SUCCESS('%s reclaimed%s' % (format_size(stats['reclaimed']), ' (dry run)' if options['dry_run'] else '')))
+
+    def move(self, f, src, md5, sha256, size):
+        dest = get_blob_path(sha256)
+        # the row points to the blob only once its content is in place,
+        # the old file is removed after commit: interrupting never loses a file
+        with transaction.atomic():
+            blob, created = file_blobs.objects.select_for_update().get_or_create(sha256=sha256, defaults={'md5': md5, 'size': size})
+            if not os.path.isfile(dest):
+                link_or_copy(src, dest)
+            preview = get_legacy_path(f, 'preview')
+            if os.path.isfile(preview) and not os.path.isfile(get_blob_path(sha256, 'preview')):
+                link_or_copy(preview, get_blob_path(sha256, 'preview'))
+            file_blobs.objects.filter(pk=sha256).update(refcount=F('refcount') + 1)
+            type(f).objects.filter(pk=f.pk).update(blob=blob, checksum=f.checksum or md5, has_preview=os.path.isfile(get_blob_path(sha256, 'preview')))
+
+        for path in (src, preview):
+            if os.path.isfile(path):
+                os.unlink(path)
+
+
+def hash_file(path):
+    md5 = hashlib.md5()
+    sha256 = hashlib.sha256()
+    size = 0
+    with open(path, 'rb') as fo:
+        for chunk in iter(lambda: fo.read(65536), b''):
+            md5.update(chunk)
+            sha256.update(chunk)
+            size += len(chunk)
+    return md5.hexdigest(), sha256.hexdigest(), size
+
+
+def format_size(size):
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if size < 1024:
+            return '%.1f %s' % (size, unit)
+        size /= 1024.0
+    return '%.1f TB' % size
@@ -0,0 +1,22 @@
+# -*- coding: utf-8 -*-
+from django.core.management.base import BaseCommand
+from yats.fakeclamd import FakeClamd
+
+
+class Command(BaseCommand):
+    help = 'run a fake clamd for development, it only detects the EICAR test file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=3310)
+        parser.add_argument('--delay', type=float, default=0, help='seconds each scan takes')
+
+    def handle(self, *args, **options):
+        server = FakeClamd(options['host'], options['port'], delay=options['delay'])
+        self.stdout.write('fake clamd listening on %s, CLAMD_ADDRESS = \'%s\'' % (server.address, server.address))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.stop()
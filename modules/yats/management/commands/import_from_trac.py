@@ -1,16 +1,17 @@
 # -*- coding: utf-8 -*-
 from django.core.management.base import BaseCommand, CommandError
 from django.contrib.auth import get_user_model
+from django.db import transaction
 import getpass
 from xmlrpc import client as xmlrpclib
 from furl import furl
 from yats.models import docs, docs_files
-from yats.docs import get_doc_files_folder
-from yats.shortcuts import convertPDFtoImg, convertOfficeTpPDF, isPreviewable
+from django.core.files.uploadedfile import SimpleUploadedFile
+from yats.blobstore import add_blob, get_file_path
+from yats.shortcuts import convertPDFtoImg, convertOfficeTpPDF, isPreviewable, mark_preview
 import re
 import os
 import mimetypes
-import hashlib
 
 def convert(text, base_path, multilines=True):
     text = re.sub('\r\n', '\n', text)
@@ -130,36 +131,31 @@ class Command(BaseCommand):
                 file = rpc_srv.wiki.getAttachment(att)
                 mimetype = mimetypes.guess_type(filename)
 
+                upload = SimpleUploadedFile(filename, file.data)
                 f = docs_files()
                 f.name = filename
-                f.size = 0
+                f.size = upload.size
                 f.content_type = mimetype[0] if mimetype[0] else ''
                 f.doc_id = d.id
                 f.public = True
-                f.save(user=user)
-
-                dest = get_doc_files_folder()
-                if not os.path.exists(dest):
-                    os.makedirs(dest)
-
-                with open('%s%s.dat' % (dest, f.id), 'wb') as destination:
-                    destination.write(file.data)
-                    destination.close()
-
-                hash_md5 = hashlib.md5()
-                with open('%s%s.dat' % (dest, f.id), "rb") as fo:
-                    for chunk in iter(lambda: fo.read(4096), b""):
-                        hash_md5.update(chunk)
-                f.checksum = hash_md5.hexdigest()
-                f.save(user=user)
-
-                if 'pdf' in f.content_type:
-                    convertPDFtoImg('%s/%s.dat' % (dest, f.id), '%s/%s.preview' % (dest, f.id))
+                with transaction.atomic():
+                    f.blob = add_blob(upload)
+                    f.checksum = upload.hash
+                    f.save(user=user)
+
+                src = get_file_path(f)
+                preview = get_file_path(f, 'preview')
+                if os.path.isfile(preview):
+                    pass
+                elif 'pdf' in f.content_type:
+                    convertPDFtoImg(src, preview)
                 else:
                     if 'image' not in f.content_type and isPreviewable(f.content_type):
-                        tmp = convertOfficeTpPDF('%s/%s.dat' % (dest, f.id))
-                        convertPDFtoImg(tmp, '%s/%s.preview' % (dest, f.id))
+                        tmp = convertOfficeTpPDF(src)
+                        convertPDFtoImg(tmp, preview)
                         if os.path.isfile(tmp):
                             os.unlink(tmp)
+                if os.path.isfile(preview):
+                    mark_preview(f)
 
             self.stdout.write('%s => %s' % (doc, d.pk))
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+from django.core.management.base import BaseCommand
+from yats.blobstore import get_layouts, get_legacy_folders, link_or_copy, set_layout_settled
+
+import os
+import time
+
+
+class Command(BaseCommand):
+    help = 'move attachments and previews into the directory layout configured by FILE_UPLOAD_LAYOUT, safe while yats is running'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='only count the files to move')
+        parser.add_argument('--limit', type=int, default=0, help='stop after moving this many files')
+        parser.add_argument('--sleep', type=float, default=0, help='seconds to wait after each file, keeps the disk usable for others')
+
+    def handle(self, *args, **options):
+        layouts = get_layouts()
+        target = layouts[0]
+        self.stdout.write('target layout %s' % target.__class__.__name__)
+
+        moved = 0
+        for folder in get_legacy_folders():
+            for layout in layouts[1:]:
+                ids = sorted(set(name.split('.')[0] for name in layout.iter_files(folder)), key=int)
+                self.stdout.write('%s: %s files in %s' % (folder, len(ids), layout.__class__.__name__))
+                if options['dry_run']:
+                    continue
+
+                for pk in ids:
+                    # preview first: readers look for the preview next to the .dat they find
+                    for name in ('%s.preview' % pk, '%s.dat' % pk):
+                        src = layout.get_path(folder, name)
+                        dest = target.get_path(folder, name)
+                        if os.path.isfile(src) and not os.path.isfile(dest):
+                            link_or_copy(src, dest)
+                    for name in ('%s.dat' % pk, '%s.preview' % pk):
+                        src = layout.get_path(folder, name)
+                        if os.path.isfile(src):
+                            os.unlink(src)
+
+                    moved += 1
+                    if options['sleep']:
+                        time.sleep(options['sleep'])
+                    if options['limit'] and moved >= options['limit']:
+                        self.stdout.write(self.style.SUCCESS('moved %s files, limit reached' % moved))
+                        return
+
+        if not options['dry_run']:
+            # running processes keep looking on disk until they are restarted
+            set_layout_settled()
+            self.stdout.write(self.style.SUCCESS('moved %s files, restart yats to stop looking for them in the old layout' % moved))
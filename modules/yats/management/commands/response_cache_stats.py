@@ -0,0 +1,22 @@
+# -*- coding: utf-8 -*-
+from django.core.management.base import BaseCommand
+from yats.middleware.cache import get_stats, reset_stats, response_cache_enabled
+
+
+class Command(BaseCommand):
+    help = 'hits and misses of the response cache per url pattern'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true', help='start counting again')
+
+    def handle(self, *args, **options):
+        if not response_cache_enabled():
+            self.stdout.write('yats.middleware.cache.yatsCacheMiddleware is not in MIDDLEWARE')
+
+        self.stdout.write('%-30s %10s %10s %7s' % ('url', 'hits', 'misses', 'ratio'))
+        for regex, hits, misses in get_stats():
+            ratio = hits * 100.0 / (hits + misses) if hits + misses else 0
+            self.stdout.write('%-30s %10s %10s %6.1f%%' % (regex, hits, misses, ratio))
+
+        if options['reset']:
+            reset_stats()
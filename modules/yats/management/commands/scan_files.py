@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+from django.core.management.base import BaseCommand, CommandError
+from yats.models import file_blobs
+from yats.tasks import scan_blob
+from yats.virusscan import check_blob, get_scanner, ScanError, SCAN_PENDING, SCAN_CLEAN, SCAN_INFECTED
+
+
+class Command(BaseCommand):
+    help = 'virus scan quarantined attachments (or all with --all)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help='scan every stored file again')
+        parser.add_argument('--now', action='store_true', help='scan in this command instead of queueing for the scan workers')
+        parser.add_argument('--limit', type=int, default=0, help='stop after this many files')
+
+    def handle(self, *args, **options):
+        blobs = file_blobs.objects.filter(refcount__gt=0)
+        if options['all']:
+            blobs = blobs.exclude(scan_state=SCAN_INFECTED)
+        else:
+            blobs = blobs.filter(scan_state=SCAN_PENDING)
+        shas = list(blobs.order_by('c_date').values_list('pk', flat=True))
+        if options['limit']:
+            shas = shas[:options['limit']]
+        if options['all']:
+            file_blobs.objects.filter(pk__in=shas).update(scan_state=SCAN_PENDING)
+
+        if not options['now']:
+            for sha256 in shas:
+                scan_blob(sha256)
+            self.stdout.write('%s files queued, run: manage.py process_tasks --queue scans' % len(shas))
+            return
+
+        infected = 0
+        for sha256 in shas:
+            try:
+                if check_blob(sha256) == SCAN_INFECTED:
+                    infected += 1
+                    self.stderr.write('%s infected' % sha256)
+            except ScanError as e:
+                raise CommandError(str(e))
+
+        metrics = get_scanner().metrics()
+        self.stdout.write('%s files scanned, %s infected, %s clean' % (metrics['scans'], infected, file_blobs.objects.filter(pk__in=shas, scan_state=SCAN_CLEAN).count()))
+        if metrics['scans']:
+            self.stdout.write('latency avg %(avg).3fs p50 %(p50).3fs p95 %(p95).3fs max %(max).3fs' % metrics)
@@ -2,20 +2,34 @@
 from django.template import loader
 from django.http import HttpResponse
 from django.conf import settings
-from django.contrib.auth import authenticate, login, get_user
-from yats.models import UserProfile
+from django.contrib.auth import authenticate, login, get_user, get_user_model
+from django.db.models import Q
+from django.utils import timezone
+from yats.shortcuts import get_user_organisation
 
 import re
 import base64
+import binascii
+import datetime
+import hashlib
+import hmac
+import os
+import secrets
+import threading
+import time
+
+# verified basic auth credentials of this process, keyed by a hmac with a key that
+# never leaves the process, so neither passwords nor anything to test them against are kept
+_credential_secret = os.urandom(32)
+_credentials = {}
+_credentials_lock = threading.Lock()
+CREDENTIAL_CACHE_SIZE = 1000
 
 def OrgaAdditionMiddleware(get_response):
 
     def middleware(request):
         if request.user.is_active and request.user.is_authenticated:
-            try:
-                request.organisation = UserProfile.objects.get(user=request.user).organisation
-            except Exception:
-                pass
+            request.organisation = get_user_organisation(request.user)
 
             if not hasattr(request, 'organisation') or not request.organisation:
                 response = HttpResponse(loader.render_to_string('no_orga.html', {'source': 'middleware', 'request_path': request.build_absolute_uri()}, request=request))
@@ -31,6 +45,73 @@ def OrgaAdditionMiddleware(get_response):
 
     return middleware
 
+def credential_key(username, password):
+    return hmac.new(_credential_secret, ('%s\0%s' % (username, password)).encode('utf-8'), hashlib.sha256).digest()
+
+def password_fingerprint(user):
+    # changes with the password, the cached credential is void then
+    return hmac.new(_credential_secret, (user.password or '').encode('utf-8'), hashlib.sha256).digest()
+
+def authenticate_basic(request, username, password):
+    """
+    (user, cached), a credential checked in the last BASIC_AUTH_CACHE_TIMEOUT seconds is not hashed again
+    """
+    timeout = getattr(settings, 'BASIC_AUTH_CACHE_TIMEOUT', 300)
+    key = credential_key(username, password)
+    entry = _credentials.get(key)
+    if entry is not None:
+        expires, user_id, fingerprint, backend = entry
+        if expires > time.time():
+            user = get_user_model().objects.filter(pk=user_id, is_active=True).first()
+            if user is not None and hmac.compare_digest(fingerprint, password_fingerprint(user)):
+                user.backend = backend
+                return user, True
+        with _credentials_lock:
+            _credentials.pop(key, None)
+
+    user = authenticate(request, username=username, password=password)
+    if user is not None and user.is_active and timeout:
+        with _credentials_lock:
+            if len(_credentials) >= CREDENTIAL_CACHE_SIZE:
+                now = time.time()
+                for old in [old for old, value in _credentials.items() if value[0] <= now]:
+                    del _credentials[old]
+                if len(_credentials) >= CREDENTIAL_CACHE_SIZE:
+                    _credentials.clear()
+            _credentials[key] = (time.time() + timeout, user.pk, password_fingerprint(user), user.backend)
+    return user, False
+
+def hash_api_token(token):
+    return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+def create_api_token(user, name='', days=None):
+    """
+    (api_tokens row, token), only the hash of the token is stored
+    """
+    from yats.models import api_tokens
+
+    token = secrets.token_urlsafe(32)
+    t = api_tokens(user=user, name=name, key=hash_api_token(token))
+    if days:
+        t.expires = timezone.now() + datetime.timedelta(days=days)
+    t.save()
+    return t, token
+
+def authenticate_token(token):
+    """
+    Authorization: Token <token>, no password hashing and no session
+    """
+    from yats.models import api_tokens
+
+    now = timezone.now()
+    t = api_tokens.objects.select_related('user').filter(key=hash_api_token(token), user__is_active=True).filter(Q(expires__isnull=True) | Q(expires__gt=now)).first()
+    if t is None:
+        return None
+    # once a minute is exact enough
+    if t.last_used is None or t.last_used < now - datetime.timedelta(minutes=1):
+        api_tokens.objects.filter(pk=t.pk).update(last_used=now)
+    return t.user
+
 class BasicAuthMiddleware:
     def __init__(self, get_response):
         self.get_response = get_response
@@ -45,6 +126,40 @@ class BasicAuthMiddleware:
 
         self.public_urls = tuple(public_urls)
 
+    def authorize(self, request):
+        """
+        logs in the user of the Authorization header (Basic or Token), True if it succeeded
+        """
+        auth = request.META.get('HTTP_AUTHORIZATION', '').split()
+        if len(auth) != 2:
+            return False
+
+        if auth[0].lower() in ('token', 'bearer'):
+            user = authenticate_token(auth[1])
+            if user is None:
+                return False
+            request.user = user
+            request.organisation = get_user_organisation(user)
+            return True
+
+        if auth[0].lower() == "basic":
+            auth_data = auth[1]
+            auth_data += "=" * ((4 - len(auth_data) % 4) % 4)
+            try:
+                uname, passwd = base64.b64decode(auth_data).decode('utf-8').split(':', 1)
+            except (binascii.Error, UnicodeDecodeError, ValueError):
+                return False
+            user, cached = authenticate_basic(request, uname, passwd)
+            if user and user.is_active:
+                request.user = user
+                request.organisation = get_user_organisation(user)
+                # clients keeping the cookie come back with the session, for all others
+                # (most caldav clients) login would only create a session per request
+                if not cached:
+                    login(request, user)
+                return True
+        return False
+
     def __call__(self, request):
         for url in self.public_urls:
             if url.match(request.path[1:]):
@@ -53,32 +168,11 @@ class BasicAuthMiddleware:
         # lookup, if user was already authenticated
         request.user = get_user(request)
         if request.user.is_authenticated:
-            try:
-                request.organisation = UserProfile.objects.get(user=request.user).organisation
-            except Exception:
-                pass
+            request.organisation = get_user_organisation(request.user)
             return self.get_response(request)
 
-        if 'HTTP_AUTHORIZATION' in request.META:
-            auth = request.META['HTTP_AUTHORIZATION'].split()
-            if len(auth) == 2:
-                # NOTE: We only support basic authentication for now.
-                #
-                if auth[0].lower() == "basic":
-                    auth_data = auth[1]
-                    auth_data += "=" * ((4 - len(auth_data) % 4) % 4)
-                    auth_data = base64.b64decode(auth_data).decode('utf-8')
-                    uname, passwd = auth_data.split(':', 1)
-                    user = authenticate(username=uname, password=passwd)
-                    if user:
-                        if user.is_active:
-                            request.user = user
-                            try:
-                                request.organisation = UserProfile.objects.get(user=user).organisation
-                            except Exception:
-                                pass
-                            login(request, user)
-                            return self.get_response(request)
+        if self.authorize(request):
+            return self.get_response(request)
 
         # Either they did not provide an authorization header or
         # something in the authorization attempt failed. Send a 401
@@ -100,31 +194,8 @@ class TryBasicAuthMiddleware(BasicAuthMiddleware):
         # lookup, if user was already authenticated
         request.user = get_user(request)
         if request.user.is_authenticated:
-            try:
-                request.organisation = UserProfile.objects.get(user=request.user).organisation
-            except Exception:
-                pass
+            request.organisation = get_user_organisation(request.user)
             return self.get_response(request)
 
-        if 'HTTP_AUTHORIZATION' in request.META:
-            auth = request.META['HTTP_AUTHORIZATION'].split()
-            if len(auth) == 2:
-                # NOTE: We only support basic authentication for now.
-                #
-                if auth[0].lower() == "basic":
-                    auth_data = auth[1]
-                    auth_data += "=" * ((4 - len(auth_data) % 4) % 4)
-                    auth_data = base64.b64decode(auth_data).decode('utf-8')
-                    uname, passwd = auth_data.split(':', 1)
-                    user = authenticate(username=uname, password=passwd)
-                    if user:
-                        if user.is_active:
-                            request.user = user
-                            try:
-                                request.organisation = UserProfile.objects.get(user=user).organisation
-                            except Exception:
-                                pass
-                            login(request, user)
-                            return self.get_response(request)
-
+        self.authorize(request)
         return self.get_response(request)
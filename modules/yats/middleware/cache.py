@@ -1,168 +1,243 @@
 # -*- coding: utf-8 -*-
-from django.middleware.cache import UpdateCacheMiddleware, FetchFromCacheMiddleware
-from django.core.cache import cache
+"""
+per user response cache for read heavy pages
+
+MIDDLEWARE = [..., 'yats.middleware.auth.OrgaAdditionMiddleware', 'yats.middleware.cache.yatsCacheMiddleware']
+
+only GET/HEAD of paths matching CACHE_MIDDLEWARE_URLS are cached:
+
+CACHE_MIDDLEWARE_URLS = (
+    # path regex, seconds, data shown on the page
+    (r'^tickets/list/$', 60, ('tickets',)),
+    (r'^board/', 60, ('tickets', 'boards')),
+)
+
+responses marked private are never stored: the ticket and doc pages answer
+conditional GETs with their own ETag instead (yats.request.setPageValidators).
+
+every key contains the version of the data the page shows, seen from the user:
+ticket changes bump the version of the ticket's organisation (customers only see
+their own) and the one of the staff, so a change in one organisation leaves the
+pages of all other organisations in the cache.
+"""
 from django.conf import settings
+from django.core.cache import caches
 from django.utils.encoding import iri_to_uri
-from django.utils.cache import get_max_age, patch_response_headers
 from django.utils.translation import get_language
-from django.core.cache import get_cache, DEFAULT_CACHE_ALIAS
 
 import hashlib
-import warnings
+import re
+import time
+
+DEFAULT_URLS = (
+    (r'^tickets/list/$', 60, ('tickets',)),
+    (r'^board/', 60, ('tickets', 'boards')),
+    (r'^kanban/$', 60, ('tickets',)),
+)
+
+_patterns = None
+
+
+def get_cache():
+    return caches[getattr(settings, 'CACHE_MIDDLEWARE_ALIAS', 'default')]
+
+
+def get_key_prefix():
+    return getattr(settings, 'CACHE_MIDDLEWARE_KEY_PREFIX', '')
+
+
+def get_patterns():
+    global _patterns
+    urls = getattr(settings, 'CACHE_MIDDLEWARE_URLS', DEFAULT_URLS)
+    if _patterns is None or _patterns[0] is not urls:
+        _patterns = (urls, [(re.compile(regex), timeout, data) for regex, timeout, data in urls])
+    return _patterns[1]
+
+
+def response_cache_enabled():
+    return 'yats.middleware.cache.yatsCacheMiddleware' in settings.MIDDLEWARE
+
+
+def version_key(scope):
+    return '%s.respcache.version.%s' % (get_key_prefix(), scope)
+
+
+def get_versions(scopes):
+    cache = get_cache()
+    keys = [version_key(scope) for scope in scopes]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            # never start at 0 again, pages of an evicted version could still be around
+            cache.add(key, int(time.time() * 1000), None)
+            versions[key] = cache.get(key)
+    return [str(versions[key]) for key in keys]
+
+
+def bump_versions(scopes):
+    cache = get_cache()
+    for scope in scopes:
+        key = version_key(scope)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.add(key, int(time.time() * 1000), None)
+
+
+def get_scopes(request, data):
+    scopes = ['global', 'user.%s' % request.user.pk]
+    for name in data:
+        if name == 'tickets':
+            if request.user.is_staff:
+                scopes.append('tickets.all')
+            else:
+                scopes.append('tickets.org.%s' % getattr(getattr(request, 'organisation', None), 'pk', None))
+        elif name == 'boards':
+            scopes.append('boards.user.%s' % request.user.pk)
+        else:
+            scopes.append(name)
+    return scopes
 
-md5_constructor = hashlib.md5
-md5_hmac = md5_constructor
-sha_constructor = hashlib.sha1
-sha_hmac = sha_constructor
 
-def get_cache_key(request, key_prefix=None):
+def get_cached_models():
     """
-    depending on user, request-method gererate a key with respect to
-    GET with querystring and POST with data
+    models changed_scopes knows, only their saves and deletes are connected to the cache
     """
-    if key_prefix is None:
-        key_prefix = settings.CACHE_MIDDLEWARE_KEY_PREFIX
-
-    if request.method in ('GET', 'HEAD'):
-        method = 'GET'
-        content = md5_constructor(request.GET.urlencode())
-    elif request.method == 'POST':
-        method = 'POST'
-        content = md5_constructor(request.raw_post_data)
-    else:
-        method = ''
-        content = md5_constructor()
-    path = md5_constructor(iri_to_uri(request.path))
-
-    if request.user.is_authenticated:
-        user = iri_to_uri(request.user)
-    else:
-        user = ''
-
-    # on response lang was DE again although on request it was EN, so cache that :-)
-    if hasattr(request, '_cache_lang'):
-        lang = request._cache_lang
-    else:
-        lang = get_language()
-        request._cache_lang = lang
-
-    return '%s.%s.%s.%s.%s.%s.%s' % (
-               request.get_host(), key_prefix, lang, method, user, path.hexdigest(), content.hexdigest())
-
-class yatsUpdateCacheMiddleware(UpdateCacheMiddleware):
+    from yats.models import tickets, tickets_comments, tickets_files, tickets_participants, tickets_ignorants, tickets_history, boards, UserProfile
+    from yats.models import organisation, ticket_type, ticket_priority, ticket_resolution, ticket_flow, ticket_flow_edges
+    from yats.shortcuts import get_ticket_model
+
+    # signals go to the exact class, TICKET_CLASS may be a subclass
+    return set([
+        tickets, get_ticket_model(), tickets_comments, tickets_files, tickets_participants, tickets_ignorants, tickets_history, boards, UserProfile,
+        organisation, ticket_type, ticket_priority, ticket_resolution, ticket_flow, ticket_flow_edges,
+    ])
+
+
+def changed_scopes(instance):
+    """
+    scopes whose pages show the saved or deleted instance
     """
-    extending djangos standard cache mechanism for POST
+    from yats.models import tickets, tickets_comments, tickets_files, tickets_participants, tickets_ignorants, tickets_history, boards, UserProfile
+    from yats.models import organisation, ticket_type, ticket_priority, ticket_resolution, ticket_flow, ticket_flow_edges
+
+    if isinstance(instance, (tickets_comments, tickets_files, tickets_participants, tickets_ignorants, tickets_history)):
+        customer = tickets.objects.filter(pk=instance.ticket_id).values_list('customer_id', flat=True).first()
+        return ['tickets.all', 'tickets.org.%s' % customer]
+    if isinstance(instance, tickets):
+        return ['tickets.all', 'tickets.org.%s' % instance.customer_id]
+    if isinstance(instance, boards):
+        return ['boards.user.%s' % instance.c_user_id]
+    if isinstance(instance, UserProfile):
+        return ['user.%s' % instance.user_id]
+    if isinstance(instance, (organisation, ticket_type, ticket_priority, ticket_resolution, ticket_flow, ticket_flow_edges)):
+        return ['global']
+    return []
+
+
+def invalidate_response_cache(instance):
+    if not response_cache_enabled():
+        return
+    scopes = changed_scopes(instance)
+    if scopes:
+        bump_versions(scopes)
+
+
+def invalidate_seen(user):
     """
+    seen flags of tickets_participants are set with queryset.update(), no signal tells the cache
+    """
+    if not response_cache_enabled():
+        return
+    # lists, boards and kanban all carry the user scope
+    bump_versions(['user.%s' % getattr(user, 'pk', user)])
 
-    def process_response(self, request, response):
-        """Sets the cache, if needed."""
-        if not self._should_update_cache(request, response):
-            # We don't need to update the cache, just return.
-            return response
-        if response.streaming or response.status_code != 200:
-            return response
-        # Try to get the timeout from the "max-age" section of the "Cache-
-        # Control" header before reverting to using the default cache_timeout
-        # length.
-        timeout = get_max_age(response)
-        if timeout == None:
-            timeout = self.cache_timeout
-        elif timeout == 0:
-            # max-age was set to 0, don't bother caching.
-            return response
-        patch_response_headers(response, timeout)
-        if timeout:
-            #cache_key = learn_cache_key(request, response, timeout, self.key_prefix, cache=self.cache)
-            cache_key = get_cache_key(request, key_prefix=None)
-            if hasattr(response, 'render') and callable(response.render):
-                response.add_post_render_callback(
-                    lambda r: self.cache.set(cache_key, r, timeout)
-                )
-            else:
-                self.cache.set(cache_key, response, timeout)
-        return response
 
-class yatsFetchFromCacheMiddleware(FetchFromCacheMiddleware):
+def get_cache_key(request, data):
     """
-    extending djangos standard cache mechanism for POST
+    depending on user, language, the user's view of the data and path with querystring
     """
+    path = hashlib.md5(iri_to_uri(request.get_full_path()).encode('utf-8')).hexdigest()
+    versions = hashlib.md5('.'.join(get_versions(get_scopes(request, data))).encode('ascii')).hexdigest()
+    # the csrf token in the page belongs to the browser
+    # and so do the breadcrumbs
+    csrf = hashlib.md5((request.META.get('CSRF_COOKIE', '') + request.COOKIES.get(getattr(settings, 'BREADCRUMBS_COOKIE_NAME', 'yats_breadcrumbs'), '')).encode('utf-8')).hexdigest()[:8]
+    return '%s.respcache.%s.%s.%s.%s.%s.%s' % (get_key_prefix(), request.get_host(), get_language(), request.user.pk, csrf, versions, path)
 
-    def process_request(self, request):
-        """
-        Checks whether the page is already cached and returns the cached
-        version if available.
-        """
-        if not request.method in ('GET', 'HEAD'):
-            request._cache_update_cache = False
-            return None # Don't bother checking the cache.
-
-        # try and get the cached GET response
-        #cache_key = get_cache_key(request, self.key_prefix, 'GET', cache=self.cache)
-        cache_key = get_cache_key(request, self.key_prefix)
-        if cache_key is None:
-            request._cache_update_cache = True
-            return None # No cache information available, need to rebuild.
-        response = self.cache.get(cache_key, None)
-        # if it wasn't found and we are looking for a HEAD, try looking just for that
-        if response is None and request.method == 'HEAD':
-            #cache_key = get_cache_key(request, self.key_prefix, 'HEAD', cache=self.cache)
-            cache_key = get_cache_key(request, self.key_prefix)
-            response = self.cache.get(cache_key, None)
-
-        if response is None:
-            request._cache_update_cache = True
-            return None # No cache information available, need to rebuild.
-
-        # hit, return cached response
-        request._cache_update_cache = False
-        return response
 
-class yatsCacheMiddleware(yatsUpdateCacheMiddleware, yatsFetchFromCacheMiddleware):
-    """
-    Cache middleware that provides basic behavior for many simple sites.
+def count(name, result):
+    cache = get_cache()
+    key = '%s.respcache.stats.%s.%s' % (get_key_prefix(), name, result)
+    try:
+        cache.incr(key)
+    except ValueError:
+        if not cache.add(key, 1, None):
+            cache.incr(key)
+
 
-    Also used as the hook point for the cache decorator, which is generated
-    using the decorator-from-middleware utility.
+def get_stats():
     """
-    def __init__(self, cache_timeout=None, cache_anonymous_only=None, **kwargs):
-        # We need to differentiate between "provided, but using default value",
-        # and "not provided". If the value is provided using a default, then
-        # we fall back to system defaults. If it is not provided at all,
-        # we need to use middleware defaults.
+    [(url regex, hits, misses)]
+    """
+    cache = get_cache()
+    result = []
+    for regex, timeout, data in getattr(settings, 'CACHE_MIDDLEWARE_URLS', DEFAULT_URLS):
+        result.append((regex, cache.get('%s.respcache.stats.%s.hit' % (get_key_prefix(), regex), 0), cache.get('%s.respcache.stats.%s.miss' % (get_key_prefix(), regex), 0)))
+    return result
 
-        cache_kwargs = {}
 
-        try:
-            self.key_prefix = kwargs['key_prefix']
-            if self.key_prefix is not None:
-                cache_kwargs['KEY_PREFIX'] = self.key_prefix
-            else:
-                self.key_prefix = ''
-        except KeyError:
-            self.key_prefix = settings.CACHE_MIDDLEWARE_KEY_PREFIX
-            cache_kwargs['KEY_PREFIX'] = self.key_prefix
+def reset_stats():
+    cache = get_cache()
+    for regex, timeout, data in getattr(settings, 'CACHE_MIDDLEWARE_URLS', DEFAULT_URLS):
+        cache.delete_many(['%s.respcache.stats.%s.hit' % (get_key_prefix(), regex), '%s.respcache.stats.%s.miss' % (get_key_prefix(), regex)])
 
-        try:
-            self.cache_alias = kwargs['cache_alias']
-            if self.cache_alias is None:
-                self.cache_alias = DEFAULT_CACHE_ALIAS
-            if cache_timeout is not None:
-                cache_kwargs['TIMEOUT'] = cache_timeout
-        except KeyError:
-            self.cache_alias = settings.CACHE_MIDDLEWARE_ALIAS
-            if cache_timeout is None:
-                cache_kwargs['TIMEOUT'] = settings.CACHE_MIDDLEWARE_SECONDS
-            else:
-                cache_kwargs['TIMEOUT'] = cache_timeout
 
-        if cache_anonymous_only is None:
-            self.cache_anonymous_only = getattr(settings, 'CACHE_MIDDLEWARE_ANONYMOUS_ONLY', False)
-        else:
-            self.cache_anonymous_only = cache_anonymous_only
+def has_messages(request):
+    storage = getattr(request, '_messages', None)
+    return storage is not None and bool(storage._queued_messages or storage._loaded_messages)
 
-        if self.cache_anonymous_only:
-            msg = "CACHE_MIDDLEWARE_ANONYMOUS_ONLY has been deprecated and will be removed in Django 1.8."
-            warnings.warn(msg, PendingDeprecationWarning, stacklevel=1)
 
-        self.cache = get_cache(self.cache_alias, **cache_kwargs)
-        self.cache_timeout = self.cache.default_timeout
+class yatsCacheMiddleware:
+    """
+    must come after the auth and organisation middlewares
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def match(self, request):
+        if request.method not in ('GET', 'HEAD') or not request.user.is_authenticated:
+            return None
+        path = request.path[1:]
+        for pattern in get_patterns():
+            if pattern[0].match(path):
+                return pattern
+        return None
+
+    def __call__(self, request):
+        pattern = self.match(request)
+        # pending messages are shown by the next page, it must be rendered
+        if pattern is None or has_messages(request):
+            return self.get_response(request)
+
+        regex, timeout, data = pattern
+        cache = get_cache()
+        cache_key = get_cache_key(request, data)
+        response = cache.get(cache_key)
+        if response is not None:
+            count(regex.pattern, 'hit')
+            response['X-Cache'] = 'HIT'
+            return response
+
+        count(regex.pattern, 'miss')
+        response = self.get_response(request)
+        if self.should_store(request, response):
+            cache.set(cache_key, response, timeout)
+        response['X-Cache'] = 'MISS'
+        return response
+
+    def should_store(self, request, response):
+        if response.status_code != 200 or response.streaming or response.cookies:
+            return False
+        if 'no-store' in response.get('Cache-Control', '') or 'private' in response.get('Cache-Control', ''):
+            return False
+        return not has_messages(request)
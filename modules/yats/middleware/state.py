@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+"""
+breadcrumbs without session writes
+
+MIDDLEWARE = [..., 'yats.middleware.auth.OrgaAdditionMiddleware', 'yats.middleware.state.yatsStateMiddleware', ...]
+
+templates find them in request.breadcrumbs, the signed cookie is only sent
+again when add_breadcrumbs changed them.
+
+with SESSION_SAVE_EVERY_REQUEST = False a session would end SESSION_COOKIE_AGE
+after the login, the session of an active user is saved (and gets a new expiry)
+once per SESSION_REFRESH_INTERVAL seconds instead, default one day.
+"""
+from django.conf import settings
+from django.utils.functional import SimpleLazyObject
+from yats.shortcuts import get_breadcrumbs, save_breadcrumbs
+
+import time
+
+
+def refresh_session(request):
+    session = getattr(request, 'session', None)
+    user = getattr(request, 'user', None)
+    if session is None or user is None or settings.SESSION_SAVE_EVERY_REQUEST or session.get_expire_at_browser_close():
+        return
+    if not user.is_authenticated:
+        return
+    now = int(time.time())
+    if now - session.get('yats_refreshed', 0) >= getattr(settings, 'SESSION_REFRESH_INTERVAL', 86400):
+        session['yats_refreshed'] = now
+
+
+def yatsStateMiddleware(get_response):
+
+    def middleware(request):
+        request.breadcrumbs = SimpleLazyObject(lambda: get_breadcrumbs(request))
+        response = get_response(request)
+        refresh_session(request)
+        return save_breadcrumbs(request, response)
+
+    return middleware
@@ -0,0 +1,26 @@
+# Generated by Django 5.2.18 on 2026-10-19 10:15
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('yats', '0027_auto_20210211_1723'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='search_queue',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('django_ct', models.CharField(max_length=100)),
+                ('django_id', models.CharField(max_length=40)),
+                ('c_date', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'unique_together': {('django_ct', 'django_id')},
+            },
+        ),
+    ]
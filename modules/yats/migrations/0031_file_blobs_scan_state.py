@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-19 16:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('yats', '0030_upload_sessions'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='file_blobs',
+            name='scan_state',
+            field=models.SmallIntegerField(default=1),
+        ),
+        migrations.AddField(
+            model_name='file_blobs',
+            name='virus',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-19 18:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('yats', '0031_file_blobs_scan_state'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tickets_files',
+            name='has_preview',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='docs_files',
+            name='has_preview',
+            field=models.BooleanField(default=False),
+        ),
+    ]
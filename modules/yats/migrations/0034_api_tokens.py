@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-19 20:05
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('yats', '0033_userprofile_search_state'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='api_tokens',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(blank=True, default='', max_length=255)),
+                ('key', models.CharField(max_length=64, unique=True)),
+                ('c_date', models.DateTimeField(default=django.utils.timezone.now)),
+                ('last_used', models.DateTimeField(blank=True, null=True)),
+                ('expires', models.DateTimeField(blank=True, null=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-20 09:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('yats', '0034_api_tokens'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='docs_files',
+            name='size',
+            field=models.PositiveBigIntegerField(),
+        ),
+    ]
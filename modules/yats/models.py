@@ -2,12 +2,13 @@
 from django.db import models
 from django.conf import settings
 from django.utils.translation import gettext_lazy as _
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete
 from django.utils import timezone
 from django.utils.text import slugify
 from markdownx.models import MarkdownxField
 
 import json
+import os
 import uuid
 
 YES_NO_DONT_KNOW = (
@@ -63,6 +64,8 @@ class UserProfile(models.Model):
     signal = models.CharField(max_length=255, null=True, blank=True)
     day_since_closed_tickets = models.SmallIntegerField(default=5)
     impersonate_alias = models.CharField(max_length=255, null=True, blank=True)
+    # last ticket search, see yats.shortcuts.get_last_search
+    search_state = models.TextField(null=True, blank=True)
 
     def save(self, *args, **kwargs):
         if not self.pk:
@@ -221,6 +224,9 @@ class tickets(base):
         super(tickets, self).save(*args, **kwargs)
         tickets_participants.objects.filter(ticket=self).update(seen=False)
         tickets_ignorants.objects.filter(ticket=self).delete()
+        # post_save invalidated the cached pages before the seen flags were reset
+        from yats.middleware.cache import invalidate_response_cache
+        invalidate_response_cache(self)
 
     def get_absolute_url(self):
         return "/tickets/view/%i/" % self.id
@@ -252,13 +258,26 @@ class tickets_comments(base):
 
         tickets.objects.filter(id=self.ticket_id).update(last_action_date=self.c_date, hasComments=tickets_comments.objects.filter(ticket=self.ticket_id, active_record=True).count() > 0)
 
+class file_blobs(models.Model):
+    # content addressed, shared by tickets_files and docs_files
+    sha256 = models.CharField(max_length=64, primary_key=True)
+    md5 = models.CharField(max_length=32)
+    size = models.BigIntegerField()
+    refcount = models.PositiveIntegerField(default=0)
+    c_date = models.DateTimeField(default=timezone.now)
+    scan_state = models.SmallIntegerField(default=1)  # 0 = waiting for the virus scan, 1 = clean, 2 = infected
+    virus = models.CharField(max_length=255, blank=True, default='')
+
 class tickets_files(base):
     ticket = models.ForeignKey(tickets, on_delete=models.CASCADE)
     name = models.CharField(max_length=255)
     content_type = models.CharField(max_length=255)
-    size = models.PositiveIntegerField()
+    size = models.PositiveBigIntegerField()
     public = models.BooleanField(default=False)
     checksum = models.CharField(max_length=255, null=True, blank=True)
+    blob = models.ForeignKey(file_blobs, on_delete=models.PROTECT, null=True, blank=True, related_name='+')
+    # set by the preview worker, pages never look at the disk
+    has_preview = models.BooleanField(default=False)
 
     def save(self, *args, **kwargs):
         super(tickets_files, self).save(*args, **kwargs)
@@ -323,9 +342,93 @@ class docs_files(base):
     doc = models.ForeignKey(docs, on_delete=models.CASCADE)
     name = models.CharField(max_length=255)
     content_type = models.CharField(max_length=255)
-    size = models.PositiveIntegerField()
+    size = models.PositiveBigIntegerField()
     public = models.BooleanField(default=False)
     checksum = models.CharField(max_length=255, null=True, blank=True)
+    blob = models.ForeignKey(file_blobs, on_delete=models.PROTECT, null=True, blank=True, related_name='+')
+    has_preview = models.BooleanField(default=False)
 
     class Meta:
         ordering = ['c_date']
+
+def release_file_blob(sender, instance, **kwargs):
+    if instance.blob_id:
+        from yats.blobstore import release_blob
+        release_blob(instance.blob_id)
+
+post_delete.connect(release_file_blob, sender=tickets_files)
+post_delete.connect(release_file_blob, sender=docs_files)
+
+class search_queue(models.Model):
+    django_ct = models.CharField(max_length=100)
+    django_id = models.CharField(max_length=40)
+    c_date = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        unique_together = ('django_ct', 'django_id')
+
+class upload_sessions(models.Model):
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    ticket = models.ForeignKey(tickets, on_delete=models.CASCADE)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='+')
+    name = models.CharField(max_length=255)
+    content_type = models.CharField(max_length=255)
+    length = models.BigIntegerField()
+    offset = models.BigIntegerField(default=0)
+    c_date = models.DateTimeField(default=timezone.now)
+    u_date = models.DateTimeField(default=timezone.now)
+
+class api_tokens(models.Model):
+    """
+    tokens for scripts and caldav clients, see yats.middleware.auth.create_api_token
+    """
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='+')
+    name = models.CharField(max_length=255, blank=True, default='')
+    # sha256 of the token, the token is only shown once
+    key = models.CharField(max_length=64, unique=True)
+    c_date = models.DateTimeField(default=timezone.now)
+    last_used = models.DateTimeField(null=True, blank=True)
+    expires = models.DateTimeField(null=True, blank=True)
+
+def remove_upload_part(sender, instance, **kwargs):
+    from yats.uploadhandler import get_session_path, drop_session_hashers
+    drop_session_hashers(instance.pk)
+    path = get_session_path(instance.pk)
+    if os.path.isfile(path):
+        os.unlink(path)
+
+post_delete.connect(remove_upload_part, sender=upload_sessions)
+
+def invalidate_response_cache(sender, instance, **kwargs):
+    from yats.middleware.cache import invalidate_response_cache
+    invalidate_response_cache(instance)
+
+def invalidate_field_options(sender, update_fields=None, **kwargs):
+    # option lists of the api, see yats.fieldschema. a login only sets last_login
+    if update_fields and set(update_fields) == {'last_login'}:
+        return
+    from yats.fieldschema import invalidate_field_options
+    invalidate_field_options(sender)
+
+def connect_cache_invalidation():
+    # from yats.apps.YatsConfig.ready, TICKET_CLASS and the models its fields reference are loaded then
+    from yats.middleware.cache import get_cached_models
+    from yats.fieldschema import get_option_models
+
+    for sender in get_cached_models():
+        post_save.connect(invalidate_response_cache, sender=sender, dispatch_uid='yats_response_cache_save')
+        post_delete.connect(invalidate_response_cache, sender=sender, dispatch_uid='yats_response_cache_delete')
+    for sender in get_option_models():
+        post_save.connect(invalidate_field_options, sender=sender, dispatch_uid='yats_field_options_save')
+        post_delete.connect(invalidate_field_options, sender=sender, dispatch_uid='yats_field_options_delete')
+
+def invalidate_organisation_cache(sender, instance, update_fields=None, **kwargs):
+    # a login only sets last_login
+    if update_fields and set(update_fields) == {'last_login'}:
+        return
+    from yats.shortcuts import bump_orga_version
+    bump_orga_version()
+
+for sender in (UserProfile, organisation, settings.AUTH_USER_MODEL):
+    post_save.connect(invalidate_organisation_cache, sender=sender, dispatch_uid='yats_orga_cache_save')
+    post_delete.connect(invalidate_organisation_cache, sender=sender, dispatch_uid='yats_orga_cache_delete')
@@ -1,11 +1,20 @@
 # -*- coding: utf-8 -*-
-from django.http import StreamingHttpResponse
-from wsgiref.util import FileWrapper
+from django.conf import settings
+from django.http import StreamingHttpResponse, HttpResponse, FileResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.translation import get_language
+from django.utils.http import http_date, parse_http_date_safe
+import calendar
+import hashlib
 import mimetypes
 import os
 import re
+import uuid
 
-range_re = re.compile(r'bytes\s*=\s*(\d+)\s*-\s*(\d*)', re.I)
+range_re = re.compile(r'^\s*(\d*)\s*-\s*(\d*)\s*$')
+
+# more ranges than this are answered with the whole file
+MAX_RANGES = 16
 
 class RangeFileWrapper:
     def __init__(self, filelike, blksize=8192, offset=0, length=None):
@@ -40,25 +49,171 @@ class RangeFileWrapper:
             self.remaining -= len(data)
             return data
 
-def streamRanges(request, path, content_type=None):
-    range_header = request.META.get('HTTP_RANGE', '').strip()
-    range_match = range_re.match(range_header)
-    size = os.path.getsize(path)
+class MultiRangeFileWrapper:
+    def __init__(self, filelike, ranges, size, content_type, boundary, blksize=8192):
+        self.filelike = filelike
+        self.ranges = ranges
+        self.size = size
+        self.content_type = content_type
+        self.boundary = boundary
+        self.blksize = blksize
+
+    def part_header(self, first_byte, last_byte):
+        return ('\r\n--%s\r\nContent-Type: %s\r\nContent-Range: bytes %s-%s/%s\r\n\r\n' % (self.boundary, self.content_type, first_byte, last_byte, self.size)).encode('ascii')
+
+    def footer(self):
+        return ('\r\n--%s--\r\n' % self.boundary).encode('ascii')
+
+    def length(self):
+        return sum(len(self.part_header(first, last)) + last - first + 1 for first, last in self.ranges) + len(self.footer())
+
+    def close(self):
+        self.filelike.close()
+
+    def __iter__(self):
+        for first_byte, last_byte in self.ranges:
+            yield self.part_header(first_byte, last_byte)
+            for data in RangeFileWrapper(self.filelike, self.blksize, first_byte, last_byte - first_byte + 1):
+                yield data
+        yield self.footer()
+
+def getBlockSize(length):
+    # few large reads for big files, without holding much memory per download
+    return min(max(length // 16, 64 * 1024), 1024 * 1024)
+
+def parseRanges(header, size):
+    """
+    list of (first_byte, last_byte), None if the header is missing or not usable, [] if unsatisfiable
+    """
+    if not header or not header.strip().lower().startswith('bytes='):
+        return None
+    ranges = []
+    for spec in header.split('=', 1)[1].split(','):
+        match = range_re.match(spec)
+        if not match:
+            return None
+        first_byte, last_byte = match.groups()
+        if not first_byte and not last_byte:
+            return None
+        if not first_byte:
+            # suffix range: last n bytes
+            first_byte = max(size - int(last_byte), 0)
+            last_byte = size - 1
+        else:
+            first_byte = int(first_byte)
+            last_byte = min(int(last_byte), size - 1) if last_byte else size - 1
+        if first_byte > last_byte:
+            continue
+        ranges.append((first_byte, last_byte))
+    if len(ranges) > MAX_RANGES:
+        return None
+    return ranges
+
+def rangeApplies(request, etag, last_modified):
+    if_range = request.META.get('HTTP_IF_RANGE', '').strip()
+    if not if_range:
+        return True
+    if if_range.startswith('"') or if_range.startswith('W/'):
+        # weak validators never match for ranges
+        return etag is not None and if_range == etag
+    date = parse_http_date_safe(if_range)
+    return date is not None and int(last_modified) <= date
+
+def offloadResponse(path, content_type):
+    """
+    FILE_DOWNLOAD_BACKEND = 'xsendfile': apache mod_xsendfile / lighttpd
+    FILE_DOWNLOAD_BACKEND = 'xaccel': nginx, FILE_DOWNLOAD_ACCEL_ROOT is the internal location aliasing FILE_UPLOAD_PATH
+    the web server then handles ranges itself
+    """
+    backend = getattr(settings, 'FILE_DOWNLOAD_BACKEND', None)
+    if backend == 'xsendfile':
+        resp = HttpResponse(content_type=content_type)
+        resp['X-Sendfile'] = path
+        return resp
+    if backend == 'xaccel':
+        root = str(settings.FILE_UPLOAD_PATH)
+        relative = os.path.relpath(path, root)
+        resp = HttpResponse(content_type=content_type)
+        resp['X-Accel-Redirect'] = '%s/%s' % (settings.FILE_DOWNLOAD_ACCEL_ROOT.rstrip('/'), relative)
+        return resp
+    return None
+
+def streamRanges(request, path, content_type=None, etag=None):
+    stat = os.stat(path)
+    size = stat.st_size
     if not content_type:
         content_type, encoding = mimetypes.guess_type(path)
         content_type = content_type or 'application/octet-stream'
-    if range_match:
-        first_byte, last_byte = range_match.groups()
-        first_byte = int(first_byte) if first_byte else 0
-        last_byte = int(last_byte) if last_byte else size - 1
-        if last_byte >= size:
-            last_byte = size - 1
-        length = last_byte - first_byte + 1
-        resp = StreamingHttpResponse(RangeFileWrapper(open(path, 'rb'), offset=first_byte, length=length), status=206, content_type=content_type)
-        resp['Content-Length'] = str(length)
-        resp['Content-Range'] = 'bytes %s-%s/%s' % (first_byte, last_byte, size)
-    else:
-        resp = StreamingHttpResponse(FileWrapper(open(path, 'rb')), content_type=content_type)
-        resp['Content-Length'] = str(size)
+
+    resp = get_conditional_response(request, etag=etag, last_modified=int(stat.st_mtime))
+    if resp is None:
+        resp = offloadResponse(path, content_type)
+    if resp is None:
+        ranges = None
+        if rangeApplies(request, etag, stat.st_mtime):
+            ranges = parseRanges(request.META.get('HTTP_RANGE', ''), size)
+
+        if ranges == []:
+            resp = HttpResponse(status=416)
+            resp['Content-Range'] = 'bytes */%s' % size
+        elif ranges and len(ranges) == 1:
+            first_byte, last_byte = ranges[0]
+            length = last_byte - first_byte + 1
+            resp = StreamingHttpResponse(RangeFileWrapper(open(path, 'rb'), blksize=getBlockSize(length), offset=first_byte, length=length), status=206, content_type=content_type)
+            resp['Content-Length'] = str(length)
+            resp['Content-Range'] = 'bytes %s-%s/%s' % (first_byte, last_byte, size)
+        elif ranges:
+            wrapper = MultiRangeFileWrapper(open(path, 'rb'), ranges, size, content_type, uuid.uuid4().hex, blksize=getBlockSize(size))
+            resp = StreamingHttpResponse(wrapper, status=206, content_type='multipart/byteranges; boundary=%s' % wrapper.boundary)
+            resp['Content-Length'] = str(wrapper.length())
+        else:
+            # wsgi.file_wrapper of the server sends it with os.sendfile
+            resp = FileResponse(open(path, 'rb'), content_type=content_type)
+            resp.block_size = getBlockSize(size)
+            if 'Content-Disposition' in resp:
+                del resp['Content-Disposition']
+            resp['Content-Length'] = str(size)
+
+    if etag:
+        resp['ETag'] = etag
+    resp['Last-Modified'] = http_date(stat.st_mtime)
     resp['Accept-Ranges'] = 'bytes'
     return resp
+
+
+def pageETag(request, *parts):
+    """
+    weak etag of a rendered page, the same data looks different for other users and languages
+    and the page carries the csrf token of the browser
+    """
+    from yats.shortcuts import get_breadcrumbs_cookie_name
+    # the breadcrumbs are part of every page
+    key = '|'.join([str(part) for part in parts] + [str(request.user.pk), get_language() or '', request.META.get('CSRF_COOKIE', ''), request.COOKIES.get(get_breadcrumbs_cookie_name(), '')])
+    return 'W/"%s"' % hashlib.md5(key.encode('utf-8')).hexdigest()
+
+
+def conditionalPage(request, etag, last_modified):
+    """
+    304 if the browser has the current page, None if it needs to be rendered
+    """
+    if etag is None or request.method not in ('GET', 'HEAD'):
+        return None
+    # pending messages are shown by the next rendered page
+    storage = getattr(request, '_messages', None)
+    if storage is not None and (storage._queued_messages or storage._loaded_messages):
+        return None
+    response = get_conditional_response(request, etag=etag, last_modified=calendar.timegm(last_modified.utctimetuple()) if last_modified else None)
+    if response is not None:
+        setPageValidators(response, etag, last_modified)
+    return response
+
+
+def setPageValidators(response, etag, last_modified):
+    if etag is None:
+        return response
+    response['ETag'] = etag
+    if last_modified:
+        response['Last-Modified'] = http_date(calendar.timegm(last_modified.utctimetuple()))
+    # browsers ask again every time, shared caches keep out
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
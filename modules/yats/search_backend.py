@@ -0,0 +1,717 @@
+# -*- coding: utf-8 -*-
+"""
+haystack engine keeping the index inside the django database
+
+sqlite uses a fts5 table, postgresql a tsvector column with gin index,
+any other vendor falls back to LIKE scans over the same document table.
+
+HAYSTACK_CONNECTIONS = {
+    'default': {
+        'ENGINE': 'yats.search_backend.DatabaseEngine',
+        # optional
+        'DATABASE': 'default',
+        'TABLE': 'yats_search',
+    },
+}
+"""
+import re
+import datetime
+
+from collections import Counter
+
+from django.conf import settings
+from django.db import connections as db_connections, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from haystack.backends import BaseEngine, BaseSearchBackend, BaseSearchQuery, SearchNode, log_query
+from haystack.exceptions import SearchBackendError
+from haystack.models import SearchResult
+from haystack.utils import get_identifier, get_model_ct
+
+from yats.spelling import get_spelling_index
+
+WORD_RE = re.compile(r'\w+', re.UNICODE)
+PHRASE_RE = re.compile(r'"(?P<phrase>.*?)"')
+
+# index fields stored as real columns, everything else only lands in the text columns
+TEXT_COLUMNS = ('caption', 'text', 'content_auto')
+FILTER_COLUMNS = ('closed', 'customer', 'last_action_date', 'django_ct', 'django_id')
+SORT_COLUMNS = ('caption', 'closed', 'customer', 'last_action_date', 'django_id', 'score')
+
+
+def words(value):
+    return WORD_RE.findall(str(value).lower())
+
+
+def term_scope(customer):
+    # spelling dictionary scopes: '*' counts all documents (staff), '' those without a customer (docs)
+    if customer is None:
+        return ''
+    return str(getattr(customer, 'pk', customer))
+
+
+def document_terms(caption, text, customer=None):
+    # spelling dictionary, document frequency of every term as (scope, term)
+    terms = set([word[:40] for word in words('%s %s' % (caption, text)) if len(word) >= 3 and not word.isdigit()])
+    return set([(scope, term) for scope in ('*', term_scope(customer)) for term in terms])
+
+
+class BaseDialect(object):
+    nulls_last = ' NULLS LAST'
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.table = backend.table
+
+    @property
+    def connection(self):
+        return db_connections[self.backend.database]
+
+    def setup(self, cursor):
+        raise NotImplementedError
+
+    def setup_terms(self, cursor):
+        # the first version was not split by customer, setup rebuilds it
+        if '%s_terms' % self.table in self.connection.introspection.table_names(cursor):
+            columns = [column.name for column in self.connection.introspection.get_table_description(cursor, '%s_terms' % self.table)]
+            if 'scope' not in columns:
+                cursor.execute('DROP TABLE %s_terms' % self.table)
+        cursor.execute('CREATE TABLE IF NOT EXISTS %s_terms (scope VARCHAR(20) NOT NULL, term VARCHAR(100) NOT NULL, freq INTEGER NOT NULL, PRIMARY KEY (scope, term))' % self.table)
+
+    def write(self, cursor, rows):
+        deltas = self.old_terms(cursor, [(row['django_ct'], row['django_id']) for row in rows])
+        cursor.executemany(
+            'DELETE FROM %s_document WHERE django_ct = %%s AND django_id = %%s' % self.table,
+            [(row['django_ct'], row['django_id']) for row in rows]
+        )
+        cursor.executemany(self.insert_sql(), [self.insert_params(row) for row in rows])
+        for row in rows:
+            deltas.update(document_terms(row['caption'], row['text'], row['customer']))
+        self.add_terms(cursor, deltas)
+
+    def old_terms(self, cursor, keys):
+        """
+        negative term counts of the currently indexed versions
+        """
+        deltas = Counter()
+        by_ct = {}
+        for django_ct, django_id in keys:
+            by_ct.setdefault(django_ct, []).append(django_id)
+        for django_ct, ids in by_ct.items():
+            for pos in range(0, len(ids), 500):
+                chunk = ids[pos:pos + 500]
+                cursor.execute('SELECT caption, text, customer FROM %s_document WHERE django_ct = %%s AND django_id IN (%s)' % (self.table, ', '.join(['%s'] * len(chunk))), [django_ct] + chunk)
+                for caption, text, customer in cursor.fetchall():
+                    deltas.subtract(document_terms(caption, text, customer))
+        return deltas
+
+    def upsert_terms_sql(self):
+        return 'INSERT INTO %(t)s_terms (scope, term, freq) VALUES (%%s, %%s, %%s) ON CONFLICT (scope, term) DO UPDATE SET freq = %(t)s_terms.freq + excluded.freq' % {'t': self.table}
+
+    def add_terms(self, cursor, deltas):
+        deltas = [(scope, term, delta) for (scope, term), delta in deltas.items() if delta]
+        if not deltas:
+            return
+        cursor.executemany(self.upsert_terms_sql(), deltas)
+        if [delta for scope, term, delta in deltas if delta < 0]:
+            cursor.execute('DELETE FROM %s_terms WHERE freq <= 0' % self.table)
+
+    def rebuild_terms(self, cursor):
+        counts = Counter()
+        cursor.execute('SELECT caption, text, customer FROM %s_document' % self.table)
+        while True:
+            rows = cursor.fetchmany(1000)
+            if not rows:
+                break
+            for caption, text, customer in rows:
+                counts.update(document_terms(caption, text, customer))
+        cursor.execute('DELETE FROM %s_terms' % self.table)
+        self.add_terms(cursor, counts)
+
+    def insert_sql(self):
+        return 'INSERT INTO %s_document (django_ct, django_id, caption, text, content_auto, facets, closed, customer, last_action_date) VALUES (%%s, %%s, %%s, %%s, %%s, %%s, %%s, %%s, %%s)' % self.table
+
+    def insert_params(self, row):
+        return [
+            row['django_ct'], row['django_id'], row['caption'], row['text'], row['content_auto'], row['facets'],
+            row['closed'], row['customer'], self.connection.ops.adapt_datetimefield_value(row['last_action_date'])
+        ]
+
+    def drop(self, cursor):
+        cursor.execute('DROP TABLE IF EXISTS %s_terms' % self.table)
+        cursor.execute('DROP TABLE IF EXISTS %s_document' % self.table)
+
+    def delete(self, cursor, django_ct=None, django_id=None):
+        if django_ct is None:
+            cursor.execute('DELETE FROM %s_document' % self.table)
+            cursor.execute('DELETE FROM %s_terms' % self.table)
+        elif django_id is None:
+            cursor.execute('DELETE FROM %s_document WHERE django_ct = %%s' % self.table, [django_ct])
+            self.rebuild_terms(cursor)
+        else:
+            deltas = self.old_terms(cursor, [(django_ct, django_id)])
+            cursor.execute('DELETE FROM %s_document WHERE django_ct = %%s AND django_id = %%s' % self.table, [django_ct, django_id])
+            self.add_terms(cursor, deltas)
+
+    def filter_sql(self, field, lookup, value, negated):
+        # documents do not carry closed/customer, keep them visible like the simple backend did
+        column = 'd.%s' % field
+        if lookup == 'in':
+            value = list(value)
+            sql = '%s IN (%s)' % (column, ', '.join(['%s'] * len(value)))
+            params = value
+        elif lookup == 'range':
+            sql = '%s BETWEEN %%s AND %%s' % column
+            params = list(value)
+        else:
+            operator = {'gt': '>', 'gte': '>=', 'lt': '<', 'lte': '<='}.get(lookup, '=')
+            sql = '%s %s %%s' % (column, operator)
+            params = [value]
+        if field == 'last_action_date':
+            params = [self.connection.ops.adapt_datetimefield_value(param) for param in params]
+        if field in ('closed', 'customer'):
+            sql = '(%s OR %s IS NULL)' % (sql, column)
+        if negated:
+            sql = 'NOT %s' % sql
+        return sql, params
+
+    def order_sql(self, sort_by, has_text):
+        order = []
+        for field in sort_by or []:
+            direction = 'ASC'
+            if field.startswith('-'):
+                direction = 'DESC'
+                field = field[1:]
+            if field not in SORT_COLUMNS:
+                raise SearchBackendError("cannot sort by '%s'" % field)
+            if field == 'score':
+                order.append('r.score %s' % direction)
+            else:
+                order.append('r.%s %s%s' % (field, direction, self.nulls_last if direction == 'DESC' else ''))
+        if not order:
+            if has_text:
+                order.append('r.score DESC')
+            else:
+                order.append('r.last_action_date DESC%s' % self.nulls_last)
+        order.append('r.id DESC')
+        return ' ORDER BY %s' % ', '.join(order)
+
+    def limit_sql(self, start_offset, end_offset):
+        if end_offset is None:
+            return ' OFFSET %d' % start_offset
+        return ' LIMIT %d OFFSET %d' % (max(end_offset - start_offset, 0), start_offset)
+
+    def search(self, cursor, query, models, sort_by, start_offset, end_offset):
+        match, match_params, where, where_params = self.compile(query, models)
+        score = self.score_sql() if match else '0'
+        sql = 'SELECT d.id, d.django_ct, d.django_id, d.caption, d.closed, d.customer, d.last_action_date, %s AS score FROM %s' % (score, self.from_sql(bool(match)))
+        conditions = ([match] if match else []) + where
+        if conditions:
+            sql += ' WHERE ' + ' AND '.join(conditions)
+        # fts5 ranking functions can not be mixed with window functions, so count outside
+        sql = 'SELECT r.django_ct, r.django_id, r.caption, r.closed, r.customer, r.last_action_date, r.score, COUNT(*) OVER () AS hits FROM (%s) r' % sql
+        sql += self.order_sql(sort_by, query['text'] is not None)
+        sql += self.limit_sql(int(start_offset), int(end_offset) if end_offset is not None else None)
+        cursor.execute(sql, (self.score_params(match_params) if match else []) + match_params + where_params)
+        return cursor.fetchall()
+
+    def count(self, cursor, query, models):
+        match, match_params, where, where_params = self.compile(query, models)
+        sql = 'SELECT COUNT(*) FROM %s' % self.from_sql(bool(match))
+        conditions = ([match] if match else []) + where
+        if conditions:
+            sql += ' WHERE ' + ' AND '.join(conditions)
+        cursor.execute(sql, match_params + where_params)
+        return cursor.fetchone()[0]
+
+    def compile(self, query, models):
+        """
+        returns (match sql, params, [where sql], params)
+        """
+        where = []
+        params = []
+        if models:
+            cts = [get_model_ct(model) for model in models]
+            sql, sql_params = self.filter_sql('django_ct', 'in', cts, False)
+            where.append(sql)
+            params.extend(sql_params)
+        for field, lookup, value, negated in query['filters']:
+            sql, sql_params = self.filter_sql(field, lookup, value, negated)
+            where.append(sql)
+            params.extend(sql_params)
+        match, match_params = self.compile_text(query['text'])
+        return match, match_params, where, params
+
+    def from_sql(self, has_text):
+        return '%s_document d' % self.table
+
+    def score_sql(self):
+        return '0'
+
+    def score_params(self, match_params):
+        return []
+
+    def compile_text(self, node):
+        raise NotImplementedError
+
+
+class GenericDialect(BaseDialect):
+    nulls_last = ''
+
+    def limit_sql(self, start_offset, end_offset):
+        if end_offset is None:
+            return ' LIMIT 18446744073709551615 OFFSET %d' % start_offset
+        return super(GenericDialect, self).limit_sql(start_offset, end_offset)
+
+    def upsert_terms_sql(self):
+        return 'INSERT INTO %s_terms (scope, term, freq) VALUES (%%s, %%s, %%s) ON DUPLICATE KEY UPDATE freq = freq + VALUES(freq)' % self.table
+
+    def setup(self, cursor):
+        cursor.execute('CREATE TABLE IF NOT EXISTS %s_document (id INTEGER PRIMARY KEY AUTO_INCREMENT, django_ct VARCHAR(100) NOT NULL, django_id VARCHAR(40) NOT NULL, caption TEXT, text LONGTEXT, content_auto LONGTEXT, facets TEXT, closed BOOL NULL, customer INTEGER NULL, last_action_date DATETIME(6) NULL, UNIQUE (django_ct, django_id))' % self.table)
+
+    def leaf_sql(self, leaf):
+        columns = TEXT_COLUMNS if leaf['field'] not in TEXT_COLUMNS else (leaf['field'],)
+        value = ' '.join(leaf['words'])
+        value = '%' + value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+        sql = '(%s)' % ' OR '.join(['LOWER(d.%s) LIKE %%s' % column for column in columns])
+        return sql, [value] * len(columns)
+
+    def compile_text(self, node):
+        if node is None:
+            return None, []
+        if 'words' in node:
+            sql, params = self.leaf_sql(node)
+        else:
+            parts = []
+            params = []
+            for child in node['children']:
+                child_sql, child_params = self.compile_text(child)
+                parts.append(child_sql)
+                params.extend(child_params)
+            sql = '(%s)' % (' %s ' % node['connector']).join(parts)
+        if node['negated']:
+            sql = 'NOT %s' % sql
+        return sql, params
+
+
+class SQLiteDialect(BaseDialect):
+    """
+    external content fts5 table over the document table, kept in sync by triggers.
+    closed, customer and the content type are additional tokens in the facets column,
+    so those filters are answered by the fts index itself.
+    """
+    def setup(self, cursor):
+        table = self.table
+        cursor.execute('CREATE TABLE IF NOT EXISTS %s_document (id INTEGER PRIMARY KEY, django_ct VARCHAR(100) NOT NULL, django_id VARCHAR(40) NOT NULL, caption TEXT, text TEXT, content_auto TEXT, facets TEXT, closed BOOL NULL, customer INTEGER NULL, last_action_date DATETIME NULL, UNIQUE (django_ct, django_id))' % table)
+        cursor.execute("CREATE VIRTUAL TABLE IF NOT EXISTS %s_fts USING fts5(caption, text, content_auto, facets, content='%s_document', content_rowid='id', prefix='2 3 4', tokenize='unicode61 remove_diacritics 2')" % (table, table))
+        cursor.execute('CREATE TRIGGER IF NOT EXISTS %(t)s_ai AFTER INSERT ON %(t)s_document BEGIN INSERT INTO %(t)s_fts(rowid, caption, text, content_auto, facets) VALUES (new.id, new.caption, new.text, new.content_auto, new.facets); END' % {'t': table})
+        cursor.execute("CREATE TRIGGER IF NOT EXISTS %(t)s_ad AFTER DELETE ON %(t)s_document BEGIN INSERT INTO %(t)s_fts(%(t)s_fts, rowid, caption, text, content_auto, facets) VALUES ('delete', old.id, old.caption, old.text, old.content_auto, old.facets); END" % {'t': table})
+        cursor.execute("CREATE TRIGGER IF NOT EXISTS %(t)s_au AFTER UPDATE ON %(t)s_document BEGIN INSERT INTO %(t)s_fts(%(t)s_fts, rowid, caption, text, content_auto, facets) VALUES ('delete', old.id, old.caption, old.text, old.content_auto, old.facets); INSERT INTO %(t)s_fts(rowid, caption, text, content_auto, facets) VALUES (new.id, new.caption, new.text, new.content_auto, new.facets); END" % {'t': table})
+
+    def drop(self, cursor):
+        cursor.execute('DROP TABLE IF EXISTS %s_fts' % self.table)
+        super(SQLiteDialect, self).drop(cursor)
+
+    def from_sql(self, has_text):
+        if not has_text:
+            return '%s_document d' % self.table
+        return '%s_fts JOIN %s_document d ON d.id = %s_fts.rowid' % (self.table, self.table, self.table)
+
+    def limit_sql(self, start_offset, end_offset):
+        if end_offset is None:
+            return ' LIMIT -1 OFFSET %d' % start_offset
+        return super(SQLiteDialect, self).limit_sql(start_offset, end_offset)
+
+    def score_sql(self):
+        # caption, text, content_auto, facets
+        return '-bm25(%s_fts, 10.0, 1.0, 2.0, 0.0)' % self.table
+
+    def compile(self, query, models):
+        facets = []
+        where = []
+        params = []
+        if models:
+            facets.append('(%s)' % ' OR '.join(['facets : %s' % facet_token('ct', get_model_ct(model)) for model in models]))
+        for field, lookup, value, negated in query['filters']:
+            if field in ('closed', 'customer', 'django_ct') and lookup in ('exact', 'content', 'in'):
+                values = value if lookup == 'in' else [value]
+                if field == 'django_ct':
+                    tokens = [facet_token('ct', item) for item in values]
+                else:
+                    tokens = [facet_token(field, item) for item in values] + [facet_token(field, None)]
+                facet = '(%s)' % ' OR '.join(['facets : %s' % token for token in tokens])
+                if negated:
+                    facet = '(facets : all NOT %s)' % facet
+                facets.append(facet)
+            else:
+                sql, sql_params = self.filter_sql(field, lookup, value, negated)
+                where.append(sql)
+                params.extend(sql_params)
+
+        text = self.compile_text(query['text'])
+        if text:
+            facets.insert(0, text)
+        if not facets:
+            return None, [], where, params
+        return '%s_fts MATCH %%s' % self.table, [' AND '.join(facets)], where, params
+
+    def leaf_match(self, leaf):
+        if leaf['field'] in TEXT_COLUMNS:
+            columns = leaf['field']
+        else:
+            columns = '{%s}' % ' '.join(TEXT_COLUMNS)
+        if leaf['phrase']:
+            return '%s : "%s"' % (columns, ' '.join(leaf['words']))
+        terms = ['%s : "%s"%s' % (columns, word, '*' if leaf['prefix'] else '') for word in leaf['words']]
+        if len(terms) == 1:
+            return terms[0]
+        return '(%s)' % ' AND '.join(terms)
+
+    def compile_text(self, node, top=True):
+        # fts5 only knows a binary NOT, so negations are attached to the positive part
+        if node is None:
+            return None
+        if 'words' in node:
+            match = self.leaf_match(node)
+        else:
+            positive = []
+            negative = []
+            for child in node['children']:
+                if child['negated'] and node['connector'] == 'AND':
+                    negative.append(self.compile_text(dict(child, negated=False), False))
+                else:
+                    positive.append(self.compile_text(child, False))
+            match = ' %s ' % node['connector']
+            match = '(%s)' % match.join(positive or ['facets : all'])
+            for item in negative:
+                match = '(%s NOT %s)' % (match, item)
+        if node['negated']:
+            match = '(facets : all NOT %s)' % match
+        return match
+
+
+class PostgresDialect(BaseDialect):
+    """
+    tsvector column weighted by field (A caption, B content_auto, D text),
+    gin index for the match and a btree for the filters.
+    """
+    weights = {'caption': 'A', 'content_auto': 'B', 'text': 'D'}
+
+    @property
+    def config(self):
+        return self.backend.options.get('CONFIG', 'simple')
+
+    def setup(self, cursor):
+        table = self.table
+        cursor.execute('CREATE TABLE IF NOT EXISTS %s_document (id BIGSERIAL PRIMARY KEY, django_ct VARCHAR(100) NOT NULL, django_id VARCHAR(40) NOT NULL, caption TEXT, text TEXT, content_auto TEXT, facets TEXT, closed BOOLEAN NULL, customer INTEGER NULL, last_action_date TIMESTAMP WITH TIME ZONE NULL, search_vector TSVECTOR, UNIQUE (django_ct, django_id))' % table)
+        cursor.execute('CREATE INDEX IF NOT EXISTS %s_vector_idx ON %s_document USING GIN (search_vector)' % (table, table))
+        cursor.execute('CREATE INDEX IF NOT EXISTS %s_filter_idx ON %s_document (django_ct, closed, customer)' % (table, table))
+
+    def insert_sql(self):
+        vector = ' || '.join(["setweight(to_tsvector('%s', COALESCE(%%s, '')), '%s')" % (self.config, self.weights[column]) for column in TEXT_COLUMNS])
+        return 'INSERT INTO %s_document (django_ct, django_id, caption, text, content_auto, facets, closed, customer, last_action_date, search_vector) VALUES (%%s, %%s, %%s, %%s, %%s, %%s, %%s, %%s, %%s, %s)' % (self.table, vector)
+
+    def insert_params(self, row):
+        return super(PostgresDialect, self).insert_params(row) + [row[column] for column in TEXT_COLUMNS]
+
+    def score_sql(self):
+        return "ts_rank_cd(d.search_vector, to_tsquery('%s', %%s))" % self.config
+
+    def score_params(self, match_params):
+        return match_params
+
+    def compile_text(self, node, top=True):
+        if node is None:
+            return None, []
+        query = self.tsquery(node)
+        return "d.search_vector @@ to_tsquery('%s', %%s)" % self.config, [query]
+
+    def tsquery(self, node):
+        if 'words' in node:
+            weight = self.weights.get(node['field'], '')
+            if node['phrase']:
+                query = ' <-> '.join(["'%s':%s" % (word, weight) if weight else "'%s'" % word for word in node['words']])
+            else:
+                suffix = ('*' if node['prefix'] else '') + weight
+                query = ' & '.join(["'%s'%s" % (word, ':' + suffix if suffix else '') for word in node['words']])
+            query = '(%s)' % query
+        else:
+            connector = ' & ' if node['connector'] == 'AND' else ' | '
+            query = '(%s)' % connector.join([self.tsquery(child) for child in node['children']])
+        if node['negated']:
+            query = '!%s' % query
+        return query
+
+
+def facet_token(field, value):
+    if value is None:
+        return '%snull' % field
+    if isinstance(value, bool):
+        value = int(value)
+    elif isinstance(value, str) and value.lower() in ('true', 'false'):
+        value = int(value.lower() == 'true')
+    return '%s%s' % (field, re.sub(r'\W|_', '', str(value).lower()))
+
+
+def get_dialect(backend):
+    vendor = db_connections[backend.database].vendor
+    if vendor == 'sqlite':
+        return SQLiteDialect(backend)
+    if vendor == 'postgresql':
+        return PostgresDialect(backend)
+    return GenericDialect(backend)
+
+
+class DatabaseSearchBackend(BaseSearchBackend):
+    def __init__(self, connection_alias, **connection_options):
+        super(DatabaseSearchBackend, self).__init__(connection_alias, **connection_options)
+        self.options = connection_options
+        self.database = connection_options.get('DATABASE', 'default')
+        self.table = connection_options.get('TABLE', 'yats_search')
+        self.setup_complete = False
+        self.dialect = get_dialect(self)
+
+    def setup(self):
+        with transaction.atomic(using=self.database):
+            with db_connections[self.database].cursor() as cursor:
+                self.dialect.setup(cursor)
+                self.dialect.setup_terms(cursor)
+                # documents indexed before the term dictionary existed
+                cursor.execute('SELECT 1 FROM %s_terms LIMIT 1' % self.table)
+                if not cursor.fetchone():
+                    cursor.execute('SELECT 1 FROM %s_document LIMIT 1' % self.table)
+                    if cursor.fetchone():
+                        self.dialect.rebuild_terms(cursor)
+        self.setup_complete = True
+
+    def drop(self):
+        with db_connections[self.database].cursor() as cursor:
+            self.dialect.drop(cursor)
+        self.setup_complete = False
+
+    def prepare_row(self, data):
+        django_ct = data['django_ct']
+        row = {
+            'django_ct': django_ct,
+            'django_id': str(data['django_id']),
+            'caption': data.get('caption') or '',
+            'text': data.get('text') or '',
+            'content_auto': data.get('content_auto') or '',
+            'closed': data.get('closed'),
+            'customer': data.get('customer'),
+            'last_action_date': data.get('last_action_date'),
+        }
+        row['facets'] = ' '.join([
+            'all',
+            facet_token('ct', django_ct),
+            facet_token('closed', row['closed']),
+            facet_token('customer', row['customer']),
+        ])
+        return row
+
+    def write_rows(self, rows):
+        if not self.setup_complete:
+            self.setup()
+        with transaction.atomic(using=self.database):
+            with db_connections[self.database].cursor() as cursor:
+                self.dialect.write(cursor, rows)
+
+    def update(self, index, iterable, commit=True):
+        rows = []
+        for obj in iterable:
+            rows.append(self.prepare_row(index.full_prepare(obj)))
+            if len(rows) >= self.batch_size:
+                self.write_rows(rows)
+                rows = []
+        if rows:
+            self.write_rows(rows)
+
+    def remove(self, obj_or_string, commit=True):
+        if not self.setup_complete:
+            self.setup()
+        django_ct, django_id = get_identifier(obj_or_string).rsplit('.', 1)
+        with transaction.atomic(using=self.database):
+            with db_connections[self.database].cursor() as cursor:
+                self.dialect.delete(cursor, django_ct, django_id)
+
+    def clear(self, models=None, commit=True):
+        if not self.setup_complete:
+            self.setup()
+        with transaction.atomic(using=self.database):
+            with db_connections[self.database].cursor() as cursor:
+                if models:
+                    for model in models:
+                        self.dialect.delete(cursor, get_model_ct(model))
+                else:
+                    self.dialect.delete(cursor)
+
+    @log_query
+    def search(self, query_string, **kwargs):
+        if not self.setup_complete:
+            self.setup()
+
+        if not isinstance(query_string, dict):
+            query_string = {'text': None, 'filters': []}
+
+        result_class = kwargs.get('result_class') or SearchResult
+        start_offset = kwargs.get('start_offset') or 0
+        end_offset = kwargs.get('end_offset')
+        models = kwargs.get('models')
+
+        with db_connections[self.database].cursor() as cursor:
+            rows = self.dialect.search(cursor, query_string, models, kwargs.get('sort_by'), start_offset, end_offset)
+            if rows:
+                hits = rows[0][7]
+            elif start_offset:
+                hits = self.dialect.count(cursor, query_string, models)
+            else:
+                hits = 0
+
+        results = []
+        for django_ct, django_id, caption, closed, customer, last_action_date, score, count in rows:
+            app_label, model_name = django_ct.split('.')
+            fields = {'caption': caption}
+            if closed is not None:
+                fields['closed'] = bool(closed)
+            if customer is not None:
+                fields['customer'] = customer
+            if last_action_date is not None:
+                fields['last_action_date'] = self.to_datetime(last_action_date)
+            results.append(result_class(app_label, model_name, django_id, score, **fields))
+
+        spelling_suggestion = None
+        if self.include_spelling:
+            if kwargs.get('spelling_query'):
+                spelling_words = [(word, False) for word in words(kwargs['spelling_query'])]
+            else:
+                spelling_words = self.spelling_words(query_string['text'])
+            index = get_spelling_index(self, self.spelling_scopes(query_string['filters'])) if spelling_words else None
+            if index is not None:
+                spelling_suggestion = index.suggest(spelling_words)
+
+        return {'results': results, 'hits': hits, 'facets': {}, 'spelling_suggestion': spelling_suggestion}
+
+    def spelling_scopes(self, filters):
+        """
+        term scopes the query can see: its customers and the documents without one, all for no customer filter
+        """
+        for field, lookup, value, negated in filters:
+            if field != 'customer':
+                continue
+            if negated or lookup not in ('exact', 'content', 'in'):
+                return ['']
+            values = value if lookup == 'in' else [value]
+            return sorted(set([term_scope(item) for item in values] + ['']))
+        return ['*']
+
+    def spelling_words(self, node):
+        if node is None or node['negated']:
+            return []
+        if 'words' in node:
+            return [(word, node['prefix']) for word in node['words']]
+        result = []
+        for child in node['children']:
+            result.extend(self.spelling_words(child))
+        return result
+
+    def to_datetime(self, value):
+        if isinstance(value, str):
+            value = parse_datetime(value)
+        if isinstance(value, datetime.datetime) and settings.USE_TZ and timezone.is_naive(value):
+            value = timezone.make_aware(value, datetime.timezone.utc)
+        return value
+
+    def more_like_this(self, model_instance, additional_query_string=None, start_offset=0, end_offset=None, limit_to_registered_models=None, result_class=None, **kwargs):
+        return {'results': [], 'hits': 0}
+
+    def prep_value(self, db_field, value):
+        return value
+
+
+class DatabaseSearchQuery(BaseSearchQuery):
+    """
+    build_query returns a structure instead of a query string:
+    {'text': text node or None, 'filters': [(field, lookup, value, negated)]}
+    text nodes are {'connector', 'negated', 'children'} or leaves with 'words'.
+    column filters are only supported AND-ed at the top level, the way .filter() and .exclude() chain them.
+    """
+    def __str__(self):
+        return repr(self.build_query())
+
+    def build_query(self):
+        filters = []
+        text = self.build_node(self.query_filter, filters, True)
+        return {'text': text, 'filters': filters}
+
+    def build_node(self, node, filters, top):
+        children = []
+        for child in node.children:
+            if isinstance(child, SearchNode):
+                negated_filter = child.negated and len(child.children) == 1 and not isinstance(child.children[0], SearchNode)
+                if top and child.connector == 'AND' and (not child.negated or negated_filter):
+                    if negated_filter and self.is_filter(child, child.children[0]):
+                        field, lookup = child.split_expression(child.children[0][0])
+                        filters.append((field, lookup, self.plain_value(child.children[0][1]), True))
+                        continue
+                    elif not child.negated:
+                        sub = self.build_node(child, filters, True)
+                        if sub:
+                            children.append(sub)
+                        continue
+                sub = self.build_node(child, filters, False)
+                if sub:
+                    children.append(sub)
+            else:
+                if self.is_filter(node, child):
+                    if not top or node.connector != 'AND' or node.negated:
+                        raise SearchBackendError("filter on '%s' can not be combined with OR or negated groups" % child[0])
+                    field, lookup = node.split_expression(child[0])
+                    filters.append((field, lookup, self.plain_value(child[1]), False))
+                else:
+                    children.extend(self.build_text(node, child))
+
+        if not children:
+            return None
+        if len(children) == 1 and not node.negated:
+            return children[0]
+        return {'connector': node.connector, 'negated': node.negated, 'children': children}
+
+    def is_filter(self, node, child):
+        field, lookup = node.split_expression(child[0])
+        return field in FILTER_COLUMNS
+
+    def plain_value(self, value):
+        if hasattr(value, 'input_type_name'):
+            return value.query_string
+        return value
+
+    def build_text(self, node, child):
+        field, lookup = node.split_expression(child[0])
+        value = child[1]
+        prefix = lookup in ('contains', 'startswith') or field == 'content_auto'
+        input_type = getattr(value, 'input_type_name', None)
+        raw = self.plain_value(value)
+
+        if input_type == 'auto_query':
+            leaves = []
+            for phrase in PHRASE_RE.findall(raw):
+                if words(phrase):
+                    leaves.append(self.leaf(field, words(phrase), phrase=True))
+            for token in PHRASE_RE.sub(' ', raw).split():
+                negated = token.startswith('-') and len(token) > 1
+                if words(token):
+                    leaves.append(self.leaf(field, words(token), prefix=prefix, negated=negated))
+            return leaves
+
+        if not words(raw):
+            return []
+        return [self.leaf(field, words(raw), prefix=prefix, phrase=input_type == 'exact', negated=input_type == 'not')]
+
+    def leaf(self, field, value, prefix=False, phrase=False, negated=False):
+        return {'field': field, 'words': value, 'prefix': prefix and not phrase, 'phrase': phrase and len(value) > 1, 'negated': negated}
+
+
+class DatabaseEngine(BaseEngine):
+    backend = DatabaseSearchBackend
+    query = DatabaseSearchQuery
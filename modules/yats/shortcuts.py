@@ -5,6 +5,7 @@ from django.core.mail import send_mail
 from django.contrib import messages
 from django.utils.translation import gettext as _
 from django.db.models import Q
+from django.db import transaction
 
 from PIL import Image  # ImageOps
 import sys
@@ -12,6 +13,7 @@ import datetime
 import re
 import os
 import subprocess
+import hashlib
 import time
 from dateutil import parser
 
@@ -33,6 +35,8 @@ def isPreviewable(mime):
 
 def resize_image(filename, size=(200, 150), dpi=75):
     image = Image.open(filename)
+    # jpeg: let the decoder scale down by 1/2, 1/4 or 1/8 instead of decoding the full image
+    image.draft('RGB', size)
     pw = image.size[0]
     ph = image.size[1]
     nw = size[0]
@@ -50,18 +54,18 @@ def resize_image(filename, size=(200, 150), dpi=75):
         if pr > nr:
             # icon aspect is wider than destination ratio
             tw = int(round(nh * pr))
-            image = image.resize((tw, nh), Image.ANTIALIAS)
+            image = image.resize((tw, nh), Image.LANCZOS, reducing_gap=3.0)
             l = int(round((tw - nw) / 2.0))
             image = image.crop((l, 0, l + nw, nh))
         elif pr < nr:
             # icon aspect is taller than destination ratio
             th = int(round(nw / pr))
-            image = image.resize((nw, th), Image.ANTIALIAS)
+            image = image.resize((nw, th), Image.LANCZOS, reducing_gap=3.0)
             t = int(round((th - nh) / 2.0))
             image = image.crop((0, t, nw, t + nh))
         else:
             # icon aspect matches the destination ratio
-            image = image.resize(size, Image.ANTIALIAS)
+            image = image.resize(size, Image.LANCZOS, reducing_gap=3.0)
 
     if image.mode != "RGB":
         # http://packages.debian.org/search?keywords=python-imaging
@@ -70,11 +74,137 @@ def resize_image(filename, size=(200, 150), dpi=75):
         image = image.convert('RGB')
     return image
 
+def get_thumbnail(src, size=(200, 150)):
+    """
+    path of the resize_image png of src, kept below FILE_UPLOAD_PATH/thumbs until src changes
+    """
+    mtime = int(os.path.getmtime(src))
+    digest = hashlib.md5(src.encode('utf-8')).hexdigest()
+    path = os.path.join(get_thumbnail_folder(digest), '%s_%sx%s_%s.png' % (digest, size[0], size[1], mtime))
+    if not os.path.isfile(path):
+        folder = os.path.dirname(path)
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+        tmp = '%s.%s.part' % (path, os.getpid())
+        resize_image(src, size).save(tmp, 'PNG')
+        os.replace(tmp, path)
+    return path
+
+def get_thumbnail_folder(digest):
+    return os.path.join(str(settings.FILE_UPLOAD_PATH), 'thumbs', digest[:2], digest[2:4])
+
+def remove_thumbnails(src):
+    """
+    removes the thumbnails of src in every size, for when src itself is removed
+    """
+    digest = hashlib.md5(src.encode('utf-8')).hexdigest()
+    folder = get_thumbnail_folder(digest)
+    if not os.path.isdir(folder):
+        return
+    for entry in os.scandir(folder):
+        if entry.name.startswith('%s_' % digest):
+            try:
+                os.unlink(entry.path)
+            except FileNotFoundError:
+                pass
+
+def thumbnail_response(request, src, size=(200, 150)):
+    from yats.request import streamRanges
+
+    thumb = get_thumbnail(src, size)
+    # name covers source, size and mtime
+    response = streamRanges(request, thumb, 'image/png', etag='"%s"' % os.path.basename(thumb)[:-4])
+    response['Cache-Control'] = 'private'
+    return response
+
 def get_ticket_model():
     mod_path, cls_name = settings.TICKET_CLASS.rsplit('.', 1)
     mod_path = mod_path.split('.').pop(0)
     return apps.get_model(mod_path, cls_name)
 
+# user -> organisation of the auth middlewares and the api, every save of a user,
+# user profile or organisation starts a new version of all entries
+ORGA_CACHE_LOCAL_SIZE = 1000
+_orga_local = {}
+
+def get_orga_cache():
+    from django.core.cache import caches
+    return caches[getattr(settings, 'ORGA_CACHE_ALIAS', 'default')]
+
+def get_orga_version():
+    """
+    None if the cache is not shared between the processes, nothing is cached then:
+    a new version would only reach the process that saved the change
+    """
+    from django.core.cache.backends.dummy import DummyCache
+    from django.core.cache.backends.locmem import LocMemCache
+
+    cache = get_orga_cache()
+    if isinstance(cache, (DummyCache, LocMemCache)):
+        return None
+    version = cache.get('yats.orga.version')
+    if version is None:
+        cache.add('yats.orga.version', int(time.time() * 1000), None)
+        version = cache.get('yats.orga.version')
+    return version
+
+def bump_orga_version():
+    cache = get_orga_cache()
+    try:
+        cache.incr('yats.orga.version')
+    except ValueError:
+        cache.add('yats.orga.version', int(time.time() * 1000), None)
+    _orga_local.clear()
+
+def cached_orga_lookup(key, load):
+    version = get_orga_version()
+    if version is None:
+        return load()
+    # this process has it from an earlier request
+    local = _orga_local.get(key)
+    if local is not None and local[0] == version:
+        return local[1]
+    cache = get_orga_cache()
+    cache_key = 'yats.orga.%s.%s' % (version, key)
+    value = cache.get(cache_key)
+    if value is None:
+        value = load()
+        cache.set(cache_key, value, getattr(settings, 'ORGA_CACHE_TIMEOUT', 3600))
+    if len(_orga_local) >= ORGA_CACHE_LOCAL_SIZE:
+        _orga_local.clear()
+    _orga_local[key] = (version, value)
+    return value
+
+def get_user_organisation(user):
+    """
+    organisation of the user's profile, None without profile or organisation
+    """
+    import copy
+
+    def load():
+        from yats.models import UserProfile
+        profile = UserProfile.objects.select_related('organisation').filter(user=user.pk).first()
+        return (profile.organisation if profile else None,)
+
+    # callers get their own instance, the cached one is shared by all requests of the process
+    return copy.copy(cached_orga_lookup('user.%s' % user.pk, load)[0])
+
+def get_api_user(username):
+    """
+    (user, organisation) of an active user with profile, (None, None) otherwise
+    """
+    import copy
+
+    def load():
+        from yats.models import UserProfile
+        profile = UserProfile.objects.select_related('user', 'organisation').filter(user__username=username, user__is_active=True).first()
+        if profile is None:
+            return (None, None)
+        return (profile.user, profile.organisation)
+
+    user, organisation = cached_orga_lookup('api.%s' % hashlib.md5(username.encode('utf-8')).hexdigest(), load)
+    return copy.copy(user), copy.copy(organisation)
+
 def touch_ticket(user, ticket_id):
     from yats.models import tickets_participants
     tickets_participants.objects.get_or_create(ticket_id=ticket_id, user=user)
@@ -490,13 +620,16 @@ def signal_file(request, file_id):
 
     tic = get_ticket_model().objects.get(pk=ticket_id)
 
+    from yats.blobstore import get_file_path
     preview_file = []
-    if os.path.isfile('%s%s.preview' % (settings.FILE_UPLOAD_PATH, file_id)):
-        preview_file.append('%s%s.preview' % (settings.FILE_UPLOAD_PATH, file_id))
-    if len(preview_file) == 0 and 'image' in io.content_type:
-        preview_file.append('%s%s.dat' % (settings.FILE_UPLOAD_PATH, file_id))
-    if len(preview_file) == 0 and io.content_type == 'audio/mpeg':
-        preview_file.append('%s%s.dat' % (settings.FILE_UPLOAD_PATH, file_id))
+    # nothing is sent along before the virus scan passed
+    if not io.blob_id or io.blob.scan_state == 1:
+        if io.has_preview:
+            preview_file.append(get_file_path(io, 'preview'))
+        if len(preview_file) == 0 and 'image' in io.content_type:
+            preview_file.append(get_file_path(io))
+        if len(preview_file) == 0 and io.content_type == 'audio/mpeg':
+            preview_file.append(get_file_path(io))
 
     if len(int_rcpt) > 0:
         body = '%s\n%s: %s\n%s: %s\n%s: %s\n\n%s' % (_('new file added'), _('file name'), io.name, _('file size'), io.size, _('content type'), io.content_type, get_ticket_url(request, ticket_id))
@@ -650,8 +783,38 @@ def prettyValues(data):
     data['rules'] = prettyData(data['rules'])
     return data
 
+# breadcrumbs live in a signed cookie and the last search in the user profile,
+# the session is only written when something in it changed
+BREADCRUMBS_VERSION = 1
+SEARCH_STATE_VERSION = 1
+
+def get_breadcrumbs_cookie_name():
+    return getattr(settings, 'BREADCRUMBS_COOKIE_NAME', 'yats_breadcrumbs')
+
+def get_breadcrumbs(request):
+    if not hasattr(request, '_breadcrumbs'):
+        request._breadcrumbs = []
+        request._breadcrumbs_changed = False
+        value = request.get_signed_cookie(get_breadcrumbs_cookie_name(), default=None, salt='yats.breadcrumbs')
+        try:
+            data = json.loads(value) if value else {}
+        except ValueError:
+            data = {}
+        # an other user logged in with the same browser
+        if data.get('v') == BREADCRUMBS_VERSION and data.get('u') == request.user.pk:
+            request._breadcrumbs = [tuple(bread) for bread in data.get('b', [])]
+    return request._breadcrumbs
+
+def save_breadcrumbs(request, response):
+    if not getattr(request, '_breadcrumbs_changed', False):
+        return response
+    value = json.dumps({'v': BREADCRUMBS_VERSION, 'u': request.user.pk, 'b': request._breadcrumbs}, separators=(',', ':'))
+    response.set_signed_cookie(get_breadcrumbs_cookie_name(), value, salt='yats.breadcrumbs', max_age=settings.SESSION_COOKIE_AGE, path=settings.SESSION_COOKIE_PATH, secure=settings.SESSION_COOKIE_SECURE or None, httponly=True, samesite=settings.SESSION_COOKIE_SAMESITE)
+    return response
+
 def add_breadcrumbs(request, pk, typ, **kwargs):
-    breadcrumbs = request.session.get('breadcrumbs', [])
+    breadcrumbs = get_breadcrumbs(request)
+    before = list(breadcrumbs)
     caption = kwargs.get('caption')
 
     # checks if already exists
@@ -675,10 +838,49 @@ def add_breadcrumbs(request, pk, typ, **kwargs):
             breadcrumbs.append((int(pk), typ,))
     while len(breadcrumbs) > 10:
         breadcrumbs.pop(0)
-    request.session['breadcrumbs'] = breadcrumbs
+    if breadcrumbs != before:
+        request._breadcrumbs_changed = True
 
 def del_breadcrumbs(request):
-    request.session['breadcrumbs'] = []
+    breadcrumbs = get_breadcrumbs(request)
+    if breadcrumbs:
+        del breadcrumbs[:]
+        request._breadcrumbs_changed = True
+
+def get_last_search(request):
+    """
+    (search, caption) of the last ticket search of the user, (None, '') if there is none
+    """
+    if not hasattr(request, '_last_search'):
+        from yats.models import UserProfile
+        state = UserProfile.objects.filter(user=request.user).values_list('search_state', flat=True).first()
+        try:
+            data = json.loads(state) if state else {}
+        except ValueError:
+            data = {}
+        if data.get('v') == SEARCH_STATE_VERSION:
+            request._last_search = (data.get('q'), data.get('c', ''))
+        else:
+            # searched before the state moved out of the session
+            request._last_search = (request.session.get('last_search'), request.session.get('last_search_caption', ''))
+    return request._last_search
+
+def set_last_search(request, search, caption=None):
+    """
+    caption None keeps the caption of the last search, the profile is only written on changes
+    """
+    from yats.models import UserProfile
+    from django.core.serializers.json import DjangoJSONEncoder
+
+    old_search, old_caption = get_last_search(request)
+    if caption is None:
+        caption = old_caption
+    # stored as it comes back, dates become strings
+    search = json.loads(json.dumps(search, cls=DjangoJSONEncoder))
+    request._last_search = (search, caption)
+    if (search, caption) != (old_search, old_caption):
+        UserProfile.objects.filter(user=request.user).update(search_state=json.dumps({'v': SEARCH_STATE_VERSION, 'q': search, 'c': caption}, separators=(',', ':')))
+    return search
 
 def build_ticket_search(request, base_query, search_params, params):
     if not request.user.is_staff:
@@ -923,6 +1125,54 @@ def build_ticket_search_ext(request, base_query, search):
         base_query = base_query.filter(Query)
     return (search, base_query)
 
+def build_ical_todo(item):
+    import vobject
+    from dateutil import tz
+
+    # vobject only knows the dateutil tz classes
+    def utc(value):
+        return value.astimezone(tz.tzutc())
+
+    cal = vobject.iCalendar()
+    cal.add('vtodo')
+    cal.vtodo.add('summary').value = item.caption
+    cal.vtodo.add('uid').value = str(item.uuid)
+    cal.vtodo.add('created').value = utc(item.c_date)
+    if item.closed:
+        cal.vtodo.add('status').value = 'COMPLETED'
+    if item.priority:
+        cal.vtodo.add('priority').value = str(item.priority.caldav)
+    else:
+        cal.vtodo.add('priority').value = '0'
+    if item.description:
+        cal.vtodo.add('description').value = item.description
+    if item.show_start:
+        # cal.vtodo.add('dstart').value = item.show_start
+        cal.vtodo.add('due').value = utc(item.show_start)
+        cal.vtodo.add('valarm')
+        cal.vtodo.valarm.add('uuid').value = '%s-%s' % (str(item.uuid), item.pk)
+        cal.vtodo.valarm.add('x-wr-alarmuid').value = '%s-%s' % (str(item.uuid), item.pk)
+        cal.vtodo.valarm.add('action').value = 'DISPLAY'
+        # cal.vtodo.valarm.add('x-apple-proximity').value = 'DEPART'
+        cal.vtodo.valarm.add('description').value = 'Erinnerung an ein Ereignis'
+        # cal.vtodo.valarm.add('trigger').value =
+        # TRIGGER;VALUE=DATE-TIME:20180821T200000Z
+
+    cal.vtodo.add('x-radicale-name').value = '%s.ics' % str(item.uuid)
+    return cal
+
+def ical_todo_stream(items, name=None):
+    """
+    yields a VCALENDAR one VTODO at a time, so the whole calendar is never held in memory
+    """
+    yield 'BEGIN:VCALENDAR\r\nVERSION:2.0\r\nPRODID:-//YATS//NONSGML Radicale Server//DE\r\n'
+    if name:
+        name = name.replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,').replace('\n', '\\n')
+        yield 'X-WR-CALNAME:%s\r\n' % name
+    for item in items:
+        yield build_ical_todo(item).vtodo.serialize()
+    yield 'END:VCALENDAR\r\n'
+
 
 def convertPDFtoImg(pdf, dest=None):
     try:
@@ -952,17 +1202,26 @@ class yatsCalledProcessError(subprocess.CalledProcessError):
         return "Command '%s' returned non-zero exit status %d - error: %s" % (self.cmd, self.returncode, self.output)
 
 def convertOfficeTpPDF(office, mimetype=None):
+    from yats.converter import get_office_converter
+
+    converter = get_office_converter()
+    if converter:
+        path, fileName = os.path.split(office)
+        return converter.convert(office, '/convert/%s.%s' % (fileName.split('.')[0], 'pdf'), mimetype)
+    return spawnOfficeToPDF(office, mimetype)
+
+def spawnOfficeToPDF(office, mimetype=None, outdir='/convert'):
     if mimetype and 'html' in mimetype.lower():
-        command = 'sudo /usr/bin/libreoffice --headless --invisible --infilter=HTML --convert-to pdf --outdir /convert %s' % (office)
+        command = 'sudo /usr/bin/libreoffice --headless --invisible --infilter=HTML --convert-to pdf --outdir %s %s' % (outdir, office)
 
     elif mimetype and 'text' in mimetype.lower():
-        command = 'sudo /usr/bin/libreoffice --headless --invisible --infilter=Text --convert-to pdf --outdir /convert %s' % (office)
+        command = 'sudo /usr/bin/libreoffice --headless --invisible --infilter=Text --convert-to pdf --outdir %s %s' % (outdir, office)
 
     elif mimetype and 'json' in mimetype.lower():
-        command = 'sudo /usr/bin/libreoffice --headless --invisible --infilter=Text --convert-to pdf --outdir /convert %s' % (office)
+        command = 'sudo /usr/bin/libreoffice --headless --invisible --infilter=Text --convert-to pdf --outdir %s %s' % (outdir, office)
 
     else:
-        command = 'sudo /usr/bin/libreoffice --headless --invisible --convert-to pdf --outdir /convert %s' % (office)
+        command = 'sudo /usr/bin/libreoffice --headless --invisible --convert-to pdf --outdir %s %s' % (outdir, office)
     print(command)
     process = subprocess.Popen(command, shell=True, stdout=subprocess.PIPE, cwd='.')
     output, unused_err = process.communicate()
@@ -972,4 +1231,147 @@ def convertOfficeTpPDF(office, mimetype=None):
 
     path, fileName = os.path.split(office)
 
-    return '/convert/%s.%s' % (fileName.split('.')[0], 'pdf')
+    return '%s/%s.%s' % (outdir, fileName.split('.')[0], 'pdf')
+
+def needsPreview(mime):
+    if not mime:
+        return False
+    return 'pdf' in mime or ('image' not in mime and isPreviewable(mime))
+
+def build_file_preview(src, preview, mimetype):
+    if 'pdf' in mimetype:
+        convertPDFtoImg(src, preview)
+    else:
+        tmp = convertOfficeTpPDF(src, mimetype)
+        try:
+            convertPDFtoImg(tmp, preview)
+        finally:
+            if os.path.isfile(tmp):
+                os.unlink(tmp)
+
+def preview_pending_response():
+    from django.http import HttpResponse
+    from django.utils.cache import add_never_cache_headers
+
+    with open(os.path.join(os.path.dirname(__file__), 'static', 'preview_pending.png'), 'rb') as fo:
+        response = HttpResponse(fo.read(), content_type='image/png')
+    # the real preview replaces it as soon as the worker is done
+    add_never_cache_headers(response)
+    return response
+
+def queue_preview(f):
+    """
+    previews are built by yats.tasks.build_preview, run workers with: manage.py process_tasks --queue previews
+    """
+    from yats.blobstore import get_file_path
+    from yats.tasks import build_preview
+
+    if not needsPreview(f.content_type) or f.has_preview:
+        return False
+    # same content uploaded before, its preview is already there
+    if f.blob_id and blob_has_preview(f.blob_id):
+        mark_preview(f)
+        return False
+    # yats.virusscan.check_blob queues it once the file is clean
+    if f.blob_id and f.blob.scan_state != 1:
+        return False
+    model_name = f._meta.model_name
+    file_id = f.pk
+    transaction.on_commit(lambda: build_preview(model_name, file_id))
+    return True
+
+def blob_has_preview(sha256):
+    from yats.models import tickets_files, docs_files
+    return tickets_files.objects.filter(blob=sha256, has_preview=True).exists() or docs_files.objects.filter(blob=sha256, has_preview=True).exists()
+
+def mark_preview(f, has_preview=True):
+    """
+    the preview of a blob belongs to all files with that content
+    """
+    from yats.models import tickets_files, docs_files
+    from django.utils import timezone
+
+    # u_date moves, conditional GETs of the ticket or doc see the change
+    if f.blob_id:
+        for model in (tickets_files, docs_files):
+            model.objects.filter(blob=f.blob_id).exclude(has_preview=has_preview).update(has_preview=has_preview, u_date=timezone.now())
+    else:
+        type(f).objects.filter(pk=f.pk).update(has_preview=has_preview, u_date=timezone.now())
+    f.has_preview = has_preview
+
+def queue_transcription(f):
+    """
+    audio is transcribed by yats.tasks.transcribe_file, run workers with: manage.py process_tasks --queue transcriptions
+    """
+    from yats.tasks import transcribe_file
+
+    if 'audio' not in f.content_type:
+        return False
+    # yats.virusscan.check_blob queues it once the file is clean
+    if f.blob_id and f.blob.scan_state != 1:
+        return False
+    file_id = f.pk
+    transaction.on_commit(lambda: transcribe_file(file_id))
+    return True
+
+def build_autocomplete_query(models, q, customer=None):
+    from haystack.query import SearchQuerySet
+
+    sqs = SearchQuerySet().models(*set([apps.get_model(model) for model in models]))
+    # only open tickets in autocomplete
+    sqs = sqs.filter(closed=False)
+    if customer is not None:
+        sqs = sqs.filter(customer=customer)
+    for word in q.split(' '):
+        word = word.strip()
+        if word:
+            sqs = sqs.filter(content_auto__contains=word)
+    return sqs
+
+def get_autocomplete_suggestion(models, q, customer=None):
+    sqs = build_autocomplete_query(models, q, customer)
+    # the suggestion comes with the search, keep that one row only
+    sqs.query.set_limits(0, 1)
+    return sqs.spelling_suggestion()
+
+def get_autocomplete(models, q, customer=None, order_by=None):
+    """
+    top matches of open tickets / docs for the typed prefixes, customer None means all customers.
+    results are cached shortly per scope and query, so typing the same prefix again is free.
+    """
+    from django.core.cache import cache
+
+    if hasattr(settings, 'AUTOCOMPLETE_LIMIT'):
+        limit = settings.AUTOCOMPLETE_LIMIT
+    else:
+        limit = 10
+    if hasattr(settings, 'AUTOCOMPLETE_CACHE_TTL'):
+        ttl = settings.AUTOCOMPLETE_CACHE_TTL
+    else:
+        ttl = 30
+
+    q = ' '.join([word.strip().lower() for word in q.split(' ') if word.strip()])
+    if not q:
+        return []
+
+    key = 'autocomplete:%s' % hashlib.md5(('%s|%s|%s|%s' % (customer, ','.join(sorted(models)), order_by, q)).encode('utf-8')).hexdigest()
+    result = cache.get(key)
+    if result is not None:
+        return result
+
+    sqs = build_autocomplete_query(models, q, customer)
+    if order_by:
+        sqs = sqs.order_by(order_by)
+
+    result = []
+    for ele in sqs[:limit]:
+        data = {
+            'caption': str(ele.caption),
+            'id': ele.pk
+        }
+        if hasattr(ele, 'closed') and ele.closed:
+            data['closed'] = ele.closed
+        result.append(data)
+
+    cache.set(key, result, ttl)
+    return result
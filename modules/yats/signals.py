@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+from django.conf import settings
+from django.db import transaction
+from django.db.models import signals
+from haystack.signals import BaseSignalProcessor
+from haystack.utils import get_model_ct
+
+from yats.models import tickets, tickets_comments, tickets_files, docs, docs_files, search_queue
+from yats.shortcuts import get_ticket_model
+
+
+class QueuedSignalProcessor(BaseSignalProcessor):
+    """
+    HAYSTACK_SIGNAL_PROCESSOR = 'yats.signals.QueuedSignalProcessor'
+
+    saves only queue the affected ticket or doc, yats.tasks.update_search_index
+    re-indexes the queued documents in batches.
+    """
+    def get_models(self):
+        return set([tickets, get_ticket_model(), tickets_comments, tickets_files, docs, docs_files])
+
+    def setup(self):
+        for model in self.get_models():
+            signals.post_save.connect(self.handle_save, sender=model)
+            signals.post_delete.connect(self.handle_delete, sender=model)
+
+    def teardown(self):
+        for model in self.get_models():
+            signals.post_save.disconnect(self.handle_save, sender=model)
+            signals.post_delete.disconnect(self.handle_delete, sender=model)
+
+    def handle_save(self, sender, instance, **kwargs):
+        enqueue_search_update(*get_search_document(instance))
+
+    def handle_delete(self, sender, instance, **kwargs):
+        enqueue_search_update(*get_search_document(instance))
+
+
+def get_search_document(instance):
+    # comments and files are part of the ticket / doc document
+    if isinstance(instance, (tickets_comments, tickets_files)):
+        return get_model_ct(get_ticket_model()), instance.ticket_id
+    if isinstance(instance, tickets):
+        return get_model_ct(get_ticket_model()), instance.pk
+    if isinstance(instance, docs_files):
+        return get_model_ct(docs), instance.doc_id
+    return get_model_ct(instance), instance.pk
+
+
+def enqueue_search_update(django_ct, django_id):
+    from background_task.models import Task
+    from yats.tasks import update_search_index
+
+    if hasattr(settings, 'SEARCH_QUEUE_DELAY'):
+        delay = settings.SEARCH_QUEUE_DELAY
+    else:
+        delay = 2
+
+    def enqueue():
+        search_queue.objects.bulk_create([search_queue(django_ct=django_ct, django_id=str(django_id))], ignore_conflicts=True)
+        # one pending worker is enough, it drains the whole queue. a running (locked) one
+        # may already have seen the queue empty, so it does not count
+        if Task.objects.get_task(update_search_index.name).filter(locked_by=None).exists():
+            return
+        update_search_index(schedule=delay)
+
+    transaction.on_commit(enqueue)
@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+"""
+spelling suggestions from the term dictionary of the search index
+
+symspell like: every term is stored under all variants with up to max_distance
+characters deleted (of its first prefix_length characters), a lookup only has
+to generate the deletes of the typed word and verify the few candidates.
+"""
+from django.conf import settings
+from django.db import connections as db_connections
+
+import bisect
+import logging
+import threading
+import time
+
+logger = logging.getLogger('yats.spelling')
+
+_indexes = {}
+_building = set()
+_lock = threading.Lock()
+
+
+def get_setting(name, default):
+    if hasattr(settings, name):
+        return getattr(settings, name)
+    return default
+
+
+def deletes(word, max_distance, prefix_length):
+    word = word[:prefix_length]
+    result = set([word])
+    edits = set([word])
+    for distance in range(max_distance):
+        next_edits = set()
+        for edit in edits:
+            if len(edit) <= 1:
+                continue
+            for pos in range(len(edit)):
+                next_edits.add(edit[:pos] + edit[pos + 1:])
+        result.update(next_edits)
+        edits = next_edits
+    return result
+
+
+def distance(a, b, max_distance):
+    """
+    optimal string alignment distance, None if above max_distance
+    """
+    if abs(len(a) - len(b)) > max_distance:
+        return None
+    previous2 = None
+    previous = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                current[j] = min(current[j], previous2[j - 2] + 1)
+        if min(current) > max_distance:
+            return None
+        previous2, previous = previous, current
+    if previous[-1] > max_distance:
+        return None
+    return previous[-1]
+
+
+class SpellingIndex(object):
+    def __init__(self, terms, max_distance=2, prefix_length=7):
+        self.max_distance = max_distance
+        self.prefix_length = prefix_length
+        self.freq = dict(terms)
+        self.sorted_terms = sorted(self.freq)
+        self.deletes = {}
+        for term in self.freq:
+            for variant in deletes(term, max_distance, prefix_length):
+                self.deletes.setdefault(variant, []).append(term)
+        self.created = time.time()
+
+    def has_prefix(self, prefix):
+        pos = bisect.bisect_left(self.sorted_terms, prefix)
+        return pos < len(self.sorted_terms) and self.sorted_terms[pos].startswith(prefix)
+
+    def lookup(self, word, prefix=False):
+        """
+        best correction for word or None if the word is fine / unknown
+        """
+        if word in self.freq or (prefix and self.has_prefix(word)):
+            return None
+
+        candidates = set()
+        for variant in deletes(word, self.max_distance, self.prefix_length):
+            candidates.update(self.deletes.get(variant, []))
+
+        best = None
+        for candidate in candidates:
+            dist = distance(word, candidate, self.max_distance)
+            if prefix:
+                # typed word may still be incomplete
+                dists = [item for item in (dist, distance(word, candidate[:len(word)], self.max_distance)) if item is not None]
+                dist = min(dists) if dists else None
+            if dist is None:
+                continue
+            rank = (dist, -self.freq[candidate], candidate)
+            if best is None or rank < best:
+                best = rank
+        if best:
+            return best[2]
+        return None
+
+    def suggest(self, words):
+        """
+        words is a list of (word, prefix), returns the corrected query or None
+        """
+        changed = False
+        result = []
+        for word, prefix in words:
+            correction = self.lookup(word, prefix)
+            if correction:
+                changed = True
+                result.append(correction)
+            else:
+                result.append(word)
+        if changed:
+            return ' '.join(result)
+        return None
+
+
+def get_spelling_index(backend, scopes):
+    """
+    process local index per search table and term scopes (one per customer, '*' for staff), None until
+    the first one is built. a thread builds it and rebuilds it after SPELLING_REFRESH seconds, requests
+    keep using the old one meanwhile. at most SPELLING_MAX_INDEXES are kept.
+    """
+    key = (backend.table, tuple(scopes))
+    index = _indexes.get(key)
+    if index is None or time.time() - index.created >= get_setting('SPELLING_REFRESH', 300):
+        start_build(backend, key)
+    return index
+
+
+def start_build(backend, key):
+    with _lock:
+        if key in _building:
+            return
+        _building.add(key)
+    threading.Thread(target=build_index, args=(backend, key), daemon=True).start()
+
+
+def build_index(backend, key):
+    table, scopes = key
+    try:
+        # terms seen only once are mostly typos themselves
+        with db_connections[backend.database].cursor() as cursor:
+            cursor.execute(
+                'SELECT term, SUM(freq) FROM %s_terms WHERE scope IN (%s) GROUP BY term HAVING SUM(freq) >= %%s' % (table, ', '.join(['%s'] * len(scopes))),
+                list(scopes) + [get_setting('SPELLING_MIN_FREQ', 2)]
+            )
+            terms = cursor.fetchall()
+        index = SpellingIndex(terms, get_setting('SPELLING_MAX_DISTANCE', 2), get_setting('SPELLING_PREFIX_LENGTH', 7))
+        with _lock:
+            _indexes[key] = index
+            while len(_indexes) > get_setting('SPELLING_MAX_INDEXES', 100):
+                del _indexes[min(_indexes, key=lambda item: _indexes[item].created)]
+    except Exception:
+        # the old index stays, the next request tries again
+        logger.exception('building the spelling index of %s failed', table)
+    finally:
+        # the thread's own connection
+        db_connections[backend.database].close()
+        with _lock:
+            _building.discard(key)
@@ -2,9 +2,13 @@
 from django.conf import settings
 
 from background_task import background
+import datetime
+import logging
 import subprocess
 import os
 
+logger = logging.getLogger('yats.tasks')
+
 @background()
 def do_send_signal(msg, rcpt_list, atts=[]):
     if len(rcpt_list) == 0:
@@ -29,5 +33,130 @@ def do_send_signal(msg, rcpt_list, atts=[]):
 @background()
 def unlink_file(filename):
     if os.path.isfile(filename):
-        print 'unlink %s' % filename
+        print('unlink %s' % filename)
         os.unlink(filename)
+
+
+@background()
+def update_search_index():
+    from yats.models import search_queue
+
+    if hasattr(settings, 'SEARCH_QUEUE_BATCH_SIZE'):
+        batch_size = settings.SEARCH_QUEUE_BATCH_SIZE
+    else:
+        batch_size = 500
+
+    while True:
+        rows = list(search_queue.objects.order_by('c_date')[:batch_size])
+        if not rows:
+            break
+
+        # claim first, saves arriving meanwhile queue the document again
+        search_queue.objects.filter(pk__in=[row.pk for row in rows]).delete()
+        try:
+            reindex_documents([(row.django_ct, row.django_id) for row in rows])
+        except Exception:
+            search_queue.objects.bulk_create([search_queue(django_ct=row.django_ct, django_id=row.django_id) for row in rows], ignore_conflicts=True)
+            raise
+
+
+def reindex_documents(documents):
+    from django.apps import apps
+    from haystack import connections, connection_router
+    from haystack.exceptions import NotHandled
+
+    by_ct = {}
+    for django_ct, django_id in documents:
+        by_ct.setdefault(django_ct, set()).add(django_id)
+
+    for django_ct, ids in by_ct.items():
+        model = apps.get_model(*django_ct.split('.'))
+        for using in connection_router.for_write():
+            try:
+                index = connections[using].get_unified_index().get_index(model)
+            except NotHandled:
+                continue
+            backend = connections[using].get_backend()
+
+            objects = list(index.index_queryset(using=using).filter(pk__in=ids))
+            if objects:
+                backend.update(index, objects)
+
+            # deleted or no longer active
+            for django_id in ids - set(str(obj.pk) for obj in objects):
+                backend.remove('%s.%s' % (django_ct, django_id))
+
+
+@background(queue='previews')
+def build_preview(model_name, file_id):
+    from django.apps import apps
+    from yats.blobstore import get_file_path
+    from yats.shortcuts import build_file_preview, mark_preview
+
+    model = apps.get_model('yats', model_name)
+    try:
+        f = model.objects.get(pk=file_id)
+    except model.DoesNotExist:
+        # deleted before a worker got to it
+        return
+    src = get_file_path(f)
+    preview = get_file_path(f, 'preview')
+    # same content queued twice
+    if os.path.isfile(preview):
+        mark_preview(f)
+        return
+    if not os.path.isfile(src):
+        return
+    # queued again once the virus scan passed
+    if f.blob_id and f.blob.scan_state != 1:
+        return
+    build_file_preview(src, preview, f.content_type)
+    if os.path.isfile(preview):
+        mark_preview(f)
+
+
+@background(queue='transcriptions')
+def transcribe_file(file_id):
+    from yats.models import tickets_files, tickets_comments
+    from yats.blobstore import get_file_path
+    from yats.transcribe import transcribe_audio, TranscriptionError
+
+    try:
+        f = tickets_files.objects.get(pk=file_id, active_record=True)
+    except tickets_files.DoesNotExist:
+        return
+    try:
+        text = transcribe_audio(get_file_path(f))
+    except TranscriptionError as e:
+        # retrying does not help with a broken file or a missing engine
+        logger.warning('transcription of file %s failed: %s', file_id, e)
+        return
+    if text:
+        com = tickets_comments()
+        com.comment = text
+        com.ticket_id = f.ticket_id
+        com.action = 6
+        com.save(user_id=f.c_user_id)
+
+
+@background(queue='scans')
+def scan_blob(sha256):
+    from yats.virusscan import check_blob
+
+    # clamd errors raise, the task is retried later
+    check_blob(sha256)
+
+
+@background()
+def expire_upload_sessions():
+    from django.utils import timezone
+    from yats.models import upload_sessions
+
+    if hasattr(settings, 'UPLOAD_SESSION_EXPIRE_HOURS'):
+        hours = settings.UPLOAD_SESSION_EXPIRE_HOURS
+    else:
+        hours = 24
+
+    # post_delete removes the part files
+    for session in upload_sessions.objects.filter(u_date__lt=timezone.now() - datetime.timedelta(hours=hours)):
+        session.delete()
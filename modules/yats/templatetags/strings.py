@@ -1,13 +1,15 @@
 # -*- coding: utf-8 -*-
 from django import template
 from django.conf import settings
+from django.core.cache import caches
+from django.template.defaultfilters import force_escape, linebreaksbr, urlize
+from django.utils.safestring import mark_safe
 from django.utils.translation import gettext as _
 from django.forms.utils import pretty_name
 from yats.diff import generate_patch_html
 from yats.shortcuts import has_public_fields, non_previewable_contenttypes
 from markdownx.utils import markdownify
 
-import os
 import re
 try:
     import json
@@ -31,11 +33,8 @@ def hasPreview(mime):
     return True
 
 @register.filter
-def hasPreviewFile(fileid, type):
-    if type == 'doc':
-        return os.path.isfile('%sdocs/%s.preview' % (settings.FILE_UPLOAD_PATH, fileid))
-    else:
-        return os.path.isfile('%s%s.preview' % (settings.FILE_UPLOAD_PATH, fileid))
+def hasPreviewFile(file):
+    return file.has_preview
 
 @register.filter
 def prettify(value):
@@ -66,6 +65,59 @@ def buildToDoList(value):
 
     return re.sub('\[([ Xx])\]', render_item, value)
 
+# rendered html of text fields, cached per object, field and update time
+RENDER_CACHE_VERSION = 1
+
+def render_description(value):
+    return urlize(linebreaksbr(mark_safe(buildToDoList(numberToTicketURL(value))), True), True)
+
+def render_comment(value):
+    return urlize(linebreaksbr(mark_safe(numberToTicketURL(force_escape(value))), True), True)
+
+def render_doc(value):
+    return mark_safe(numberToTicketURL(buildToDoList(markdownify(value))))
+
+renderers = {
+    'description': render_description,
+    'comment': render_comment,
+    'text': render_doc,
+}
+
+def get_render_cache():
+    return caches[getattr(settings, 'RENDER_CACHE_ALIAS', 'default')]
+
+def render_key(obj, field):
+    return '%s.render.%s.%s.%s.%s.%s' % (getattr(settings, 'CACHE_MIDDLEWARE_KEY_PREFIX', ''), RENDER_CACHE_VERSION, obj._meta.label_lower, obj.pk, field, obj.u_date.timestamp())
+
+def prerender(objects, field):
+    """
+    renders field of all objects with one cache round trip, only the changed ones are rendered again
+    """
+    objects = [obj for obj in objects if field not in getattr(obj, '_rendered', {})]
+    if not objects:
+        return
+    cache = get_render_cache()
+    keys = [render_key(obj, field) for obj in objects]
+    cached = cache.get_many(keys)
+    missing = {}
+    for key, obj in zip(keys, objects):
+        if key in cached:
+            html = mark_safe(cached[key])
+        else:
+            html = renderers[field](getattr(obj, field) or '')
+            missing[key] = str(html)
+        if not hasattr(obj, '_rendered'):
+            obj._rendered = {}
+        obj._rendered[field] = html
+    if missing:
+        cache.set_many(missing, getattr(settings, 'RENDER_CACHE_TIMEOUT', 60 * 60 * 24 * 7))
+
+@register.filter
+def rendered(obj, field):
+    if field not in getattr(obj, '_rendered', {}):
+        prerender([obj], field)
+    return obj._rendered[field]
+
 class Diffs(template.Node):
     def __init__(self, line):
         self.line = line
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.test import Client, TestCase, override_settings
+
+from yats.models import organisation, UserProfile
+from yats.shortcuts import get_ticket_model
+
+LOCMEM = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'yats-test-respcache'}}
+
+
+@override_settings(CACHES=LOCMEM, CACHE_MIDDLEWARE_URLS=((r'^tickets/list/$', 60, ('tickets',)),))
+class ResponseCacheTest(TestCase):
+    def setUp(self):
+        caches['default'].clear()
+        self.alice = get_user_model().objects.create_user('alice', password='alice', is_staff=True)
+        self.bob = get_user_model().objects.create_user('bob', password='bob', is_staff=True)
+        self.org = organisation(name='cache')
+        self.org.save(user=self.alice)
+        UserProfile.objects.filter(user__in=[self.alice, self.bob]).update(organisation=self.org)
+        self.ticket = get_ticket_model()(caption='cached', description='cached', customer=self.org)
+        self.ticket.save(user=self.alice)
+
+    def client_for(self, user):
+        client = Client()
+        client.force_login(user)
+        # the first page sets the csrf and breadcrumb cookies, they are part of the cache key
+        self.assertEqual(client.get('/tickets/list/')['X-Cache'], 'MISS')
+        return client
+
+    def get(self, client):
+        response = client.get('/tickets/list/')
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_per_user(self):
+        alice = self.client_for(self.alice)
+        self.assertEqual(self.get(alice)['X-Cache'], 'MISS')
+        self.assertEqual(self.get(alice)['X-Cache'], 'HIT')
+        # same path, another user
+        bob = self.client_for(self.bob)
+        self.assertEqual(self.get(bob)['X-Cache'], 'MISS')
+        self.assertEqual(self.get(bob)['X-Cache'], 'HIT')
+        self.assertEqual(self.get(alice)['X-Cache'], 'HIT')
+
+    def test_invalidate_on_save(self):
+        alice = self.client_for(self.alice)
+        self.get(alice)
+        self.assertEqual(self.get(alice)['X-Cache'], 'HIT')
+
+        self.ticket.caption = 'changed'
+        self.ticket.save(user=self.alice)
+        response = self.get(alice)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertContains(response, 'changed')
+        self.assertEqual(self.get(alice)['X-Cache'], 'HIT')
+
+    def test_unrelated_save(self):
+        alice = self.client_for(self.alice)
+        self.get(alice)
+        # the login of bob only touches his last_login, no cached page shows it
+        self.client_for(self.bob)
+        self.assertEqual(self.get(alice)['X-Cache'], 'HIT')
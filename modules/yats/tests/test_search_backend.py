@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+from unittest import skipUnless
+
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import TestCase
+
+from haystack import connections
+from haystack.query import SearchQuerySet
+
+from yats.models import organisation, docs
+from yats.search_backend import SQLiteDialect
+from yats.search_indexes import DocIndex, TicketIndex
+from yats.shortcuts import get_ticket_model
+
+
+@skipUnless(connection.vendor == 'sqlite', 'fts5 dialect')
+class SQLiteSearchTest(TestCase):
+    def setUp(self):
+        # the backend remembers its setup, the tables of the last test are rolled back
+        connections['default'].reset_sessions()
+        self.backend = connections['default'].get_backend()
+        # the spelling index is built in a thread of its own, which can not see the test transaction
+        self.backend.include_spelling = False
+        self.assertIsInstance(self.backend.dialect, SQLiteDialect)
+
+        self.user = get_user_model().objects.create_user('search', password='search')
+        self.org = organisation(name='search')
+        self.org.save(user=self.user)
+        self.other = organisation(name='other')
+        self.other.save(user=self.user)
+
+        Ticket = get_ticket_model()
+        self.printer = Ticket(caption='printer jams', description='the printer on floor two jams on every page', customer=self.org)
+        self.printer.save(user=self.user)
+        self.mail = Ticket(caption='mail server down', description='no mail since monday', customer=self.other)
+        self.mail.save(user=self.user)
+        self.doc = docs(caption='printer manual', text='how to clear a paper jam')
+        self.doc.save(user=self.user)
+
+        self.backend.update(TicketIndex(), [self.printer, self.mail])
+        self.backend.update(DocIndex(), [self.doc])
+
+    def search(self, text, **filters):
+        return sorted((result.model_name, int(result.pk)) for result in SearchQuerySet().auto_query(text).filter(**filters))
+
+    def test_search(self):
+        Ticket = get_ticket_model()
+        self.assertEqual(self.search('printer'), sorted([(Ticket._meta.model_name, self.printer.pk), ('docs', self.doc.pk)]))
+        self.assertEqual(self.search('mail'), [(Ticket._meta.model_name, self.mail.pk)])
+        self.assertEqual(len(SearchQuerySet().filter(content_auto__contains='print')), 2)
+        self.assertEqual(self.search('printer -manual'), [(Ticket._meta.model_name, self.printer.pk)])
+        self.assertEqual(self.search('"paper jam"'), [('docs', self.doc.pk)])
+        self.assertEqual(self.search('monday', customer=self.org.pk), [])
+
+    def test_update(self):
+        self.printer.caption = 'scanner jams'
+        self.printer.description = 'the scanner stopped'
+        self.printer.save(user=self.user)
+        self.backend.update(TicketIndex(), [self.printer])
+
+        self.assertEqual(self.search('printer'), [('docs', self.doc.pk)])
+        self.assertEqual(self.search('scanner'), [(get_ticket_model()._meta.model_name, self.printer.pk)])
+        self.assertEqual(SearchQuerySet().count(), 3)
+
+    def test_remove(self):
+        self.backend.remove(self.printer)
+        self.assertEqual(self.search('printer'), [('docs', self.doc.pk)])
+
+        self.backend.clear(models=[docs])
+        self.assertEqual(self.search('printer'), [])
+        self.assertEqual(self.search('mail'), [(get_ticket_model()._meta.model_name, self.mail.pk)])
+
+        self.backend.clear()
+        self.assertEqual(SearchQuerySet().count(), 0)
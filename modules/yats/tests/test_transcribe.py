@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+from django.contrib.auth import get_user_model
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, override_settings
+
+from yats.blobstore import add_blob
+from yats.models import organisation, tickets_files, tickets_comments
+from yats.shortcuts import get_ticket_model
+from yats.tasks import transcribe_file
+
+import os
+import shutil
+import tempfile
+
+# stands in for ffmpeg: three seconds of silence at 16 kHz, 16 bit mono
+FFMPEG = '''#!/bin/sh
+head -c 96000 /dev/zero
+'''
+
+
+class TranscribeFileTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super(TranscribeFileTest, cls).setUpClass()
+        cls.folder = tempfile.mkdtemp()
+        ffmpeg = os.path.join(cls.folder, 'ffmpeg')
+        with open(ffmpeg, 'w') as fo:
+            fo.write(FFMPEG)
+        os.chmod(ffmpeg, 0o755)
+        cls.settings = override_settings(
+            FILE_UPLOAD_PATH=cls.folder,
+            FILE_UPLOAD_VIRUS_SCAN=False,
+            TRANSCRIPTION_RECOGNIZER='yats.transcribe.StubRecognizer',
+            TRANSCRIPTION_FFMPEG=ffmpeg,
+        )
+        cls.settings.enable()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.settings.disable()
+        shutil.rmtree(cls.folder, ignore_errors=True)
+        super(TranscribeFileTest, cls).tearDownClass()
+
+    def test_comment(self):
+        user = get_user_model().objects.create_user('audio', password='audio')
+        org = organisation(name='audio')
+        org.save(user=user)
+        ticket = get_ticket_model()(caption='audio', description='audio', customer=org)
+        ticket.save(user=user)
+        f = tickets_files(name='call.wav', size=4, content_type='audio/wav', ticket_id=ticket.pk, public=True)
+        f.blob = add_blob(SimpleUploadedFile('call.wav', b'RIFF', 'audio/wav'))
+        f.save(user=user)
+
+        transcribe_file.now(f.pk)
+
+        comment = tickets_comments.objects.get(ticket=ticket)
+        self.assertEqual(comment.comment, 'transcript of 3.0 seconds audio')
+        self.assertEqual(comment.action, 6)
+        self.assertEqual(comment.c_user_id, user.pk)
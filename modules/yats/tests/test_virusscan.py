@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+from django.contrib.auth import get_user_model
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, override_settings
+
+from yats import virusscan
+from yats.blobstore import add_blob, get_blob_path
+from yats.fakeclamd import FakeClamd, EICAR
+from yats.models import organisation, tickets_files, tickets_comments, file_blobs
+from yats.shortcuts import get_ticket_model
+
+import os
+import shutil
+import tempfile
+
+
+class CheckBlobTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super(CheckBlobTest, cls).setUpClass()
+        cls.clamd = FakeClamd().start()
+        cls.folder = tempfile.mkdtemp()
+        cls.settings = override_settings(FILE_UPLOAD_PATH=cls.folder, FILE_UPLOAD_VIRUS_SCAN=True, CLAMD_ADDRESS=cls.clamd.address)
+        cls.settings.enable()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.settings.disable()
+        cls.clamd.stop()
+        shutil.rmtree(cls.folder, ignore_errors=True)
+        super(CheckBlobTest, cls).tearDownClass()
+
+    def setUp(self):
+        # the pool of the process would keep talking to another clamd
+        virusscan._pool = None
+        self.user = get_user_model().objects.create_user('scan', password='scan')
+        org = organisation(name='scan')
+        org.save(user=self.user)
+        self.ticket = get_ticket_model()(caption='scan', description='scan', customer=org)
+        self.ticket.save(user=self.user)
+
+    def tearDown(self):
+        virusscan._pool = None
+
+    def attach(self, name, data):
+        f = tickets_files(name=name, size=len(data), content_type='application/zip', ticket_id=self.ticket.pk, public=True)
+        f.blob = add_blob(SimpleUploadedFile(name, data, 'application/zip'))
+        f.save(user=self.user)
+        return f
+
+    def test_clean(self):
+        f = self.attach('clean.zip', os.urandom(300000))
+        self.assertEqual(f.blob.scan_state, virusscan.SCAN_PENDING)
+
+        self.assertEqual(virusscan.check_blob(f.blob_id), virusscan.SCAN_CLEAN)
+        self.assertEqual(file_blobs.objects.get(pk=f.blob_id).scan_state, virusscan.SCAN_CLEAN)
+        self.assertTrue(tickets_files.objects.get(pk=f.pk).active_record)
+        self.assertTrue(os.path.isfile(get_blob_path(f.blob_id)))
+        self.assertEqual(self.clamd.scans, 1)
+
+    def test_eicar(self):
+        f = self.attach('eicar.zip', os.urandom(300000) + EICAR)
+
+        self.assertEqual(virusscan.check_blob(f.blob_id), virusscan.SCAN_INFECTED)
+        blob = file_blobs.objects.get(pk=f.blob_id)
+        self.assertEqual(blob.scan_state, virusscan.SCAN_INFECTED)
+        self.assertEqual(blob.virus, 'Eicar-Signature')
+        # quarantined: removed from the ticket and from disk
+        self.assertFalse(tickets_files.objects.get(pk=f.pk).active_record)
+        self.assertFalse(os.path.isfile(get_blob_path(f.blob_id)))
+        self.assertIn('Eicar-Signature', tickets_comments.objects.filter(ticket=self.ticket).last().comment)
+        self.assertEqual(virusscan.quarantine_response(tickets_files.objects.get(pk=f.pk)).status_code, 410)
@@ -1,6 +1,6 @@
 # -*- coding: utf-8 -*-
 from django.contrib.auth.decorators import login_required
-from django.shortcuts import render
+from django.shortcuts import render, get_object_or_404
 from django.http.response import HttpResponseRedirect, StreamingHttpResponse, HttpResponse, JsonResponse
 from django.apps import apps
 from django.conf import settings
@@ -12,26 +12,34 @@ from django.utils.encoding import smart_str
 from django.contrib.auth.models import User
 from django.utils import timezone
 from django.utils.http import parse_http_date_safe, http_date
+from django.utils.cache import get_conditional_response
+from django.db import transaction
+from django.db.models import Max, Count, OuterRef, Subquery
 from yats.forms import TicketsForm, CommentForm, UploadFileForm, SearchForm, TicketCloseForm, TicketReassignForm, AddToBordForm, SimpleTickets, ToDo
-from yats.models import tickets_files, tickets_comments, tickets_reports, ticket_resolution, tickets_participants, tickets_history, ticket_flow_edges, ticket_flow, get_flow_start, get_flow_end, tickets_ignorants, ticket_priority
-from yats.shortcuts import resize_image, touch_ticket, mail_ticket, jabber_ticket, signal_ticket, mail_comment, jabber_comment, signal_comment, mail_file, jabber_file, signal_file, clean_search_values, convert_sarch, check_references, remember_changes, add_history, prettyValues, add_breadcrumbs, get_ticket_model, build_ticket_search_ext, convertPDFtoImg, convertOfficeTpPDF, isPreviewable
-from yats.request import streamRanges
+from yats.models import upload_sessions, tickets_files, tickets_comments, tickets_reports, ticket_resolution, tickets_participants, tickets_history, ticket_flow_edges, ticket_flow, get_flow_start, get_flow_end, tickets_ignorants, ticket_priority
+from yats.shortcuts import thumbnail_response, touch_ticket, mail_ticket, jabber_ticket, signal_ticket, mail_comment, jabber_comment, signal_comment, mail_file, jabber_file, signal_file, clean_search_values, convert_sarch, check_references, remember_changes, add_history, prettyValues, add_breadcrumbs, get_last_search, set_last_search, get_ticket_model, build_ticket_search_ext, ical_todo_stream, needsPreview, queue_preview, queue_transcription, preview_pending_response
+from yats.request import streamRanges, pageETag, conditionalPage, setPageValidators
+from yats.uploadhandler import hash_upload, get_session_path, write_session_chunk, SessionUploadedFile
+from yats.blobstore import add_blob, get_file_path
+from yats.virusscan import quarantine_response
+from yats.templatetags.strings import prerender
+from yats.middleware.cache import invalidate_seen
 import os
-import io
 import graph
 import re
 import copy
 import datetime
 import time
+import calendar
 import hashlib
+import base64
+import binascii
+import fcntl
+import mimetypes
 try:
     import json
 except ImportError:
     from django.utils import simplejson as json
-try:
-    import pyclamd
-except Exception:
-    pass
 
 @login_required
 def create(request):
@@ -132,8 +140,211 @@ def simple(request):
         form = SimpleTickets(initial=initial)
     return render(request, 'tickets/new.html', {'layout': 'horizontal', 'form': form, 'mode': 'simple'})
 
+def add_ticket_file(request, tic, file_obj, content_type):
+    """
+    attaches a received upload (PUT or resumable) to the ticket, the virus scan runs in the background
+    """
+    hash = hash_upload(file_obj).hash
+
+    if tickets_files.objects.filter(active_record=True, ticket=tic.pk, checksum=hash).count() > 0:
+        raise Exception('duplicate hash value - file already exists in this ticket %s' % tic.pk)
+
+    f = tickets_files()
+    f.name = file_obj.name
+    f.size = file_obj.size
+    f.checksum = hash
+    f.content_type = content_type
+    f.ticket_id = tic.pk
+    f.public = True
+    with transaction.atomic():
+        f.blob = add_blob(file_obj)
+        f.save(user=request.user)
+
+    touch_ticket(request.user, tic.pk)
+
+    add_history(request, tic, 5, file_obj.name)
+
+    mail_file(request, f.pk)
+    jabber_file(request, f.pk)
+    signal_file(request, f.pk)
+
+    queue_preview(f)
+
+    queue_transcription(f)
+
+    return f
+
+
+TUS_VERSION = '1.0.0'
+
+
+def tus_response(status, headers={}):
+    resp = HttpResponse(status=status)
+    resp['Tus-Resumable'] = TUS_VERSION
+    resp['Cache-Control'] = 'no-store'
+    for key, value in headers.items():
+        resp[key] = str(value)
+    return resp
+
+
+def tus_capabilities():
+    headers = {'Tus-Version': TUS_VERSION, 'Tus-Extension': 'creation,termination'}
+    if getattr(settings, 'UPLOAD_SESSION_MAX_SIZE', None):
+        headers['Tus-Max-Size'] = settings.UPLOAD_SESSION_MAX_SIZE
+    return headers
+
+
+def parse_upload_metadata(header):
+    # Upload-Metadata: filename d29ybGQucGRm,filetype YXBwbGljYXRpb24vcGRm
+    metadata = {}
+    for pair in header.split(','):
+        parts = pair.strip().split(' ', 1)
+        if not parts[0]:
+            continue
+        try:
+            metadata[parts[0]] = base64.b64decode(parts[1]).decode('utf-8') if len(parts) > 1 else ''
+        except (binascii.Error, UnicodeDecodeError):
+            pass
+    return metadata
+
+
+def create_upload_session(request, tic):
+    """
+    POST /tickets/upload/XXX/ with Upload-Length, answers with the Location to PATCH the chunks to
+    """
+    from yats.tasks import expire_upload_sessions
+    from background_task.tasks import TaskSchedule
+
+    try:
+        length = int(request.META.get('HTTP_UPLOAD_LENGTH', ''))
+    except ValueError:
+        length = 0
+    if length <= 0:
+        resp = tus_response(400)
+        resp.content = 'invalid Upload-Length: %s' % request.META.get('HTTP_UPLOAD_LENGTH', 'missing')
+        return resp
+    max_size = getattr(settings, 'UPLOAD_SESSION_MAX_SIZE', None)
+    if max_size and length > max_size:
+        return tus_response(413)
+
+    metadata = parse_upload_metadata(request.META.get('HTTP_UPLOAD_METADATA', ''))
+    name = metadata.get('filename') or request.GET.get('filename')
+    if not name:
+        return HttpResponse('missing filename', status=400)
+    name = os.path.basename(name)
+    content_type = metadata.get('filetype') or mimetypes.guess_type(name)[0] or 'application/octet-stream'
+
+    session = upload_sessions.objects.create(ticket_id=tic.pk, user=request.user, name=name[:255], content_type=content_type, length=length)
+    open(get_session_path(session.pk), 'wb').close()
+
+    if hasattr(settings, 'UPLOAD_SESSION_EXPIRE_HOURS'):
+        hours = settings.UPLOAD_SESSION_EXPIRE_HOURS
+    else:
+        hours = 24
+    expire_upload_sessions(schedule={'run_at': hours * 3600, 'action': TaskSchedule.CHECK_EXISTING})
+
+    return tus_response(201, {'Location': '/tickets/upload/%s/%s/' % (tic.pk, session.pk.hex), 'Upload-Offset': 0})
+
+
+@login_required
+def upload_session(request, ticket, session):
+    """
+    resumable upload (tus 1.0): HEAD for the offset, PATCH the next chunk, DELETE to cancel
+    chunks go straight into the upload folder, the last one attaches the file to the ticket
+    """
+    session = get_object_or_404(upload_sessions, pk=session, ticket=ticket, user=request.user)
+
+    if request.method == 'OPTIONS':
+        return tus_response(204, tus_capabilities())
+
+    if request.method in ('HEAD', 'GET'):
+        return tus_response(200, {'Upload-Offset': session.offset, 'Upload-Length': session.length})
+
+    if request.method == 'DELETE':
+        session.delete()
+        return tus_response(204)
+
+    if request.method != 'PATCH':
+        return tus_response(405)
+
+    if request.META.get('CONTENT_TYPE', '').split(';')[0].strip() != 'application/offset+octet-stream':
+        return tus_response(415)
+    try:
+        offset = int(request.META['HTTP_UPLOAD_OFFSET'])
+        content_length = int(request.META.get('CONTENT_LENGTH') or 0)
+    except (KeyError, ValueError):
+        return tus_response(400)
+
+    try:
+        fo = open(get_session_path(session.pk), 'r+b')
+    except FileNotFoundError:
+        return tus_response(404)
+    with fo:
+        # one PATCH per session at a time, across all processes
+        try:
+            fcntl.flock(fo, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return tus_response(409, {'Upload-Offset': session.offset})
+        try:
+            session.refresh_from_db()
+        except upload_sessions.DoesNotExist:
+            return tus_response(404)
+        if offset != session.offset:
+            return tus_response(409, {'Upload-Offset': session.offset})
+
+        written = write_session_chunk(session.pk, fo, offset, request, min(content_length, session.length - offset))
+        session.offset += written
+        session.u_date = timezone.now()
+        session.save(update_fields=['offset', 'u_date'])
+
+        if session.offset < session.length:
+            return tus_response(204, {'Upload-Offset': session.offset})
+
+        # complete, still holding the lock
+        tic = get_ticket_model().objects.get(pk=ticket)
+        file_obj = SessionUploadedFile(session)
+        try:
+            f = add_ticket_file(request, tic, file_obj, session.content_type)
+        except Exception as e:
+            session.delete()
+            return HttpResponse(str(e), status=422)
+        finally:
+            file_obj.close()
+        session.delete()
+
+    return tus_response(204, {'Upload-Offset': f.size, 'Content-Location': '/tickets/download/%s/?file=%s' % (tic.pk, f.pk)})
+
+
+def ticket_validators(request, ticket, mode):
+    """
+    etag and last modified of the ticket pages with one query, None if the ticket does not exist
+    """
+    def latest(model, field):
+        return Subquery(model.objects.filter(ticket=OuterRef('pk')).order_by('-%s' % field).values(field)[:1])
+
+    row = get_ticket_model().objects.filter(pk=ticket).annotate(
+        last_comment=latest(tickets_comments, 'u_date'),
+        last_file=latest(tickets_files, 'u_date'),
+        last_history=latest(tickets_history, 'c_date'),
+        participants=Subquery(tickets_participants.objects.filter(ticket=OuterRef('pk')).values('ticket').annotate(count=Count('pk')).values('count')[:1]),
+        seen=Subquery(tickets_participants.objects.filter(ticket=OuterRef('pk'), user=request.user).values('seen')[:1]),
+    ).values_list('last_action_date', 'u_date', 'last_comment', 'last_file', 'last_history', 'participants', 'seen').first()
+    if row is None:
+        return None, None
+    last_modified = max(filter(None, row[:5]))
+    return pageETag(request, mode, ticket, *row), last_modified
+
+
 @login_required
 def action(request, mode, ticket):
+    etag = last_modified = None
+    if mode in ('view', 'gallery', 'history') and request.method in ('GET', 'HEAD'):
+        # answer unchanged pages before loading anything
+        etag, last_modified = ticket_validators(request, ticket, mode)
+        response = conditionalPage(request, etag, last_modified)
+        if response:
+            return response
+
     mod_path, cls_name = settings.TICKET_CLASS.rsplit('.', 1)
     mod_path = mod_path.split('.').pop(0)
     tic = apps.get_model(mod_path, cls_name).objects.get(pk=ticket)
@@ -206,7 +417,8 @@ def action(request, mode, ticket):
         reassign.fields['state'].queryset = reassign.fields['state'].queryset.filter(id__in=flows)
 
         participants = tickets_participants.objects.select_related('user').filter(ticket=ticket)
-        comments = tickets_comments.objects.select_related('c_user').filter(ticket=ticket).order_by('c_date')
+        comments = list(tickets_comments.objects.select_related('c_user').filter(ticket=ticket).order_by('c_date'))
+        prerender(comments, 'comment')
 
         close_allowed = ticket_flow_edges.objects.select_related('next').filter(now=tic.state, next__type=2).count() > 0
 
@@ -227,7 +439,8 @@ def action(request, mode, ticket):
             request.session['isUsingYATSE'] = True
 
         flows = ticket_flow_edges.objects.select_related('next').filter(now=tic.state).exclude(next__type=2)
-        return render(request, 'tickets/view.html', {'layout': 'horizontal', 'ticket': tic, 'form': form, 'close': close, 'reassign': reassign, 'files': files_lines, 'comments': comments, 'participants': participants, 'close_allowed': close_allowed, 'keep_it_simple': keep_it_simple, 'last_action_date': http_date(time.mktime(tic.last_action_date.timetuple())), 'flows': flows})
+        response = render(request, 'tickets/view.html', {'layout': 'horizontal', 'ticket': tic, 'form': form, 'close': close, 'reassign': reassign, 'files': files_lines, 'comments': comments, 'participants': participants, 'close_allowed': close_allowed, 'keep_it_simple': keep_it_simple, 'last_action_date': http_date(time.mktime(tic.last_action_date.timetuple())), 'flows': flows})
+        return setPageValidators(response, etag, last_modified)
 
     elif mode == 'json':
         result = {
@@ -239,11 +452,13 @@ def action(request, mode, ticket):
 
     elif mode == 'gallery':
         images = tickets_files.objects.filter(ticket=ticket, active_record=True)
-        return render(request, 'tickets/gallery.html', {'layout': 'horizontal', 'ticket': tic, 'images': images})
+        response = render(request, 'tickets/gallery.html', {'layout': 'horizontal', 'ticket': tic, 'images': images})
+        return setPageValidators(response, etag, last_modified)
 
     elif mode == 'history':
         history = tickets_history.objects.filter(ticket=ticket)
-        return render(request, 'tickets/history.html', {'layout': 'horizontal', 'ticket': tic, 'history': history, 'keep_it_simple': keep_it_simple})
+        response = render(request, 'tickets/history.html', {'layout': 'horizontal', 'ticket': tic, 'history': history, 'keep_it_simple': keep_it_simple})
+        return setPageValidators(response, etag, last_modified)
 
     elif mode == 'reopen':
         if tic.closed:
@@ -444,33 +659,42 @@ def action(request, mode, ticket):
 
     elif mode == 'download':
         fileid = request.GET.get('file', -1)
-        file_data = tickets_files.objects.get(id=fileid, ticket=ticket)
-        src = '%s%s.dat' % (settings.FILE_UPLOAD_PATH, fileid)
+        file_data = tickets_files.objects.select_related('blob').get(id=fileid, ticket=ticket)
+        response = quarantine_response(file_data)
+        if response:
+            return response
+        src = get_file_path(file_data)
         content_type = file_data.content_type
         content_length = file_data.size
-        if request.GET.get('preview') == 'yes' and os.path.isfile('%s%s.preview' % (settings.FILE_UPLOAD_PATH, fileid)):
-            src = '%s%s.preview' % (settings.FILE_UPLOAD_PATH, fileid)
+        etag = '"%s"' % file_data.checksum if file_data.checksum else None
+        if request.GET.get('preview') == 'yes' and file_data.has_preview:
+            src = get_file_path(file_data, 'preview')
             content_type = 'imgae/png'
+            etag = '"%s-preview"' % file_data.checksum if file_data.checksum else None
+        elif request.GET.get('preview') == 'yes' and needsPreview(file_data.content_type):
+            return preview_pending_response()
 
         if request.GET.get('resize', 'no') == 'yes' and ('image' in file_data.content_type or 'pdf' in file_data.content_type):
-            img = resize_image('%s' % (src), (200, 150), 75)
-            output = io.BytesIO()
-            img.save(output, 'PNG')
-            output.seek(0)
-            response = StreamingHttpResponse(output, content_type='image/png')
+            response = thumbnail_response(request, src, (200, 150))
 
         else:
-            response = streamRanges(request, src, content_type)
+            response = streamRanges(request, src, content_type, etag=etag)
 
         if 'noDisposition' not in request.GET:
-            if request.GET.get('preview') == 'yes' and os.path.isfile('%s%s.preview' % (settings.FILE_UPLOAD_PATH, fileid)):
+            if request.GET.get('preview') == 'yes' and file_data.has_preview:
                 response['Content-Disposition'] = 'attachment;filename="%s"' % content_type
             else:
                 response['Content-Disposition'] = 'attachment;filename="%s"' % smart_str(file_data.name)
         return response
 
     elif mode == 'upload':
-        if request.method == 'POST':
+        if request.method == 'OPTIONS':
+            return tus_response(204, tus_capabilities())
+
+        elif request.method == 'POST' and 'HTTP_UPLOAD_LENGTH' in request.META:
+            return create_upload_session(request, tic)
+
+        elif request.method == 'POST':
             form = UploadFileForm(request.POST, request.FILES)
             if form.is_valid():
                 if tickets_files.objects.filter(active_record=True, ticket=ticket, checksum=request.FILES['file'].hash).count() > 0:
@@ -485,57 +709,17 @@ def action(request, mode, ticket):
                 f.content_type = request.FILES['file'].content_type
                 f.ticket_id = ticket
                 f.public = True
-                f.save(user=request.user)
+                with transaction.atomic():
+                    f.blob = add_blob(request.FILES['file'])
+                    f.save(user=request.user)
 
                 touch_ticket(request.user, ticket)
 
                 add_history(request, tic, 5, request.FILES['file'].name)
 
-                dest = settings.FILE_UPLOAD_PATH
-                if not os.path.exists(dest):
-                    os.makedirs(dest)
-
-                with open('%s%s.dat' % (dest, f.id), 'wb+') as destination:
-                    for chunk in request.FILES['file'].chunks():
-                        destination.write(chunk)
+                queue_preview(f)
 
-                if 'pdf' in f.content_type:
-                    convertPDFtoImg('%s/%s.dat' % (dest, f.id), '%s/%s.preview' % (dest, f.id))
-                else:
-                    if 'image' not in f.content_type and isPreviewable(f.content_type):
-                        tmp = convertOfficeTpPDF('%s/%s.dat' % (dest, f.id))
-                        convertPDFtoImg(tmp, '%s/%s.preview' % (dest, f.id))
-
-                        from yats.tasks import unlink_file
-                        unlink_file(tmp)
-
-                if 'audio' in f.content_type:
-                    try:
-                        import tempfile
-                        with tempfile.NamedTemporaryFile(dir='/tmp', delete=False) as tmpfile:
-                            tmp = tmpfile.name
-                        from pydub import AudioSegment
-                        sound = AudioSegment.from_mp3('%s%s.dat' % (dest, f.id))
-                        sound.export(tmp, format="wav")
-
-                        # https://realpython.com/python-speech-recognition/
-                        import speech_recognition as sr
-                        r = sr.Recognizer()
-                        with sr.AudioFile(tmp) as source:
-                            audio = r.record(source)  # read the entire audio file
-
-                        text = r.recognize_google(audio, language='de-DE')
-                        if text:
-                            com = tickets_comments()
-                            com.comment = text
-                            com.ticket_id = ticket
-                            com.action = 6
-                            com.save(user=request.user)
-                    except Exception:
-                        pass
-
-                    from yats.tasks import unlink_file
-                    unlink_file(tmp)
+                queue_transcription(f)
 
                 mail_file(request, f.pk)
                 jabber_file(request, f.pk)
@@ -600,119 +784,11 @@ def action(request, mode, ticket):
             for i, handler in enumerate(upload_handlers):
                 file_obj = handler.file_complete(counters[i])
                 if file_obj:
-                    if settings.FILE_UPLOAD_VIRUS_SCAN and pyclamd:
-                        # virus scan
-                        try:
-                            if not hasattr(pyclamd, 'scan_stream'):
-                                cd = pyclamd.ClamdUnixSocket()
-                            else:
-                                pyclamd.init_network_socket('localhost', 3310)
-                                cd = pyclamd
-
-                            # We need to get a file object for clamav. We might have a path or we might
-                            # have to read the data into memory.
-                            if hasattr(file_obj, 'temporary_file_path'):
-                                os.chmod(file_obj.temporary_file_path(), 0o664)
-                                result = cd.scan_file(file_obj.temporary_file_path())
-                            else:
-                                if hasattr(file_obj, 'read'):
-                                    result = cd.scan_stream(file_obj.read())
-                                else:
-                                    result = cd.scan_stream(file_obj['content'])
-                        except Exception:
-                            from socket import gethostname
-                            raise Exception(_(u'unable to initialize scan engine on host %s') % gethostname())
-
-                        if result:
-                            msg = ' '.join(result[result.keys()[0]]).replace('FOUND ', '')
-                            raise Exception(_(u"file is infected by virus: %s") % msg)
-
-                    hasher = hashlib.md5()
-                    # We need to get a file object for clamav. We might have a path or we might
-                    # have to read the data into memory.
-                    if hasattr(file_obj, 'temporary_file_path'):
-                        with open(file_obj.temporary_file_path(), 'rb') as afile:
-                            buf = afile.read()
-                            hasher.update(buf)
-                        hash = hasher.hexdigest()
-                    else:
-                        if hasattr(file_obj, 'read'):
-                            file_obj.seek(0)
-                            buf = file_obj.read()
-                            hasher.update(buf)
-                        else:
-                            hasher.update(file_obj['content'].read())
-                    hash = hasher.hexdigest()
-
-                    if tickets_files.objects.filter(active_record=True, ticket=ticket, checksum=hash).count() > 0:
-                        raise Exception('duplicate hash value - file already exists in this ticket %s' % ticket)
-
-                    # todo: virusscan
-                    f = tickets_files()
-                    f.name = file_obj.name
-                    f.size = file_obj.size
-                    f.checksum = hash
-                    f.content_type = content_type
-                    f.ticket_id = ticket
-                    f.public = True
-                    f.save(user=request.user)
-
-                    touch_ticket(request.user, ticket)
-
-                    add_history(request, tic, 5, file_obj.name)
-
-                    mail_file(request, f.pk)
-                    jabber_file(request, f.pk)
-                    signal_file(request, f.pk)
-
-                    dest = settings.FILE_UPLOAD_PATH
-                    if not os.path.exists(dest):
-                        os.makedirs(dest)
-
-                    with open('%s%s.dat' % (dest, f.id), 'wb+') as destination:
-                        for chunk in file_obj.chunks():
-                            destination.write(chunk)
-
-                    if 'pdf' in f.content_type:
-                        convertPDFtoImg('%s/%s.dat' % (dest, f.id), '%s/%s.preview' % (dest, f.id))
-                    else:
-                        if 'image' not in f.content_type and isPreviewable(f.content_type):
-                            try:
-                                tmp = convertOfficeTpPDF('%s/%s.dat' % (dest, f.id))
-                                convertPDFtoImg(tmp, '%s/%s.preview' % (dest, f.id))
-                                if os.path.isfile(tmp):
-                                    os.unlink(tmp)
-                            except Exception:
-                                pass
-
-                    if 'audio' in f.content_type:
-                        try:
-                            import tempfile
-                            with tempfile.NamedTemporaryFile(dir='/tmp', delete=False) as tmpfile:
-                                tmp = tmpfile.name
-                            from pydub import AudioSegment
-                            sound = AudioSegment.from_mp3('%s%s.dat' % (dest, f.id))
-                            sound.export(tmp, format="wav")
-
-                            # https://realpython.com/python-speech-recognition/
-                            import speech_recognition as sr
-                            r = sr.Recognizer()
-                            with sr.AudioFile(tmp) as source:
-                                audio = r.record(source)  # read the entire audio file
-
-                            text = r.recognize_google(audio, language='de-DE')
-                            if text:
-                                com = tickets_comments()
-                                com.comment = text
-                                com.ticket_id = ticket
-                                com.action = 6
-                                com.save(user=request.user)
-                        except Exception:
-                            pass
-
-                        from yats.tasks import unlink_file
-                        unlink_file(tmp)
-
+                    try:
+                        add_ticket_file(request, tic, file_obj, content_type)
+                    finally:
+                        # moved into the store, not in request.FILES so nobody else closes it
+                        file_obj.close()
                     return HttpResponse(status=201)
 
                 else:
@@ -736,6 +812,7 @@ def action(request, mode, ticket):
 
     elif mode == 'notify':
         tickets_participants.objects.filter(ticket=tic, user=request.user).update(seen=True)
+        invalidate_seen(request.user)
         return HttpResponse('OK')
 
     elif mode == 'sleep':
@@ -968,24 +1045,24 @@ def search(request):
     if request.method == 'POST' and 'reportname' in request.POST and request.POST['reportname']:
         rep = tickets_reports()
         rep.name = request.POST['reportname']
-        rep.search = json.dumps(request.session['last_search'], cls=DjangoJSONEncoder)
+        last_search = get_last_search(request)[0]
+        rep.search = json.dumps(last_search, cls=DjangoJSONEncoder)
         rep.save(user=request.user)
 
-        request.session['last_search'] = convert_sarch(clean_search_values(request.session['last_search']))
-        request.session['last_search_caption'] = request.POST['reportname']
+        last_search = set_last_search(request, convert_sarch(clean_search_values(last_search)), request.POST['reportname'])
 
-        return table(request, search=request.session['last_search'], list_caption=request.session['last_search_caption'])
+        return table(request, search=last_search, list_caption=request.POST['reportname'])
 
     if request.method == 'POST':
         form = SearchForm(request.POST, include_list=searchable_fields, is_stuff=request.user.is_staff, user=request.user, customer=request.organisation.id)
         form.is_valid()
-        request.session['last_search'] = convert_sarch(clean_search_values(form.cleaned_data))
-        request.session['last_search_caption'] = ''
+        last_search = set_last_search(request, convert_sarch(clean_search_values(form.cleaned_data)), '')
 
-        return table(request, search=request.session['last_search'])
+        return table(request, search=last_search)
 
-    if 'last_search' in request.session and 'new' not in request.GET:
-        return table(request, search=request.session['last_search'], list_caption=request.session.get('last_search_caption', ''))
+    last_search, caption = get_last_search(request)
+    if last_search is not None and 'new' not in request.GET:
+        return table(request, search=last_search, list_caption=caption)
 
     return HttpResponseRedirect('/tickets/search/extended/')
 
@@ -1001,11 +1078,11 @@ def search_ex(request):
     searchable_fields = settings.TICKET_SEARCH_FIELDS
 
     if request.method == 'POST':
-        request.session['last_search'] = json.loads(request.POST['query'])
-        return table(request, search=request.session['last_search'])
+        last_search = set_last_search(request, json.loads(request.POST['query']))
+        return table(request, search=last_search)
 
     if request.method == 'GET' and 'page' in request.GET:
-        return table(request, search=request.session['last_search'])
+        return table(request, search=get_last_search(request)[0])
 
     form = SearchForm(include_list=searchable_fields, is_stuff=request.user.is_staff, user=request.user, customer=request.organisation.id)
     return render(request, 'tickets/querybuilder.html', {'form': form})
@@ -1015,7 +1092,7 @@ def reports(request):
     if 'report' in request.GET:
         rep = tickets_reports.objects.get(pk=request.GET['report'])
         add_breadcrumbs(request, request.GET['report'], '@', caption=rep.name[:20])
-        request.session['last_search'] = json.loads(rep.search)
+        set_last_search(request, json.loads(rep.search))
         return HttpResponseRedirect('/tickets/search/?report=%s' % request.GET['report'])
 
     if 'delReport' in request.GET:
@@ -1037,6 +1114,27 @@ def reports(request):
 
     return render(request, 'tickets/reports.html', {'lines': rep_lines})
 
+@login_required
+def report_ics(request, report):
+    rep = get_object_or_404(tickets_reports, pk=report, c_user=request.user, active_record=True)
+    tic = get_ticket_model().objects.select_related('priority').all()
+    search_params, tic = build_ticket_search_ext(request, tic, json.loads(rep.search))
+
+    stats = tic.aggregate(last_action=Max('last_action_date'), count=Count('id'))
+    last_modified = max(filter(None, [stats['last_action'], rep.u_date, rep.c_date]))
+    etag = '"%s"' % hashlib.md5(('%s-%s-%s' % (rep.pk, last_modified.isoformat(), stats['count'])).encode('utf-8')).hexdigest()
+    last_modified = calendar.timegm(last_modified.utctimetuple())
+
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response:
+        return response
+
+    response = StreamingHttpResponse(ical_todo_stream(tic.order_by('id').iterator(), rep.name), content_type='text/calendar; charset=utf-8')
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    response['Content-Disposition'] = 'inline; filename="%s.ics"' % rep.slug
+    return response
+
 @login_required
 def workflow(request):
     if request.method == 'POST':
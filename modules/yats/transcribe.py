@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+"""
+speech to text for audio attachments, run by yats.tasks.transcribe_file:
+manage.py process_tasks --queue transcriptions
+
+ffmpeg decodes the upload to 16 bit mono pcm and hands it over in small chunks,
+no complete wav is ever built in memory or on disk. the recognizer is
+configurable:
+
+TRANSCRIPTION_RECOGNIZER = 'yats.transcribe.VoskRecognizer'  # offline, needs TRANSCRIPTION_VOSK_MODEL
+TRANSCRIPTION_RECOGNIZER = 'yats.transcribe.StubRecognizer'  # tests, no engine needed
+TRANSCRIPTION_RECOGNIZER = None                              # no transcriptions
+
+a recognizer gets an iterable of pcm chunks at its sample_rate and returns the text.
+"""
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+import json
+import subprocess
+import threading
+
+try:
+    import vosk
+except ImportError:
+    vosk = None
+
+_recognizer = None
+_lock = threading.Lock()
+
+
+def get_setting(name, default):
+    if hasattr(settings, name):
+        return getattr(settings, name)
+    return default
+
+
+class TranscriptionError(Exception):
+    pass
+
+
+class Recognizer(object):
+    sample_rate = 16000
+
+    def transcribe(self, chunks):
+        raise NotImplementedError()
+
+
+class VoskRecognizer(Recognizer):
+    """
+    offline recognition with vosk (pip install vosk), the language is the one of the model:
+    TRANSCRIPTION_VOSK_MODEL = '/usr/share/vosk/vosk-model-small-de-0.15'
+    """
+    def __init__(self, model_path=None):
+        if vosk is None:
+            raise TranscriptionError('vosk is not installed')
+        model_path = model_path or get_setting('TRANSCRIPTION_VOSK_MODEL', None)
+        if not model_path:
+            raise TranscriptionError('TRANSCRIPTION_VOSK_MODEL is not set')
+        vosk.SetLogLevel(-1)
+        # loading takes seconds, the worker keeps it
+        self.model = vosk.Model(model_path)
+
+    def transcribe(self, chunks):
+        recognizer = vosk.KaldiRecognizer(self.model, self.sample_rate)
+        parts = []
+        for data in chunks:
+            if recognizer.AcceptWaveform(data):
+                parts.append(json.loads(recognizer.Result()).get('text', ''))
+        parts.append(json.loads(recognizer.FinalResult()).get('text', ''))
+        return ' '.join(part for part in parts if part)
+
+
+class StubRecognizer(Recognizer):
+    """
+    recognizes nothing, answers TRANSCRIPTION_STUB_TEXT (%(seconds)s is the length of the audio)
+    """
+    def transcribe(self, chunks):
+        size = sum(len(data) for data in chunks)
+        text = get_setting('TRANSCRIPTION_STUB_TEXT', 'transcript of %(seconds).1f seconds audio')
+        return text % {'seconds': size / 2.0 / self.sample_rate}
+
+
+def get_recognizer():
+    """
+    recognizer of this process, None if transcriptions are switched off
+    """
+    global _recognizer
+    path = get_setting('TRANSCRIPTION_RECOGNIZER', 'yats.transcribe.VoskRecognizer')
+    if not path:
+        return None
+    with _lock:
+        if _recognizer is None or '%s.%s' % (_recognizer.__class__.__module__, _recognizer.__class__.__name__) != path:
+            _recognizer = import_string(path)()
+    return _recognizer
+
+
+def decode_audio(path, sample_rate=16000, chunk_size=32000):
+    """
+    yields raw 16 bit mono pcm, one second per chunk at 16 kHz
+    """
+    command = get_setting('TRANSCRIPTION_FFMPEG', 'ffmpeg')
+    try:
+        process = subprocess.Popen([
+            command, '-nostdin', '-loglevel', 'error',
+            '-i', path, '-f', 's16le', '-acodec', 'pcm_s16le', '-ac', '1', '-ar', str(sample_rate), '-',
+        ], stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    except OSError as e:
+        raise TranscriptionError('unable to run %s: %s' % (command, e))
+    try:
+        while True:
+            data = process.stdout.read(chunk_size)
+            if not data:
+                break
+            yield data
+        error = process.stderr.read()
+        if process.wait() != 0:
+            raise TranscriptionError('ffmpeg could not decode %s: %s' % (path, error.decode('utf-8', 'replace').strip()))
+    finally:
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+        process.stdout.close()
+        process.stderr.close()
+
+
+def transcribe_audio(path, recognizer=None):
+    recognizer = recognizer or get_recognizer()
+    if recognizer is None:
+        return None
+    return recognizer.transcribe(decode_audio(path, recognizer.sample_rate)).strip()
@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+from django.conf import settings
+from django.core.files.uploadedfile import TemporaryUploadedFile, UploadedFile
+from django.core.files.uploadhandler import FileUploadHandler
+from django.http import UnreadablePostError
+
+import hashlib
+import os
+import tempfile
+
+
+def get_upload_temp_dir():
+    # same filesystem as the final destination, so storing the upload is a rename
+    if hasattr(settings, 'FILE_UPLOAD_TEMP_DIR') and settings.FILE_UPLOAD_TEMP_DIR:
+        return settings.FILE_UPLOAD_TEMP_DIR
+    dest = os.path.join(str(settings.FILE_UPLOAD_PATH), 'tmp')
+    if not os.path.exists(dest):
+        os.makedirs(dest)
+    return dest
+
+
+class HashedUploadedFile(TemporaryUploadedFile):
+    def __init__(self, name, content_type, size, charset, content_type_extra=None):
+        _, ext = os.path.splitext(name)
+        file = tempfile.NamedTemporaryFile(suffix='.upload' + ext, dir=get_upload_temp_dir())
+        UploadedFile.__init__(self, file, name, content_type, size, charset, content_type_extra)
+        self.hash = None
+        self.sha256 = None
+
+
+class HashingFileUploadHandler(FileUploadHandler):
+    """
+    FILE_UPLOAD_HANDLERS = ['yats.uploadhandler.HashingFileUploadHandler']
+
+    writes the upload to disk as it arrives and computes md5 (.hash) and sha256 (.sha256)
+    on the way, nothing needs to read the file again afterwards.
+    """
+    def new_file(self, *args, **kwargs):
+        super(HashingFileUploadHandler, self).new_file(*args, **kwargs)
+        self.file = HashedUploadedFile(self.file_name, self.content_type, 0, self.charset, self.content_type_extra)
+        self.md5 = hashlib.md5()
+        self.sha256 = hashlib.sha256()
+
+    def receive_data_chunk(self, raw_data, start):
+        self.md5.update(raw_data)
+        self.sha256.update(raw_data)
+        self.file.write(raw_data)
+
+    def file_complete(self, file_size):
+        self.file.seek(0)
+        self.file.size = file_size
+        self.file.hash = self.md5.hexdigest()
+        self.file.sha256 = self.sha256.hexdigest()
+        return self.file
+
+    def upload_interrupted(self):
+        if hasattr(self, 'file'):
+            self.file.close()
+
+
+def hash_upload(upload):
+    """
+    sets .hash and .sha256 on uploads that did not pass HashingFileUploadHandler
+    """
+    if getattr(upload, 'hash', None) and getattr(upload, 'sha256', None):
+        return upload
+    md5 = hashlib.md5()
+    sha256 = hashlib.sha256()
+    upload.seek(0)
+    for chunk in upload.chunks():
+        md5.update(chunk)
+        sha256.update(chunk)
+    upload.seek(0)
+    upload.hash = md5.hexdigest()
+    upload.sha256 = sha256.hexdigest()
+    return upload
+
+
+def store_uploaded_file(upload, dest):
+    from django.core.files.move import file_move_safe
+
+    folder = os.path.dirname(dest)
+    if folder and not os.path.exists(folder):
+        os.makedirs(folder)
+
+    if hasattr(upload, 'temporary_file_path'):
+        file_move_safe(upload.temporary_file_path(), dest, allow_overwrite=True)
+        os.chmod(dest, 0o644)
+    else:
+        # readers never see a half written file
+        with open('%s.part' % dest, 'wb+') as destination:
+            for chunk in upload.chunks():
+                destination.write(chunk)
+        os.replace('%s.part' % dest, dest)
+
+
+# running digests of resumable uploads by session id: (offset, md5, sha256)
+# a chunk received by another process drops them, the file is hashed once when complete.
+# least recently written first, abandoned uploads are dropped beyond UPLOAD_SESSION_HASHERS_MAX
+_session_hashers = {}
+
+
+def drop_session_hashers(session_id):
+    _session_hashers.pop(session_id, None)
+
+
+def get_session_path(session_id):
+    folder = os.path.join(get_upload_temp_dir(), 'sessions')
+    if not os.path.exists(folder):
+        os.makedirs(folder)
+    return os.path.join(folder, '%s.part' % session_id)
+
+
+def write_session_chunk(session_id, fo, offset, stream, length, chunk_size=64 * 1024):
+    """
+    copies up to length bytes from stream to fo at offset, returns the bytes written
+    if the client goes away, everything received so far is kept
+    """
+    hashers = _session_hashers.pop(session_id, None)
+    if hashers and hashers[0] != offset:
+        hashers = None
+    if hashers is None and offset == 0:
+        hashers = (0, hashlib.md5(), hashlib.sha256())
+
+    written = 0
+    fo.seek(offset)
+    try:
+        while written < length:
+            chunk = stream.read(min(chunk_size, length - written))
+            if not chunk:
+                break
+            fo.write(chunk)
+            if hashers:
+                hashers[1].update(chunk)
+                hashers[2].update(chunk)
+            written += len(chunk)
+    except UnreadablePostError:
+        pass
+    fo.flush()
+    os.fsync(fo.fileno())
+
+    if hashers:
+        _session_hashers[session_id] = (offset + written, hashers[1], hashers[2])
+        while len(_session_hashers) > getattr(settings, 'UPLOAD_SESSION_HASHERS_MAX', 100):
+            del _session_hashers[next(iter(_session_hashers))]
+    return written
+
+
+class SessionUploadedFile(UploadedFile):
+    """
+    completed resumable upload, add_blob moves it into the store like a temporary upload
+    """
+    def __init__(self, session):
+        self.path = get_session_path(session.pk)
+        UploadedFile.__init__(self, open(self.path, 'rb'), session.name, session.content_type, session.length, None)
+        self.hash = None
+        self.sha256 = None
+        hashers = _session_hashers.pop(session.pk, None)
+        if hashers and hashers[0] == session.length:
+            self.hash = hashers[1].hexdigest()
+            self.sha256 = hashers[2].hexdigest()
+
+    def temporary_file_path(self):
+        return self.path
@@ -1,7 +1,7 @@
 # -*- coding: utf-8 -*-
 from django.urls import include, re_path
 from yats.views import root, info, show_board, board_by_id, yatse_api, login, logout, kanban, xptest, robots, autocomplete
-from yats.tickets import new, action, table, search, search_ex, search_simple, reports, workflow, simple, create, log
+from yats.tickets import new, action, table, search, search_ex, search_simple, reports, report_ics, workflow, simple, create, log, upload_session
 from yats.docs import docs_action, docs_new, docs_search, docs_wiki
 from yats.forms import yatsSearchView
 from rpc4django.views import serve_rpc_request
@@ -51,6 +51,10 @@ urlpatterns = [
        view=action,
        name='action'),
 
+   re_path(r'^tickets/upload/(?P<ticket>\d+)/(?P<session>[0-9a-f]{32})/$',
+       view=upload_session,
+       name='upload_session'),
+
    # search
    re_path(r'^search/?$', yatsSearchView.as_view(), name='search_view'),
 
@@ -64,6 +68,10 @@ urlpatterns = [
        view=reports,
        name='reports'),
 
+   re_path(r'^reports/(?P<report>\d+)\.ics$',
+       view=report_ics,
+       name='report_ics'),
+
    # workflow
    re_path(r'^workflow/$',
        view=workflow,
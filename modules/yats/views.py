@@ -1,5 +1,4 @@
 # -*- coding: utf-8 -*-
-from django.apps import apps
 from django.contrib.auth.decorators import login_required
 from django.http.response import HttpResponseRedirect, HttpResponseNotFound, HttpResponse, HttpResponseForbidden, JsonResponse
 from django import get_version as get_django_version
@@ -17,14 +16,13 @@ from django.conf import settings
 from django.utils import translation
 from yats import get_version, get_python_version
 from yats.tickets import table
-from yats.shortcuts import get_ticket_model, add_breadcrumbs, build_ticket_search_ext, convert_sarch
+from yats.shortcuts import get_ticket_model, add_breadcrumbs, get_last_search, build_ticket_search_ext, convert_sarch, get_autocomplete, get_autocomplete_suggestion
 from yats.models import boards, tickets_participants, ticket_flow, ticket_flow_edges, tickets_ignorants, UserProfile
 from yats.forms import AddToBordForm, PasswordForm, TicketCloseForm, TicketReassignForm
 from yats.yatse import api_login, buildYATSFields, YATSSearch
+from yats.middleware.cache import invalidate_seen
 
-from haystack.query import SearchQuerySet
 import datetime
-import locale
 try:
     import json
 except ImportError:
@@ -123,7 +121,7 @@ def show_board(request, name):
                     cd = form.cleaned_data
                     col = {
                            'column': cd['column'],
-                           'query': request.session['last_search'],
+                           'query': get_last_search(request)[0],
                            'limit': cd['limit'],
                            'order_by': cd['order_by'],
                            'order_dir': cd['order_dir']
@@ -231,6 +229,7 @@ def yatse_api(request):
         if 'ticket' in data and 'method' in data:
             if data['method'] == 'notify':
                 tickets_participants.objects.filter(ticket=data['ticket'], user=request.user).update(seen=True)
+                invalidate_seen(request.user)
                 return HttpResponse('OK')
         return HttpResponseNotFound('invalid method\n\n%s' % request.body)
 
@@ -325,43 +324,22 @@ def robots(request):
 
 @login_required
 def autocomplete(request):
-    # for datetime format
-    locale.setlocale(locale.LC_ALL, 'de_DE.UTF-8')
-
-    args = []
     models = request.GET.getlist('models')
-    for model in models:
-        args.append(apps.get_model(model))
-
-    sqs = SearchQuerySet().models(*set(args))
-    # only open tickets in autocomplete
-    sqs = sqs.filter(closed=False)
-    if not request.user.is_staff:
-        sqs = sqs.filter(customer=request.organisation.pk)
-
-    q = request.GET.get('q', '').split(' ')
-    for word in q:
-        word = word.strip()
-        if word:
-            sqs = sqs.filter(content_auto__contains=word)
-
-    if len(models) == 1 and models[0] == 'web.test':
-        sqs = sqs.order_by('-last_action_date')
+    if request.user.is_staff:
+        customer = None
+    else:
+        customer = request.organisation.pk
 
-    result = []
     if 'suggestions' in request.GET:
-        suggestion = sqs.spelling_suggestion()
+        result = []
+        suggestion = get_autocomplete_suggestion(models, request.GET.get('q', ''), customer)
         if suggestion:
             result.append({'caption': suggestion})
+        return JsonResponse(result, safe=False)
 
+    if len(models) == 1 and models[0] == 'web.test':
+        order_by = '-last_action_date'
     else:
-        for ele in sqs:
-            data = {
-                'caption': str(ele.caption),
-                'id': ele.pk
-            }
-            if hasattr(ele, 'closed') and ele.closed:
-                data['closed'] = ele.closed
-            result.append(data)
+        order_by = None
 
-    return JsonResponse(result, safe=False)
+    return JsonResponse(get_autocomplete(models, request.GET.get('q', ''), customer, order_by), safe=False)
@@ -0,0 +1,288 @@
+# -*- coding: utf-8 -*-
+"""
+virus scanning with clamd
+
+with FILE_UPLOAD_VIRUS_SCAN uploads are stored right away, but their blob stays in
+quarantine (file_blobs.scan_state = SCAN_PENDING) until yats.tasks.scan_blob streamed
+it to clamd, run workers with: manage.py process_tasks --queue scans
+every worker keeps up to CLAMD_POOL_SIZE open clamd sessions and sends the file from
+disk with INSTREAM, the upload request never waits for the scan.
+
+CLAMD_ADDRESS = 'localhost:3310' or the path of the unix socket, e.g. '/var/run/clamav/clamd.ctl'
+"""
+from django.conf import settings
+from django.db import transaction
+from django.http import HttpResponse
+from django.utils.translation import gettext as _
+
+from collections import deque
+import logging
+import queue
+import socket
+import struct
+import threading
+import time
+
+logger = logging.getLogger('yats.virusscan')
+
+SCAN_PENDING = 0
+SCAN_CLEAN = 1
+SCAN_INFECTED = 2
+
+_pool = None
+_lock = threading.Lock()
+
+
+def get_setting(name, default):
+    if hasattr(settings, name):
+        return getattr(settings, name)
+    return default
+
+
+def virus_scan_enabled():
+    return bool(get_setting('FILE_UPLOAD_VIRUS_SCAN', False))
+
+
+class ScanError(Exception):
+    pass
+
+
+def parse_address(address):
+    if isinstance(address, (tuple, list)):
+        return socket.AF_INET, tuple(address)
+    if '/' in address:
+        return socket.AF_UNIX, address
+    host, port = address.rsplit(':', 1)
+    return socket.AF_INET, (host, int(port))
+
+
+class ClamdConnection(object):
+    """
+    one clamd session (IDSESSION), several scans over the same socket
+    """
+    def __init__(self, address, timeout):
+        family, self.address = parse_address(address)
+        self.sock = socket.socket(family, socket.SOCK_STREAM)
+        self.sock.settimeout(timeout)
+        try:
+            self.sock.connect(self.address)
+            self.sock.sendall(b'zIDSESSION\0')
+        except OSError:
+            self.sock.close()
+            raise
+        self.ids = 0
+        self.buffer = b''
+
+    def read_reply(self):
+        while b'\0' not in self.buffer:
+            data = self.sock.recv(4096)
+            if not data:
+                raise ConnectionResetError('clamd closed the session')
+            self.buffer += data
+        reply, self.buffer = self.buffer.split(b'\0', 1)
+        return reply.decode('utf-8', 'replace')
+
+    def instream(self, fo, chunk_size):
+        """
+        virus name, None if clean
+        """
+        self.sock.sendall(b'zINSTREAM\0')
+        self.ids += 1
+        while True:
+            chunk = fo.read(chunk_size)
+            if not chunk:
+                break
+            self.sock.sendall(struct.pack('!L', len(chunk)))
+            self.sock.sendall(chunk)
+        self.sock.sendall(struct.pack('!L', 0))
+
+        # 1: stream: OK / 1: stream: Eicar-Signature FOUND / 1: INSTREAM size limit exceeded. ERROR
+        reply_id, _, answer = self.read_reply().partition(': ')
+        if reply_id != str(self.ids):
+            raise ScanError('unexpected clamd reply %s: %s' % (reply_id, answer))
+        if answer.endswith(' FOUND'):
+            return answer[:-len(' FOUND')].split(': ', 1)[-1]
+        if answer.endswith(' OK'):
+            return None
+        raise ScanError(answer)
+
+    def close(self):
+        try:
+            self.sock.sendall(b'zEND\0')
+        except OSError:
+            pass
+        self.sock.close()
+
+
+class ClamdPool(object):
+    def __init__(self, address=None, size=None, timeout=None, chunk_size=None):
+        self.address = address or get_setting('CLAMD_ADDRESS', 'localhost:3310')
+        self.size = size or get_setting('CLAMD_POOL_SIZE', 4)
+        self.timeout = timeout or get_setting('CLAMD_TIMEOUT', 60)
+        self.chunk_size = chunk_size or get_setting('CLAMD_CHUNK_SIZE', 256 * 1024)
+        self.idle = queue.LifoQueue()
+        self.stats_lock = threading.Lock()
+        self.latencies = deque(maxlen=1000)
+        self.scans = 0
+        self.errors = 0
+
+    def acquire(self):
+        try:
+            return self.idle.get_nowait()
+        except queue.Empty:
+            return ClamdConnection(self.address, self.timeout)
+
+    def release(self, conn):
+        if self.idle.qsize() < self.size:
+            self.idle.put(conn)
+        else:
+            conn.close()
+
+    def scan_file(self, path):
+        """
+        virus name, None if clean; ScanError if clamd could not tell
+        """
+        start = time.time()
+        try:
+            for attempt in range(2):
+                reused = not self.idle.empty()
+                try:
+                    conn = self.acquire()
+                except OSError as e:
+                    raise ScanError('unable to connect to clamd at %s: %s' % (self.address, e))
+                try:
+                    with open(path, 'rb') as fo:
+                        virus = conn.instream(fo, self.chunk_size)
+                except ScanError:
+                    conn.close()
+                    raise
+                except OSError as e:
+                    conn.close()
+                    # clamd ends idle sessions after its IdleTimeout, try once more on a new one
+                    if reused and attempt == 0:
+                        continue
+                    raise ScanError('clamd scan of %s failed: %s' % (path, e))
+                self.release(conn)
+                break
+        except ScanError:
+            with self.stats_lock:
+                self.errors += 1
+            raise
+
+        duration = time.time() - start
+        with self.stats_lock:
+            self.scans += 1
+            self.latencies.append(duration)
+        logger.info('scanned %s in %.3fs: %s', path, duration, virus or 'OK')
+        return virus
+
+    def metrics(self):
+        """
+        scan latency of this process, over the last 1000 scans
+        """
+        with self.stats_lock:
+            latencies = sorted(self.latencies)
+            result = {'scans': self.scans, 'errors': self.errors}
+        if latencies:
+            result.update({
+                'avg': sum(latencies) / len(latencies),
+                'p50': latencies[len(latencies) // 2],
+                'p95': latencies[min(int(len(latencies) * 0.95), len(latencies) - 1)],
+                'max': latencies[-1],
+            })
+        return result
+
+    def close(self):
+        while True:
+            try:
+                self.idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+def get_scanner():
+    global _pool
+    with _lock:
+        if _pool is None:
+            _pool = ClamdPool()
+    return _pool
+
+
+def queue_scan(sha256):
+    from yats.tasks import scan_blob
+    transaction.on_commit(lambda: scan_blob(sha256))
+
+
+def check_blob(sha256):
+    """
+    scans a quarantined blob, releases its files or removes them if infected
+    """
+    from yats.models import file_blobs
+    from yats.blobstore import get_blob_path
+
+    try:
+        blob = file_blobs.objects.get(pk=sha256)
+    except file_blobs.DoesNotExist:
+        return None
+    if blob.scan_state != SCAN_PENDING:
+        return blob.scan_state
+
+    virus = get_scanner().scan_file(get_blob_path(sha256))
+    if virus:
+        quarantine_blob(blob, virus)
+        return SCAN_INFECTED
+
+    file_blobs.objects.filter(pk=sha256, scan_state=SCAN_PENDING).update(scan_state=SCAN_CLEAN)
+    from yats.models import tickets_files, docs_files
+    from yats.shortcuts import queue_preview, queue_transcription
+    for model in (tickets_files, docs_files):
+        for f in model.objects.filter(blob=sha256, active_record=True):
+            queue_preview(f)
+            if model is tickets_files:
+                queue_transcription(f)
+    return SCAN_CLEAN
+
+
+def quarantine_blob(blob, virus):
+    from yats.models import file_blobs, tickets_files, docs_files, tickets_history, tickets_comments
+    from yats.blobstore import remove_blob_files
+    import json
+
+    with transaction.atomic():
+        file_blobs.objects.filter(pk=blob.pk).update(scan_state=SCAN_INFECTED, virus=virus[:255])
+        for model in (tickets_files, docs_files):
+            model.objects.filter(blob=blob.pk).update(has_preview=False)
+        for f in tickets_files.objects.filter(blob=blob.pk, active_record=True):
+            f.delete(user_id=f.c_user_id)
+
+            h = tickets_history()
+            h.ticket_id = f.ticket_id
+            h.old = json.dumps({'file': f.name})
+            h.new = json.dumps({'file': ''})
+            h.action = 8
+            h.save(user_id=f.c_user_id)
+
+            com = tickets_comments()
+            com.comment = _('file %(name)s removed, it is infected by virus: %(virus)s') % {'name': f.name, 'virus': virus}
+            com.ticket_id = f.ticket_id
+            com.action = 6
+            com.save(user_id=f.c_user_id)
+
+        for f in docs_files.objects.filter(blob=blob.pk, active_record=True):
+            f.delete(user_id=f.c_user_id)
+
+    logger.warning('blob %s is infected by %s, files removed', blob.pk, virus)
+    remove_blob_files(blob.pk)
+
+
+def quarantine_response(f):
+    """
+    None if the file may be downloaded
+    """
+    if not f.blob_id or f.blob.scan_state == SCAN_CLEAN:
+        return None
+    if f.blob.scan_state == SCAN_INFECTED:
+        return HttpResponse(_('file is infected by virus: %s') % f.blob.virus, status=410)
+    response = HttpResponse(_('file is waiting for the virus scan'), status=503)
+    response['Retry-After'] = '30'
+    return response
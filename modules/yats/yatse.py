@@ -1,13 +1,12 @@
 # -*- coding: utf-8 -*-
-from django.apps import apps
 from django.conf import settings
 from django.http import JsonResponse
 from django.core.exceptions import PermissionDenied
-from django.contrib.auth.models import User
 from django.http.request import QueryDict
 from django.utils import timezone
-from yats.shortcuts import get_ticket_model, modulePathToModuleName, build_ticket_search, clean_search_values
-from yats.models import UserProfile, tickets_participants
+from yats.fieldschema import build_fields, get_field_defs
+from yats.shortcuts import get_api_user, get_ticket_model, build_ticket_search, clean_search_values
+from yats.models import tickets_participants
 from yats.forms import SearchForm
 try:
     import json
@@ -17,50 +16,16 @@ import datetime
 
 def api_login(request):
     if request.META.get('HTTP_API_KEY') == settings.API_KEY and request.META.get('HTTP_API_USER') != '':
-        try:
-            user = User.objects.get(username=request.META.get('HTTP_API_USER'), is_active=True)
-            request.user = user
-            request.organisation = UserProfile.objects.get(user=user).organisation
-        except:
+        user, organisation = get_api_user(request.META.get('HTTP_API_USER') or '')
+        if user is None:
             raise PermissionDenied
+        request.user = user
+        request.organisation = organisation
     else:
         raise PermissionDenied
 
 def buildYATSFields(exclude_list):
-    TracFields = []
-    TicketFields = {}
-    tickets = get_ticket_model()
-    t = tickets()
-    for field in t._meta.fields:
-        if field.name in exclude_list:
-            continue
-
-        if type(field).__name__ == 'ForeignKey':
-            typename = 'select'
-            options = []
-            opts = apps.get_model(modulePathToModuleName(field.rel.to.__module__), field.rel.to.__name__).objects.all()
-            for opt in opts:
-                options.append(str(opt))
-
-            TicketFields[field.name] = (modulePathToModuleName(field.rel.to.__module__), field.rel.to.__name__)
-
-        else:
-            typename = field.__class__.__name__
-
-            # TODO: bool and boolnull and choices
-            options = None
-
-            TicketFields[field.name] = None
-
-        value = {
-                'name': field.name,
-                'label': field.name,
-                'type': typename
-               }
-        if options:
-            value['options'] = options
-        TracFields.append(value)
-    return (TracFields, TicketFields)
+    return (build_fields(exclude_list), get_field_defs())
 
 def YATSSearch(request):
     def ValuesQuerySetToDict(vqs):
@@ -32,13 +32,18 @@ INSTALLED_APPS = [
     'rest_framework',  # Add Django REST Framework
 ]
 
-# Configure haystack with simple backend (no external dependencies)
+# Configure haystack with the database full-text backend (no external dependencies)
 HAYSTACK_CONNECTIONS = {
     'default': {
-        'ENGINE': 'haystack.backends.simple_backend.SimpleEngine',
+        'ENGINE': 'yats.search_backend.DatabaseEngine',
+        'INCLUDE_SPELLING': True,
     },
 }
 
+# saves only queue the changed documents, the background worker re-indexes them
+HAYSTACK_SIGNAL_PROCESSOR = 'yats.signals.QueuedSignalProcessor'
+SEARCH_QUEUE_DELAY = 2
+
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -48,8 +53,17 @@ MIDDLEWARE = [
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'yats.middleware.auth.OrgaAdditionMiddleware',  # Add this
+    'yats.middleware.state.yatsStateMiddleware',
+    'yats.middleware.cache.yatsCacheMiddleware',
 ]
 
+# pages cached per user: path regex, seconds, data shown on the page (tickets, boards, docs)
+CACHE_MIDDLEWARE_URLS = (
+    (r'^tickets/list/$', 60, ('tickets',)),
+    (r'^board/', 60, ('tickets', 'boards')),
+    (r'^kanban/$', 60, ('tickets',)),
+)
+
 ROOT_URLCONF = 'web.urls'
 
 TEMPLATES = [
@@ -110,6 +124,15 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 # File uploads
 FILE_UPLOAD_PATH = BASE_DIR / 'data' / 'files'
+# yats.blobstore.FlatLayout keeps all files in one directory, move existing files with manage.py migrate_file_layout
+FILE_UPLOAD_LAYOUT = 'yats.blobstore.ShardedLayout'
+# let the web server send attachments: 'xsendfile' (apache mod_xsendfile) or 'xaccel' (nginx, internal location below aliasing FILE_UPLOAD_PATH)
+FILE_DOWNLOAD_BACKEND = None
+FILE_DOWNLOAD_ACCEL_ROOT = '/protected-files/'
+# previews: keep libreoffice running in every preview worker (needs python3-uno), conversions are killed after OFFICE_CONVERTER_TIMEOUT seconds
+OFFICE_CONVERTER = True
+OFFICE_CONVERTER_COMMAND = '/usr/bin/soffice'
+OFFICE_CONVERTER_TIMEOUT = 120
 
 # Disable problematic features for development
 # HAYSTACK_CONNECTIONS = {} # This line is now redundant as it's configured in INSTALLED_APPS
@@ -123,6 +146,12 @@ CACHES = {
 
 # Disable virus scanning
 FILE_UPLOAD_VIRUS_SCAN = False
+# clamd for the scan workers (host:port or unix socket path)
+CLAMD_ADDRESS = 'localhost:3310'
+
+# transcription of audio attachments, see yats/transcribe.py
+TRANSCRIPTION_RECOGNIZER = 'yats.transcribe.VoskRecognizer'
+TRANSCRIPTION_VOSK_MODEL = '/usr/share/vosk/vosk-model-small-de-0.15'
 
 # Console email backend
 EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
@@ -155,11 +184,17 @@ GITHUB_PASS = 'hg'
 
 # File upload settings
 FILE_UPLOAD_MAX_MEMORY_SIZE = 2621440  # 2.5 MB
+FILE_UPLOAD_HANDLERS = [
+    # hashes while writing to disk, see yats.uploadhandler
+    'yats.uploadhandler.HashingFileUploadHandler',
+]
 DATA_UPLOAD_MAX_MEMORY_SIZE = 2621440  # 2.5 MB
 
 # Session settings
 SESSION_COOKIE_AGE = 1209600  # 2 weeks
-SESSION_SAVE_EVERY_REQUEST = True
+SESSION_SAVE_EVERY_REQUEST = False
+# active sessions still get a new expiry once a day, see yats.middleware.state
+SESSION_REFRESH_INTERVAL = 86400
 
 # Security settings for development
 SECURE_BROWSER_XSS_FILTER = False
@@ -68,7 +68,8 @@ os.makedirs(log_dir, exist_ok=True)
 # Haystack: keep a minimal default alias so imports work
 HAYSTACK_CONNECTIONS = {
     'default': {
-        'ENGINE': 'haystack.backends.simple_backend.SimpleEngine',
+        'ENGINE': 'yats.search_backend.DatabaseEngine',
+        'INCLUDE_SPELLING': True,
     },
 }
 